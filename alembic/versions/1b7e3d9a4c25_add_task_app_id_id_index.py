@@ -0,0 +1,22 @@
+"""add task app_id id index
+
+Revision ID: 1b7e3d9a4c25
+Revises: 4a2f1c6b8d3e
+Create Date: 2015-01-14 16:20:05.118722
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1b7e3d9a4c25'
+down_revision = '4a2f1c6b8d3e'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('task_app_id_id_idx', 'task', ['app_id', 'id'])
+
+
+def downgrade():
+    op.drop_index('task_app_id_id_idx', 'task')
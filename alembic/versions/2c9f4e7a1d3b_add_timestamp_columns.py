@@ -0,0 +1,47 @@
+"""add timestamp columns
+
+The migration only changes the schema. The new columns are filled from the
+string columns by the backfill_timestamps command of cli.py, in chunks that
+are committed one by one. Run it after deploying the code that keeps the
+columns in sync, so the rows written by the old code meanwhile are filled too.
+
+Revision ID: 2c9f4e7a1d3b
+Revises: 5d1e8a3f2b7c
+Create Date: 2015-01-22 09:41:18.530146
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2c9f4e7a1d3b'
+down_revision = '5d1e8a3f2b7c'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# Timestamp columns, by table
+COLUMNS = {'app': ['updated_at'],
+           'task': ['created_at'],
+           'task_run': ['created_at', 'finished_at']}
+
+
+def upgrade():
+    for table, columns in COLUMNS.items():
+        for column in columns:
+            op.add_column(table, sa.Column(column, sa.DateTime))
+    op.create_index('app_updated_at_idx', 'app', ['updated_at'])
+    op.create_index('task_app_id_created_at_idx', 'task',
+                    ['app_id', 'created_at'])
+    op.create_index('task_run_app_id_finished_at_idx', 'task_run',
+                    ['app_id', 'finished_at'])
+    op.create_index('task_run_finished_at_idx', 'task_run', ['finished_at'])
+
+
+def downgrade():
+    op.drop_index('task_run_finished_at_idx', 'task_run')
+    op.drop_index('task_run_app_id_finished_at_idx', 'task_run')
+    op.drop_index('task_app_id_created_at_idx', 'task')
+    op.drop_index('app_updated_at_idx', 'app')
+    for table, columns in COLUMNS.items():
+        for column in columns:
+            op.drop_column(table, column)
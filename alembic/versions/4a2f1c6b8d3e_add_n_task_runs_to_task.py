@@ -0,0 +1,31 @@
+"""add n_task_runs to task
+
+Revision ID: 4a2f1c6b8d3e
+Revises: 38a8a6299086
+Create Date: 2015-01-12 11:02:41.203114
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4a2f1c6b8d3e'
+down_revision = '38a8a6299086'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('task', sa.Column('n_task_runs', sa.Integer, default=0,
+                                    server_default='0'))
+    query = '''UPDATE task SET n_task_runs=counts.n_task_runs
+               FROM (SELECT task_id, COUNT(id) AS n_task_runs FROM task_run
+                     GROUP BY task_id) AS counts
+               WHERE task.id=counts.task_id;'''
+    op.execute(query)
+    op.create_index('task_app_id_n_task_runs_idx', 'task',
+                    ['app_id', 'n_task_runs', 'id'])
+
+
+def downgrade():
+    op.drop_index('task_app_id_n_task_runs_idx', 'task')
+    op.drop_column('task', 'n_task_runs')
@@ -0,0 +1,45 @@
+"""add app stats rollup tables
+
+Revision ID: 5d1e8a3f2b7c
+Revises: 1b7e3d9a4c25
+Create Date: 2015-01-20 10:12:33.417052
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5d1e8a3f2b7c'
+down_revision = '1b7e3d9a4c25'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'app_stats_day',
+        sa.Column('app_id', sa.Integer,
+                  sa.ForeignKey('app.id', ondelete='CASCADE'),
+                  primary_key=True),
+        sa.Column('day', sa.Date, primary_key=True),
+        sa.Column('n_answers_anon', sa.Integer, server_default='0',
+                  nullable=False),
+        sa.Column('n_answers_auth', sa.Integer, server_default='0',
+                  nullable=False),
+        sa.Column('n_completed_tasks', sa.Integer, server_default='0',
+                  nullable=False),
+    )
+    op.create_table(
+        'app_stats_hour',
+        sa.Column('app_id', sa.Integer,
+                  sa.ForeignKey('app.id', ondelete='CASCADE'),
+                  primary_key=True),
+        sa.Column('hour', sa.Integer, primary_key=True),
+        sa.Column('user_type', sa.Text, primary_key=True),
+        sa.Column('n_answers', sa.Integer, server_default='0', nullable=False),
+    )
+    # The tables are filled with the rebuild_stats_rollups command of cli.py
+
+
+def downgrade():
+    op.drop_table('app_stats_hour')
+    op.drop_table('app_stats_day')
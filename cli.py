@@ -9,6 +9,7 @@ from pybossa.core import db, create_app
 from pybossa.model.app import App
 from pybossa.model.user import User
 from pybossa.model.category import Category
+from pybossa import seen_tasks, stats_rollups, leaderboard
 
 from alembic.config import Config
 from alembic import command
@@ -89,6 +90,70 @@ def markdown_db_migrate():
                 db.engine.execute(query, long_description = new_description, id = old_desc.id)
 
 
+def rebuild_seen_tasks(app_id=None):
+    """Rebuild the index of seen tasks from the task_run table.
+
+    Pass a project id to rebuild only the index of that project.
+    """
+    with app.app_context():
+        n_sets = seen_tasks.rebuild(int(app_id) if app_id else None)
+        print "Rebuilt %s sets of seen tasks" % n_sets
+
+
+def rebuild_stats_rollups(app_id=None):
+    """Rebuild the rollups of the project stats from the task_run table.
+
+    Pass a project id to rebuild only the rollups of that project.
+    """
+    with app.app_context():
+        n_task_runs = stats_rollups.rebuild(int(app_id) if app_id else None)
+        print "Counted %s task runs in the stats rollups" % n_task_runs
+
+
+def backfill_timestamps():
+    """Fill the timestamp columns added by the 2c9f4e7a1d3b migration from
+    their ISO string columns.
+
+    The rows are read in chunks of 10000 ids, committing each chunk, and only
+    the columns that are still empty are filled, so it can be run again.
+    Run it after deploying the code that keeps the columns in sync, and
+    before rebuild_stats_rollups.
+    """
+    chunk = 10000
+    columns = {'app': dict(updated_at='updated'),
+               'task': dict(created_at='created'),
+               'task_run': dict(created_at='created',
+                                finished_at='finish_time')}
+    with app.app_context():
+        for table, table_columns in columns.items():
+            values = ', '.join(
+                "%s=COALESCE(%s, CAST(NULLIF(%s, '') AS TIMESTAMP))"
+                % (column, column, string_column)
+                for column, string_column in table_columns.items())
+            empty = ' OR '.join('%s IS NULL' % column
+                                for column in table_columns)
+            last_id = db.session.execute(
+                text('SELECT MAX(id) FROM %s' % table)).scalar() or 0
+            n_rows = 0
+            for low in range(1, last_id + 1, chunk):
+                sql = text('''UPDATE %s SET %s WHERE id BETWEEN :low AND :high
+                           AND (%s)''' % (table, values, empty))
+                n_rows += db.session.execute(
+                    sql, dict(low=low, high=low + chunk - 1)).rowcount
+                db.session.commit()
+            print "Filled the timestamps of %s rows of %s" % (n_rows, table)
+
+
+def rebuild_leaderboard():
+    """Rebuild the leaderboard of the users from the task_run table."""
+    with app.app_context():
+        n_users = leaderboard.rebuild()
+        if n_users is None:
+            print "The leaderboard is already being rebuilt"
+        else:
+            print "Rebuilt the leaderboard with %s users" % n_users
+
+
 def bootstrap_avatars():
     """Download current links from user avatar and projects to real images hosted in the
     PyBossa server."""
@@ -41,6 +41,7 @@ from itsdangerous import URLSafeSerializer
 from pybossa.ratelimit import ratelimit
 from pybossa.cache.apps import n_tasks
 import pybossa.sched as sched
+from pybossa import task_lease
 from pybossa.error import ErrorStatus
 from global_stats import GlobalStatsAPI
 from task import TaskAPI
@@ -102,13 +103,25 @@ register_api(TokenAPI, 'api_token', '/token', pk='token', pk_type='string')
 @crossdomain(origin='*', headers=cors_headers)
 @ratelimit(limit=ratelimits.get('LIMIT'), per=ratelimits.get('PER'))
 def new_task(app_id):
-    """Return a new task for a project."""
+    """Return a new task for a project.
+
+    If the limit arg is given, return a list with up to limit new tasks
+    (bounded by the MAX_NEWTASK_LIMIT setting) instead.
+
+    """
     # Check if the request has an arg:
     try:
+        if request.args.get('limit'):
+            tasks = _retrieve_new_tasks(app_id, _get_limit())
+            _mark_tasks_as_requested_by_user(tasks, sentinel.master)
+            _lease_tasks(tasks)
+            return Response(json.dumps([task.dictize() for task in tasks]),
+                            mimetype="application/json")
         task = _retrieve_new_task(app_id)
         # If there is a task for the user, return it
         if task is not None:
             _mark_task_as_requested_by_user(task, sentinel.master)
+            _lease_task(task)
             response = make_response(json.dumps(task.dictize()))
             response.mimetype = "application/json"
             return response
@@ -117,6 +130,10 @@ def new_task(app_id):
         return error.format_exception(e, target='app', action='GET')
 
 def _retrieve_new_task(app_id):
+    tasks = _retrieve_new_tasks(app_id, 1)
+    return tasks[0] if tasks else None
+
+def _retrieve_new_tasks(app_id, limit):
     app = project_repo.get(app_id)
     if app is None:
         raise NotFound
@@ -124,21 +141,42 @@ def _retrieve_new_task(app_id):
         info = dict(
             error="This project does not allow anonymous contributors")
         error = model.task.Task(info=info)
-        return error
+        return [error]
     if request.args.get('offset'):
         offset = int(request.args.get('offset'))
     else:
         offset = 0
     user_id = None if current_user.is_anonymous() else current_user.id
     user_ip = request.remote_addr if current_user.is_anonymous() else None
-    task = sched.new_task(app_id, app.info.get('sched'), user_id, user_ip, offset)
-    return task
+    return sched.new_tasks(app_id, app.info.get('sched'), user_id, user_ip,
+                           offset=offset, limit=limit)
+
+def _get_limit():
+    limit = int(request.args.get('limit'))
+    if limit < 1:
+        raise ValueError('limit must be a positive integer')
+    return min(limit, current_app.config.get('MAX_NEWTASK_LIMIT'))
 
 def _mark_task_as_requested_by_user(task, redis_conn):
+    _mark_tasks_as_requested_by_user([task], redis_conn)
+
+def _mark_tasks_as_requested_by_user(tasks, redis_conn):
     usr = get_user_id_or_ip()['user_id'] or get_user_id_or_ip()['user_ip']
-    key = 'pybossa:task_requested:user:%s:task:%s' % (usr, task.id)
     timeout = 60 * 60
-    redis_conn.setex(key, timeout, True)
+    p = redis_conn.pipeline()
+    for task in tasks:
+        key = 'pybossa:task_requested:user:%s:task:%s' % (usr, task.id)
+        p.setex(key, timeout, True)
+    p.execute()
+
+def _lease_task(task):
+    _lease_tasks([task])
+
+def _lease_tasks(tasks):
+    timeout = current_app.config.get('TASK_LEASE_TIMEOUT')
+    task_ids = [task.id for task in tasks if task.id is not None]
+    if timeout and task_ids:
+        task_lease.acquire(task_ids, timeout, **get_user_id_or_ip())
 
 
 @jsonpify
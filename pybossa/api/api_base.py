@@ -66,6 +66,9 @@ class APIBase(MethodView):
     """Class to create CRUD methods."""
 
     hateoas = Hateoas()
+    # Attributes kept by PyBossa itself, which are ignored if a client sends
+    # them (e.g. when it PUTs back an object it has just read)
+    reserved_keys = set()
 
     def valid_args(self):
         """Check if the domain object args are valid."""
@@ -198,7 +201,7 @@ class APIBase(MethodView):
                 action='POST')
 
     def _create_instance_from_request(self, data):
-        data = self.hateoas.remove_links(data)
+        data = self._remove_reserved_keys(self.hateoas.remove_links(data))
         inst = self.__class__(**data)
         self._update_object(inst)
         getattr(require, self.__class__.__name__.lower()).create(inst)
@@ -280,7 +283,7 @@ class APIBase(MethodView):
         data = json.loads(request.data)
         # may be missing the id as we allow partial updates
         data['id'] = id
-        data = self.hateoas.remove_links(data)
+        data = self._remove_reserved_keys(self.hateoas.remove_links(data))
         inst = self.__class__(**data)
         for key in data:
             setattr(existing, key, data[key])
@@ -292,6 +295,13 @@ class APIBase(MethodView):
         return existing
 
 
+    def _remove_reserved_keys(self, data):
+        """Remove the reserved_keys from the data of a request."""
+        for key in self.reserved_keys:
+            data.pop(key, None)
+        return data
+
+
     def _update_object(self, data_dict):
         """Update object.
 
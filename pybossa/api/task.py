@@ -31,3 +31,5 @@ class TaskAPI(APIBase):
     """Class for domain object Task."""
 
     __class__ = Task
+    # Counted by the TaskRun model events
+    reserved_keys = set(['n_task_runs'])
@@ -24,17 +24,43 @@ It exports:
     * memoize: for caching functions using its arguments as part of the key
     * delete_cached: to remove a cached value
     * delete_memoized: to remove a cached value from the memoize decorator
+    * delete_project_memoized: to remove the memoized values of a project
+    * delete_memoized_many: to remove the memoized values of many calls
+    * set_memoized_many: to store precomputed values of many calls
+    * get_counters: stale values served and lock waits, by key prefix
+
+The hits, misses, compute time, size and Redis latency of every cached
+function are recorded by pybossa.cache.metrics, labelled by key prefix.
+
+The values are stored in pybossa.core.cache_sentinel, that spreads them over
+the REDIS_CACHE_MASTERS shards if there are several.
+
+If LOCAL_CACHE_SIZE is set, every worker also keeps the most recently used
+values in memory for LOCAL_CACHE_TIMEOUT seconds, in front of Redis. The
+delete functions publish the keys they remove, so every worker drops them.
+
+Memoized keys are added to a tag set per function, so they can be deleted
+all at once without scanning Redis. If the decorator is told which argument
+holds the project id, the keys also include a version of the project, kept
+in Redis: bumping it invalidates all the values of the project with a single
+INCR, and the old values expire on their own.
+
+Inside a request, every value is read from the cache at most once: the values
+read or stored are kept until the request ends (see get_request_stats).
 
 """
 import os
 import hashlib
+import inspect
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
-from pybossa.core import sentinel
-
-try:
-    import cPickle as pickle
-except ImportError:  # pragma: no cover
-    import pickle
+from flask import _request_ctx_stack
+from rq import Queue
+from pybossa.core import sentinel, cache_sentinel
+from pybossa.cache.local import LocalCache, Listener, apply_invalidation
+from pybossa.cache import serializers, metrics
 
 try:
     import settings_local as settings
@@ -46,6 +72,185 @@ ONE_DAY = 24 * 60 * 60
 ONE_HOUR = 60 * 60
 HALF_HOUR = 30 * 60
 FIVE_MINUTES = 5 * 60
+# Tag sets outlive the keys they index; they only keep growing with the
+# distinct arguments used in this time
+TAG_TIMEOUT = 7 * ONE_DAY
+# Seconds a recomputation may take before another caller can take over, and
+# seconds a caller waits for a value that another one is computing
+LOCK_TIMEOUT = getattr(settings, 'CACHE_LOCK_TIMEOUT', 60)
+LOCK_WAIT = getattr(settings, 'CACHE_LOCK_WAIT', 2)
+LOCK_POLL = 0.1
+
+_local_cache = None
+_local_cache_lock = threading.Lock()
+
+
+def get_local_cache():
+    """Return the in-process cache of this worker, or None if disabled.
+
+    It is created on first use, so every forked worker gets its own cache and
+    invalidation listener.
+
+    """
+    global _local_cache
+    max_size = getattr(settings, 'LOCAL_CACHE_SIZE', 0)
+    if not max_size:
+        return None
+    if _local_cache is None:
+        with _local_cache_lock:
+            if _local_cache is None:
+                local_cache = LocalCache(max_size)
+                Listener(_pubsub_connection, _invalidation_channel(),
+                         local_cache).start()
+                _local_cache = local_cache
+    return _local_cache
+
+
+def _pubsub_connection():
+    # The listener blocks waiting for messages, so it cannot use the
+    # connections of cache_sentinel.master, which time out
+    return cache_sentinel.connection.master_for(
+        cache_sentinel.shards.keys()[0], socket_timeout=None)
+
+
+def _invalidation_channel():
+    return "%s::invalidations" % settings.REDIS_KEYPREFIX
+
+
+def _invalidate(message):
+    """Publish an invalidation of the in-process caches of all workers. It
+    must be called after deleting the keys from Redis, so no worker reads the
+    old value again. The values read by the current request are dropped
+    too."""
+    _forget()
+    local_cache = get_local_cache()
+    if local_cache is not None:
+        apply_invalidation(local_cache, message)
+        cache_sentinel.master.publish(_invalidation_channel(), message)
+        _round_trip()
+
+
+def _request_memo():
+    """Return the memo of the current request, or None outside requests.
+
+    It keeps the values read or stored by the request, as stored in Redis, so
+    every value is read at most once per request, the versions of the projects
+    read, and the number of Redis round trips and of values read from the
+    memo.
+
+    """
+    ctx = _request_ctx_stack.top
+    if ctx is None:
+        return None
+    memo = getattr(ctx, 'pybossa_cache_memo', None)
+    if memo is None:
+        memo = ctx.pybossa_cache_memo = dict(values={}, versions={},
+                                             redis_calls=0, memo_hits=0)
+    return memo
+
+
+def _round_trip(n=1):
+    memo = _request_memo()
+    if memo is not None:
+        memo['redis_calls'] += n
+
+
+def _forget():
+    """Drop the values of the request memo, after deleting cached values."""
+    memo = _request_memo()
+    if memo is not None:
+        memo['values'].clear()
+        memo['versions'].clear()
+
+
+def get_request_stats():
+    """Return the number of Redis round trips of the cache in the current
+    request, and the number of values read from the request memo."""
+    memo = _request_memo() or dict(redis_calls=0, memo_hits=0)
+    return dict(redis_calls=memo['redis_calls'], memo_hits=memo['memo_hits'])
+
+
+def _get(key):
+    """Return the cached value of a key, from the request memo, from memory
+    or from Redis."""
+    memo = _request_memo()
+    if memo is not None and key in memo['values']:
+        memo['memo_hits'] += 1
+        return memo['values'][key]
+    local_cache = get_local_cache()
+    output = None
+    if local_cache is not None:
+        output = local_cache.get(key)
+    if output is None:
+        output = cache_sentinel.shard(key).slave.get(key)
+        _round_trip()
+        if output and local_cache is not None:
+            local_cache.set(key, output,
+                            getattr(settings, 'LOCAL_CACHE_TIMEOUT', 5))
+    if output and memo is not None:
+        memo['values'][key] = output
+    return output
+
+
+def _get_many(keys):
+    """Return the cached values of a list of keys (None for the missing ones),
+    reading with a single MGET the ones that are not in memory."""
+    memo = _request_memo()
+    memo_values = memo['values'] if memo is not None else {}
+    local_cache = get_local_cache()
+    outputs = [memo_values.get(key) for key in keys]
+    if memo is not None:
+        memo['memo_hits'] += len([output for output in outputs if output])
+    if local_cache is not None:
+        outputs = [output or local_cache.get(key)
+                   for key, output in zip(keys, outputs)]
+    missing = [i for i, output in enumerate(outputs) if output is None]
+    missing_keys = [keys[i] for i in missing]
+    for shard, indexes in cache_sentinel.group(missing_keys):
+        values = shard.slave.mget([missing_keys[j] for j in indexes])
+        _round_trip()
+        for j, value in zip(indexes, values):
+            outputs[missing[j]] = value
+            if value and local_cache is not None:
+                local_cache.set(missing_keys[j], value,
+                                getattr(settings, 'LOCAL_CACHE_TIMEOUT', 5))
+    if memo is not None:
+        memo_values.update((key, output) for key, output in zip(keys, outputs)
+                           if output)
+    return outputs
+
+
+def _set(key, timeout, output, tags=()):
+    """Store a value in Redis, and in memory if the local cache is on. The key
+    is added to the given tag sets."""
+    _set_many([(key, timeout, output, tags)])
+
+
+def _set_many(items):
+    """Store a list of (key, timeout, output, tags) with a single pipeline
+    per shard."""
+    if len(items) == 1 and not items[0][3]:
+        key, timeout, output, tags = items[0]
+        cache_sentinel.shard(key).master.setex(key, timeout, output)
+        _round_trip()
+    else:
+        p = cache_sentinel.pipeline()
+        for key, timeout, output, tags in items:
+            p.setex(key, timeout, output)
+            for tag in tags:
+                p.sadd(tag, key)
+                p.expire(tag, max(timeout, TAG_TIMEOUT))
+        p.execute()
+        _round_trip(len(p.pipelines))
+    memo = _request_memo()
+    if memo is not None:
+        memo['values'].update((item[0], item[2]) for item in items)
+    local_cache = get_local_cache()
+    if local_cache is not None:
+        for key, timeout, output, tags in items:
+            local_cache.set(key, output,
+                            min(timeout,
+                                getattr(settings, 'LOCAL_CACHE_TIMEOUT', 5)))
 
 
 def get_key_to_hash(*args, **kwargs):
@@ -67,10 +272,13 @@ def get_hash_key(prefix, key_to_hash):
     return key
 
 
-def cache(key_prefix, timeout=300):
+def cache(key_prefix, timeout=300, stale_timeout=None, background=False,
+          serializer='pickle'):
     """
     Decorator for caching functions.
 
+    See memoize for stale_timeout, background and serializer.
+
     Returns the function value from cache, or the function if cache disabled
 
     """
@@ -80,49 +288,334 @@ def cache(key_prefix, timeout=300):
         @wraps(f)
         def wrapper(*args, **kwargs):
             key = "%s::%s" % (settings.REDIS_KEYPREFIX, key_prefix)
-            if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
-                output = sentinel.slave.get(key)
-                if output:
-                    return pickle.loads(output)
-                output = f(*args, **kwargs)
-                sentinel.master.setex(key, timeout, pickle.dumps(output))
-                return output
-            output = f(*args, **kwargs)
-            sentinel.master.setex(key, timeout, pickle.dumps(output))
-            return output
+            return _cached_call(f, args, kwargs, key, timeout,
+                                stale_timeout=stale_timeout,
+                                background=background, serializer=serializer,
+                                name=key_prefix)
         return wrapper
     return decorator
 
 
-def memoize(timeout=300):
+def function_tag(function):
+    """Return the key of the tag set of a memoized function."""
+    return "%s::tag:function:%s" % (settings.REDIS_KEYPREFIX,
+                                    function.__name__)
+
+
+def project_version_key(project_id):
+    """Return the key of the version of the memoized values of a project."""
+    return "%s::version:project:%s" % (settings.REDIS_KEYPREFIX, project_id)
+
+
+def get_project_versions(project_ids):
+    """Return the versions of the memoized values of a list of projects,
+    reading them with a single MGET. They are read even if the cache is
+    disabled, as the values computed then are stored too.
+
+    Inside a request, every version is read at most once, even if the project
+    has none yet.
+
+    """
+    memo = _request_memo()
+    versions = memo['versions'] if memo is not None else {}
+    missing = [project_id for project_id in set(project_ids)
+               if project_id not in versions]
+    if missing:
+        outputs = _get_many([project_version_key(project_id)
+                             for project_id in missing])
+        read = dict((project_id, int(output or 0))
+                    for project_id, output in zip(missing, outputs))
+        if memo is None:
+            versions = read
+        else:
+            versions.update(read)
+    return [versions[project_id] for project_id in project_ids]
+
+
+def memoize(timeout=300, project_arg=None, stale_timeout=None,
+            background=False, serializer='pickle'):
     """
     Decorator for caching functions using its arguments as part of the key.
 
+    If project_arg is the name of the argument with the project id, the key
+    includes the version of the project, so delete_project_memoized makes
+    all the values of the project unreachable at once.
+
+    The decorated function gets a many method, to read the values of a list
+    of calls at once, and a batch decorator to register a function that
+    computes the values of many calls at once.
+
+    If stale_timeout is given, the value is kept for stale_timeout seconds
+    after it expires. In that time a single caller recomputes it, while the
+    rest get the stale value. If background is True, the value is recomputed
+    by a job in the cache queue instead; only module level functions can be
+    refreshed this way.
+
+    Values are stored with the given serializer ('pickle' or 'json' for the
+    values that JSON can represent), and compressed if they are longer than
+    CACHE_COMPRESS_THRESHOLD bytes.
+
     Returns the cached value, or the function if the cache is disabled
 
     """
     if timeout is None:
         timeout = 300
     def decorator(f):
+        tags = [function_tag(f)]
+        arg_names = inspect.getargspec(f).args
+        project_index = (arg_names.index(project_arg)
+                         if project_arg in arg_names else None)
+
+        def get_project_id(args, kwargs):
+            if project_arg in kwargs:
+                return kwargs[project_arg]
+            if project_index is not None and project_index < len(args):
+                return args[project_index]
+            return inspect.getcallargs(f, *args, **kwargs)[project_arg]
+
+        def get_key(args, kwargs):
+            return get_keys([(args, kwargs)])[0]
+
+        def get_keys(calls):
+            """Return the keys of a list of (args, kwargs) calls, reading the
+            versions of their projects at once."""
+            prefix = "%s:%s_args:" % (settings.REDIS_KEYPREFIX, f.__name__)
+            keys = [get_hash_key(prefix, get_key_to_hash(*args, **kwargs))
+                    for args, kwargs in calls]
+            if project_arg is None:
+                return keys
+            project_ids = [get_project_id(args, kwargs)
+                           for args, kwargs in calls]
+            versions = get_project_versions(project_ids)
+            return ["%s:v%s" % (key, version)
+                    for key, version in zip(keys, versions)]
+
         @wraps(f)
         def wrapper(*args, **kwargs):
-            key = "%s:%s_args:" % (settings.REDIS_KEYPREFIX, f.__name__)
-            key_to_hash = get_key_to_hash(*args, **kwargs)
-            key = get_hash_key(key, key_to_hash)
+            return _cached_call(f, args, kwargs, get_key(args, kwargs),
+                                timeout, tags, stale_timeout, background,
+                                serializer)
+
+        def many(args_list):
+            """Return the values of a list of calls, reading them with a
+            single MGET and storing the missing ones with a single pipeline.
+
+            Every call is a tuple of positional arguments, or a value for
+            functions with a single argument. The missing values are computed
+            by the batch variant of the function if there is one.
+
+            """
+            args_list = [args if isinstance(args, tuple) else (args,)
+                         for args in args_list]
+            if stale_timeout is not None:
+                return [wrapper(*args) for args in args_list]
+            keys = get_keys([(args, {}) for args in args_list])
             if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
-                output = sentinel.slave.get(key)
-                if output:
-                    return pickle.loads(output)
-                output = f(*args, **kwargs)
-                sentinel.master.setex(key, timeout, pickle.dumps(output))
-                return output
-            output = f(*args, **kwargs)
-            sentinel.master.setex(key, timeout, pickle.dumps(output))
-            return output
+                start = time.time()
+                outputs = _get_many(keys)
+                missing = [i for i, output in enumerate(outputs)
+                           if not output]
+                _record(f.__name__, reads=1,
+                        redis_us=(time.time() - start) * 1000000,
+                        hits=len(keys) - len(missing), misses=len(missing))
+            else:
+                outputs = [None] * len(keys)
+                missing = range(len(keys))
+            results = [serializers.loads(output) if output else None
+                       for output in outputs]
+            if not missing:
+                return results
+            start = time.time()
+            if batches:
+                values = batches[0]([args_list[i][0] for i in missing])
+            else:
+                values = [f(*args_list[i]) for i in missing]
+            compute_us = (time.time() - start) * 1000000
+            items = []
+            for i, value in zip(missing, values):
+                results[i] = value
+                items.append((keys[i], timeout, _dumps(value, serializer),
+                              tags))
+            _set_many(items)
+            _record(f.__name__, writes=len(items), compute_us=compute_us,
+                    size=sum(len(item[2]) for item in items))
+            return results
+
+        batches = []
+        def batch(loader):
+            """Register the batch variant of a function with a single
+            argument: it gets a list of values and returns the list of
+            results."""
+            batches[:] = [loader]
+            return loader
+
+        def cache_items(args_list, values):
+            """Return the (key, timeout, output, tags) items that store the
+            values of a list of calls, as many does."""
+            args_list = [args if isinstance(args, tuple) else (args,)
+                         for args in args_list]
+            keys = get_keys([(args, {}) for args in args_list])
+            return [(key, timeout + (stale_timeout or 0),
+                     _dumps(value, serializer), tags)
+                    for key, value in zip(keys, values)]
+
+        wrapper.many = many
+        wrapper.batch = batch
+        wrapper.cache_items = cache_items
+        wrapper.cache_keys = get_keys
         return wrapper
     return decorator
 
 
+def _cached_call(f, args, kwargs, key, timeout, tags=(), stale_timeout=None,
+                 background=False, serializer='pickle', name=None):
+    """Return the cached value of a call to f, computing and storing it if
+    needed. The metrics are recorded with the given name, or the name of
+    f."""
+    name = name or f.__name__
+    if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is not None:
+        return _compute(f, args, kwargs, key, timeout, tags, stale_timeout,
+                        serializer=serializer, name=name)
+    start = time.time()
+    if stale_timeout is None:
+        output = _get(key)
+        fresh = True
+    else:
+        output, fresh = _get_with_freshness(key, stale_timeout)
+    _record(name, reads=1, redis_us=(time.time() - start) * 1000000,
+            hits=int(bool(output)), misses=int(not output))
+    if output and fresh:
+        return serializers.loads(output)
+    if stale_timeout is None:
+        return _compute(f, args, kwargs, key, timeout, tags,
+                        serializer=serializer, name=name)
+    lock = _lock_key(key)
+    if output:
+        if _acquire(lock):
+            if background:
+                _refresh_queue().enqueue('pybossa.jobs.refresh_cached',
+                                         f.__module__, f.__name__,
+                                         args, kwargs, lock)
+            else:
+                return _compute(f, args, kwargs, key, timeout, tags,
+                                stale_timeout, lock, serializer, name)
+        _count(name, 'stale')
+        return serializers.loads(output)
+    if not _acquire(lock):
+        # Someone else is computing it: wait for the value a bit
+        _count(name, 'lock_wait')
+        waited = 0
+        while waited < LOCK_WAIT:
+            time.sleep(LOCK_POLL)
+            waited += LOCK_POLL
+            output = cache_sentinel.shard(key).master.get(key)
+            _round_trip()
+            if output:
+                return serializers.loads(output)
+        lock = None
+    return _compute(f, args, kwargs, key, timeout, tags, stale_timeout, lock,
+                    serializer, name)
+
+
+def _compute(f, args, kwargs, key, timeout, tags=(), stale_timeout=None,
+             lock=None, serializer='pickle', name=None):
+    """Call f and store its value, releasing the lock if given."""
+    try:
+        start = time.time()
+        output = f(*args, **kwargs)
+        compute_us = (time.time() - start) * 1000000
+        data = _dumps(output, serializer)
+        _set(key, timeout + (stale_timeout or 0), data, tags)
+        _record(name or f.__name__, writes=1, compute_us=compute_us,
+                size=len(data))
+        return output
+    finally:
+        if lock is not None:
+            cache_sentinel.shard(lock).master.delete(lock)
+
+
+def _dumps(output, serializer):
+    """Serialize a value to be cached. If CACHE_COMPACT_VALUES is off, every
+    value is stored as a plain pickle, as older versions do."""
+    if not getattr(settings, 'CACHE_COMPACT_VALUES', True):
+        return serializers.dumps(output)
+    return serializers.dumps(output, serializer,
+                             getattr(settings, 'CACHE_COMPRESS_THRESHOLD',
+                                     1024))
+
+
+def _get_with_freshness(key, stale_timeout):
+    """Return the cached value of a key, and whether it has not reached its
+    soft expiration yet."""
+    memo = _request_memo()
+    if memo is not None and key in memo['values']:
+        memo['memo_hits'] += 1
+        return memo['values'][key], True
+    local_cache = get_local_cache()
+    if local_cache is not None:
+        output = local_cache.get(key)
+        if output is not None:
+            return output, True
+    p = cache_sentinel.shard(key).slave.pipeline()
+    p.get(key)
+    p.ttl(key)
+    output, ttl = p.execute()
+    _round_trip()
+    fresh = ttl is not None and ttl > stale_timeout
+    if output and fresh and local_cache is not None:
+        local_cache.set(key, output,
+                        min(ttl - stale_timeout,
+                            getattr(settings, 'LOCAL_CACHE_TIMEOUT', 5)))
+    if output and fresh and memo is not None:
+        memo['values'][key] = output
+    return output, fresh
+
+
+def _record(name, **increments):
+    if getattr(settings, 'CACHE_METRICS', True):
+        metrics.record(name, **increments)
+
+
+def _lock_key(key):
+    return "%s::lock:%s" % (settings.REDIS_KEYPREFIX, key)
+
+
+def _acquire(lock):
+    _round_trip()
+    return bool(cache_sentinel.shard(lock).master.set(lock, 1, nx=True,
+                                                      ex=LOCK_TIMEOUT))
+
+
+def _refresh_queue():
+    return Queue('cache', connection=sentinel.master)
+
+
+def _count(name, counter):
+    _round_trip()
+    cache_sentinel.master.hincrby(_counters_key(), "%s:%s" % (name, counter))
+
+
+def _counters_key():
+    return "%s::counters" % settings.REDIS_KEYPREFIX
+
+
+def get_counters():
+    """Return how many times every function served a stale value ('stale')
+    or waited for another caller to compute it ('lock_wait'). They are
+    labelled as the metrics: by key_prefix for cache and by the name of the
+    function, the prefix of its keys, for memoize."""
+    counters = {}
+    for field, value in cache_sentinel.slave.hgetall(_counters_key()).items():
+        name, counter = field.rsplit(':', 1)
+        counters.setdefault(name, {})[counter] = int(value)
+    return counters
+
+
+def reset_counters():
+    """Reset the stale and lock_wait counters."""
+    cache_sentinel.master.delete(_counters_key())
+
+
 def delete_cached(key):
     """
     Delete a cached value from the cache.
@@ -132,7 +625,10 @@ def delete_cached(key):
     """
     if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
         key = "%s::%s" % (settings.REDIS_KEYPREFIX, key)
-        return bool(sentinel.master.delete(key))
+        deleted = bool(cache_sentinel.shard(key).master.delete(key))
+        _round_trip()
+        _invalidate('key:' + key)
+        return deleted
     return True
 
 
@@ -146,11 +642,102 @@ def delete_memoized(function, *args, **kwargs):
     if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
         key = "%s:%s_args:" % (settings.REDIS_KEYPREFIX, function.__name__)
         if args or kwargs:
-            key_to_hash = get_key_to_hash(*args, **kwargs)
-            key = get_hash_key(key, key_to_hash)
-            return bool(sentinel.master.delete(key))
-        keys_to_delete = sentinel.slave.keys(pattern=key + '*')
-        if not keys_to_delete:
+            key = _memoized_keys(function, [(args, kwargs)])[0]
+            deleted = bool(cache_sentinel.shard(key).master.delete(key))
+            _round_trip()
+            _invalidate('key:' + key)
+            return deleted
+        deleted = _delete_tagged(function_tag(function))
+        _invalidate('prefix:' + key)
+        return deleted
+    return True
+
+
+def delete_project_memoized(project_id):
+    """
+    Delete all the memoized values of a project, bumping its version with a
+    single INCR. The old values are no longer read, and expire on their own.
+
+    Returns True if success or no cache is enabled
+
+    """
+    if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
+        key = project_version_key(project_id)
+        cache_sentinel.shard(key).master.incr(key)
+        _round_trip()
+        _invalidate('key:' + key)
+    return True
+
+
+def delete_memoized_many(calls):
+    """
+    Delete the memoized values of a list of (function, args) calls, with a
+    single pipeline per shard and a single invalidation.
+
+    Returns True if success or no cache is enabled
+
+    """
+    if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
+        keys = []
+        for function, args in calls:
+            keys.extend(_memoized_keys(function, [(args, {})]))
+        if not keys:
             return False
-        return bool(sentinel.master.delete(*keys_to_delete))
+        p = cache_sentinel.pipeline()
+        for key in keys:
+            p.delete(key)
+        deleted = any(p.execute())
+        _round_trip(len(p.pipelines))
+        _invalidate('keys:' + '\n'.join(keys))
+        return deleted
+    return True
+
+
+def set_memoized_many(calls):
+    """
+    Store the values of a list of (function, args, value) calls to memoized
+    functions, with a single pipeline per shard. The values are stored even
+    if the cache is disabled, as computed values are.
+
+    Returns True
+
+    """
+    grouped = OrderedDict()
+    for function, args, value in calls:
+        grouped.setdefault(function, []).append((args, value))
+    items = []
+    for function, function_calls in grouped.items():
+        function_items = function.cache_items(
+            [args for args, value in function_calls],
+            [value for args, value in function_calls])
+        _record(function.__name__, writes=len(function_items),
+                size=sum(len(item[2]) for item in function_items))
+        items.extend(function_items)
+    if items:
+        _set_many(items)
     return True
+
+
+def _memoized_keys(function, calls):
+    """Return the keys of a list of (args, kwargs) calls to a memoized
+    function."""
+    if hasattr(function, 'cache_keys'):
+        return function.cache_keys(calls)
+    key = "%s:%s_args:" % (settings.REDIS_KEYPREFIX, function.__name__)
+    return [get_hash_key(key, get_key_to_hash(*args, **kwargs))
+            for args, kwargs in calls]
+
+
+def _delete_tagged(tag, keys=None):
+    """Delete the keys of a tag set, and the set. Returns True if any of the
+    keys still existed."""
+    if keys is None:
+        keys = cache_sentinel.shard(tag).master.smembers(tag)
+        _round_trip()
+    p = cache_sentinel.pipeline()
+    for key in keys:
+        p.delete(key)
+    p.delete(tag)
+    results = p.execute()
+    _round_trip(len(p.pipelines))
+    return any(results[:-1])
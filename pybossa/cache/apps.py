@@ -22,7 +22,10 @@ from pybossa.model.app import App
 from pybossa.model.task import Task
 from pybossa.model.task_run import TaskRun
 from pybossa.util import pretty_date
-from pybossa.cache import memoize, cache, delete_memoized, delete_cached
+from pybossa import volunteer_counts
+from pybossa.cache import (memoize, cache, delete_memoized, delete_cached,
+                           delete_project_memoized, delete_memoized_many,
+                           set_memoized_many)
 
 import json
 import string
@@ -34,6 +37,7 @@ from datetime import timedelta
 
 session = db.slave_session
 
+# It returns an App instance, that JSON cannot represent, so it is pickled
 @memoize(timeout=timeouts.get('APP_TIMEOUT'))
 def get_app(short_name):
     app = session.query(App).filter_by(short_name=short_name).first()
@@ -41,26 +45,29 @@ def get_app(short_name):
 
 
 @cache(timeout=timeouts.get('STATS_FRONTPAGE_TIMEOUT'),
-       key_prefix="front_page_top_apps")
+       key_prefix="front_page_top_apps", serializer='json')
 def get_top(n=4):
     """Return top n=4 apps"""
     sql = text('''SELECT app.id, app.name, app.short_name, app.description, app.info,
               COUNT(app_id) AS total FROM task_run, app
               WHERE app_id IS NOT NULL AND app.id=app_id AND app.hidden=0
               GROUP BY app.id ORDER BY total DESC LIMIT :limit;''')
-    results = session.execute(sql, dict(limit=n))
+    rows = session.execute(sql, dict(limit=n)).fetchall()
+    app_ids = [row.id for row in rows]
+    stats = zip(n_volunteers.many(app_ids), n_completed_tasks.many(app_ids))
     top_apps = []
-    for row in results:
+    for row, (volunteers, completed_tasks) in zip(rows, stats):
         app = dict(id=row.id, name=row.name, short_name=row.short_name,
                    description=row.description,
                    info=json.loads(row.info),
-                   n_volunteers=n_volunteers(row.id),
-                   n_completed_tasks=n_completed_tasks(row.id))
+                   n_volunteers=volunteers,
+                   n_completed_tasks=completed_tasks)
         top_apps.append(app)
     return top_apps
 
 
-@memoize(timeout=timeouts.get('BROWSE_TASKS_TIMEOUT'))
+@memoize(timeout=timeouts.get('BROWSE_TASKS_TIMEOUT'),
+         project_arg='project_id', serializer='json')
 def browse_tasks(project_id):
     sql = text('''
                SELECT task.id, count(task_run.id) as n_task_runs, task.n_answers
@@ -86,7 +93,7 @@ def _pct_status(n_task_runs, n_answers):
     return float(0)
 
 
-@memoize(timeout=timeouts.get('APP_TIMEOUT'))
+@memoize(timeout=timeouts.get('APP_TIMEOUT'), project_arg='app_id')
 def n_tasks(app_id):
     sql = text('''SELECT COUNT(task.id) AS n_tasks FROM task
                   WHERE task.app_id=:app_id''')
@@ -97,7 +104,16 @@ def n_tasks(app_id):
     return n_tasks
 
 
-@memoize(timeout=timeouts.get('APP_TIMEOUT'))
+@n_tasks.batch
+def _n_tasks_many(app_ids):
+    sql = text('''SELECT task.app_id, COUNT(task.id) AS n_tasks FROM task
+                  WHERE task.app_id = ANY(:app_ids) GROUP BY task.app_id''')
+    results = session.execute(sql, dict(app_ids=app_ids))
+    counts = dict((row.app_id, row.n_tasks) for row in results)
+    return [counts.get(app_id, 0) for app_id in app_ids]
+
+
+@memoize(timeout=timeouts.get('APP_TIMEOUT'), project_arg='app_id')
 def n_completed_tasks(app_id):
     sql = text('''SELECT COUNT(task.id) AS n_completed_tasks FROM task
                 WHERE task.app_id=:app_id AND task.state=\'completed\';''')
@@ -109,8 +125,21 @@ def n_completed_tasks(app_id):
     return n_completed_tasks
 
 
-@memoize(timeout=timeouts.get('REGISTERED_USERS_TIMEOUT'))
+@n_completed_tasks.batch
+def _n_completed_tasks_many(app_ids):
+    sql = text('''SELECT task.app_id, COUNT(task.id) AS n_completed_tasks
+                FROM task WHERE task.app_id = ANY(:app_ids)
+                AND task.state=\'completed\' GROUP BY task.app_id;''')
+    results = session.execute(sql, dict(app_ids=app_ids))
+    counts = dict((row.app_id, row.n_completed_tasks) for row in results)
+    return [counts.get(app_id, 0) for app_id in app_ids]
+
+
+@memoize(timeout=timeouts.get('REGISTERED_USERS_TIMEOUT'),
+         project_arg='app_id')
 def n_registered_volunteers(app_id):
+    if volunteer_counts.enabled():
+        return volunteer_counts.count(volunteer_counts.AUTH, app_id)
     sql = text('''SELECT COUNT(DISTINCT(task_run.user_id)) AS n_registered_volunteers FROM task_run
            WHERE task_run.user_id IS NOT NULL AND
            task_run.user_ip IS NULL AND
@@ -123,8 +152,25 @@ def n_registered_volunteers(app_id):
     return n_registered_volunteers
 
 
-@memoize(timeout=timeouts.get('ANON_USERS_TIMEOUT'))
+@n_registered_volunteers.batch
+def _n_registered_volunteers_many(app_ids):
+    if volunteer_counts.enabled():
+        return volunteer_counts.count_many(volunteer_counts.AUTH, app_ids)
+    sql = text('''SELECT task_run.app_id,
+           COUNT(DISTINCT(task_run.user_id)) AS n_registered_volunteers
+           FROM task_run
+           WHERE task_run.user_id IS NOT NULL AND
+           task_run.user_ip IS NULL AND
+           task_run.app_id = ANY(:app_ids) GROUP BY task_run.app_id;''')
+    results = session.execute(sql, dict(app_ids=app_ids))
+    counts = dict((row.app_id, row.n_registered_volunteers) for row in results)
+    return [counts.get(app_id, 0) for app_id in app_ids]
+
+
+@memoize(timeout=timeouts.get('ANON_USERS_TIMEOUT'), project_arg='app_id')
 def n_anonymous_volunteers(app_id):
+    if volunteer_counts.enabled():
+        return volunteer_counts.count(volunteer_counts.ANON, app_id)
     sql = text('''SELECT COUNT(DISTINCT(task_run.user_ip)) AS n_anonymous_volunteers FROM task_run
            WHERE task_run.user_ip IS NOT NULL AND
            task_run.user_id IS NULL AND
@@ -137,12 +183,34 @@ def n_anonymous_volunteers(app_id):
     return n_anonymous_volunteers
 
 
-@memoize()
+@n_anonymous_volunteers.batch
+def _n_anonymous_volunteers_many(app_ids):
+    if volunteer_counts.enabled():
+        return volunteer_counts.count_many(volunteer_counts.ANON, app_ids)
+    sql = text('''SELECT task_run.app_id,
+           COUNT(DISTINCT(task_run.user_ip)) AS n_anonymous_volunteers
+           FROM task_run
+           WHERE task_run.user_ip IS NOT NULL AND
+           task_run.user_id IS NULL AND
+           task_run.app_id = ANY(:app_ids) GROUP BY task_run.app_id;''')
+    results = session.execute(sql, dict(app_ids=app_ids))
+    counts = dict((row.app_id, row.n_anonymous_volunteers) for row in results)
+    return [counts.get(app_id, 0) for app_id in app_ids]
+
+
+@memoize(project_arg='app_id')
 def n_volunteers(app_id):
     return n_anonymous_volunteers(app_id) + n_registered_volunteers(app_id)
 
 
-@memoize(timeout=timeouts.get('APP_TIMEOUT'))
+@n_volunteers.batch
+def _n_volunteers_many(app_ids):
+    return [anonymous + registered for anonymous, registered in
+            zip(n_anonymous_volunteers.many(app_ids),
+                n_registered_volunteers.many(app_ids))]
+
+
+@memoize(timeout=timeouts.get('APP_TIMEOUT'), project_arg='app_id')
 def n_task_runs(app_id):
     sql = text('''SELECT COUNT(task_run.id) AS n_task_runs FROM task_run
                   WHERE task_run.app_id=:app_id''')
@@ -154,7 +222,7 @@ def n_task_runs(app_id):
     return n_task_runs
 
 
-@memoize(timeout=timeouts.get('APP_TIMEOUT'))
+@memoize(timeout=timeouts.get('APP_TIMEOUT'), project_arg='app_id')
 def overall_progress(app_id):
     """Returns the percentage of submitted Tasks Runs done when a task is
     completed"""
@@ -178,10 +246,31 @@ def overall_progress(app_id):
     return (pct * 100)
 
 
-@memoize(timeout=timeouts.get('APP_TIMEOUT'))
+@overall_progress.batch
+def _overall_progress_many(app_ids):
+    sql = text('''SELECT app_id, SUM(n_answers) AS n_expected_task_runs,
+               SUM(LEAST(n_task_runs, n_answers)) AS n_task_runs
+               FROM (SELECT task.app_id, task.n_answers,
+                     COUNT(task_run.task_id) AS n_task_runs
+                     FROM task LEFT OUTER JOIN task_run
+                     ON task.id=task_run.task_id
+                     WHERE task.app_id = ANY(:app_ids)
+                     GROUP BY task.id) AS tasks
+               GROUP BY app_id''')
+    results = session.execute(sql, dict(app_ids=app_ids))
+    progress = {}
+    for row in results:
+        if row.n_expected_task_runs:
+            progress[row.app_id] = (float(row.n_task_runs) /
+                                    float(row.n_expected_task_runs)) * 100
+    return [progress.get(app_id, float(0)) for app_id in app_ids]
+
+
+@memoize(timeout=timeouts.get('APP_TIMEOUT'), project_arg='app_id')
 def last_activity(app_id):
     sql = text('''SELECT finish_time FROM task_run WHERE app_id=:app_id
-               ORDER BY finish_time DESC LIMIT 1''')
+               AND finished_at IS NOT NULL
+               ORDER BY finished_at DESC LIMIT 1''')
 
     results = session.execute(sql, dict(app_id=app_id))
     for row in results:
@@ -191,6 +280,98 @@ def last_activity(app_id):
             return None
 
 
+@last_activity.batch
+def _last_activity_many(app_ids):
+    sql = text('''SELECT DISTINCT ON (app_id) app_id, finish_time FROM task_run
+               WHERE app_id = ANY(:app_ids) AND finished_at IS NOT NULL
+               ORDER BY app_id, finished_at DESC''')
+    results = session.execute(sql, dict(app_ids=app_ids))
+    finish_times = dict((row.app_id, row.finish_time) for row in results)
+    return [finish_times.get(app_id) for app_id in app_ids]
+
+
+def _listing_stats(app_ids):
+    """Return the last activity, overall progress, number of tasks and number
+    of volunteers of a list of apps, reading the cached values of every stat
+    at once."""
+    return zip(last_activity.many(app_ids), overall_progress.many(app_ids),
+               n_tasks.many(app_ids), n_volunteers.many(app_ids))
+
+
+def warm_counters(app_ids=None):
+    """Compute the counters of a list of apps, or of all of them, and store
+    them in the cache with a single pipeline.
+
+    The task and task run counters of all the apps are computed with a
+    grouped query over each table, instead of a query per app and counter.
+    The overall progress is computed from the task.n_task_runs counters.
+    Returns a dict with the counters of every app, by id.
+
+    """
+    query = session.query(App)
+    if app_ids is not None:
+        query = query.filter(App.id.in_(app_ids))
+    apps = query.all()
+    app_ids = [app.id for app in apps]
+    if not app_ids:
+        return {}
+    counters = dict((app_id, dict(n_tasks=0, n_completed_tasks=0,
+                                  n_task_runs=0, overall_progress=float(0),
+                                  n_registered_volunteers=0,
+                                  n_anonymous_volunteers=0))
+                    for app_id in app_ids)
+    sql = text('''SELECT app_id, COUNT(id) AS n_tasks,
+               COUNT(CASE WHEN state=\'completed\' THEN 1 END)
+               AS n_completed_tasks,
+               SUM(n_answers) AS n_expected_task_runs,
+               SUM(LEAST(n_task_runs, n_answers)) AS n_done_task_runs
+               FROM task WHERE app_id = ANY(:app_ids) GROUP BY app_id''')
+    for row in session.execute(sql, dict(app_ids=app_ids)):
+        app_counters = counters[row.app_id]
+        app_counters['n_tasks'] = row.n_tasks
+        app_counters['n_completed_tasks'] = row.n_completed_tasks
+        if row.n_expected_task_runs:
+            app_counters['overall_progress'] = (
+                float(row.n_done_task_runs) /
+                float(row.n_expected_task_runs)) * 100
+    approximate = volunteer_counts.enabled()
+    volunteers = '''COUNT(DISTINCT CASE WHEN user_ip IS NULL THEN user_id END)
+               AS n_registered_volunteers,
+               COUNT(DISTINCT CASE WHEN user_id IS NULL THEN user_ip END)
+               AS n_anonymous_volunteers,'''
+    sql = text('''SELECT app_id, %s COUNT(id) AS n_task_runs
+               FROM task_run WHERE app_id = ANY(:app_ids)
+               GROUP BY app_id''' % ('' if approximate else volunteers))
+    for row in session.execute(sql, dict(app_ids=app_ids)):
+        app_counters = counters[row.app_id]
+        app_counters['n_task_runs'] = row.n_task_runs
+        if not approximate:
+            app_counters['n_registered_volunteers'] = \
+                row.n_registered_volunteers
+            app_counters['n_anonymous_volunteers'] = \
+                row.n_anonymous_volunteers
+    if approximate:
+        for kind, name in ((volunteer_counts.AUTH, 'n_registered_volunteers'),
+                           (volunteer_counts.ANON, 'n_anonymous_volunteers')):
+            for app_id, n in zip(app_ids,
+                                 volunteer_counts.count_many(kind, app_ids)):
+                counters[app_id][name] = n
+    for app_id, finish_time in zip(app_ids, _last_activity_many(app_ids)):
+        counters[app_id]['last_activity'] = finish_time
+    for app_counters in counters.values():
+        app_counters['n_volunteers'] = (
+            app_counters['n_registered_volunteers'] +
+            app_counters['n_anonymous_volunteers'])
+    calls = [(get_app, (app.short_name,), app) for app in apps]
+    for counter in (n_tasks, n_completed_tasks, n_task_runs, overall_progress,
+                    last_activity, n_registered_volunteers,
+                    n_anonymous_volunteers, n_volunteers):
+        calls += [(counter, (app_id,), counters[app_id][counter.__name__])
+                  for app_id in app_ids]
+    set_memoized_many(calls)
+    return counters
+
+
 # This function does not change too much, so cache it for a longer time
 @cache(timeout=timeouts.get('STATS_FRONTPAGE_TIMEOUT'),
        key_prefix="number_featured_apps")
@@ -205,7 +386,7 @@ def _n_featured():
 
 
 # This function does not change too much, so cache it for a longer time
-@memoize(timeout=timeouts.get('STATS_FRONTPAGE_TIMEOUT'))
+@memoize(timeout=timeouts.get('STATS_FRONTPAGE_TIMEOUT'), serializer='json')
 def get_featured(category=None, page=1, per_page=5):
     """Return a list of featured apps with a pagination"""
     sql = text('''SELECT app.id, app.name, app.short_name, app.info, app.created,
@@ -217,17 +398,18 @@ def get_featured(category=None, page=1, per_page=5):
                ''')
 
     offset = (page - 1) * per_page
-    results = session.execute(sql, dict(limit=per_page, offset=offset))
+    rows = session.execute(sql, dict(limit=per_page, offset=offset)).fetchall()
+    stats = _listing_stats([row.id for row in rows])
     apps = []
-    for row in results:
+    for row, (activity, progress, tasks, volunteers) in zip(rows, stats):
         app = dict(id=row.id, name=row.name, short_name=row.short_name,
                    created=row.created, description=row.description,
-                   last_activity=pretty_date(last_activity(row.id)),
-                   last_activity_raw=last_activity(row.id),
+                   last_activity=pretty_date(activity),
+                   last_activity_raw=activity,
                    owner=row.owner,
-                   overall_progress=overall_progress(row.id),
-                   n_tasks=n_tasks(row.id),
-                   n_volunteers=n_volunteers(row.id),
+                   overall_progress=progress,
+                   n_tasks=tasks,
+                   n_volunteers=volunteers,
                    info=dict(json.loads(row.info)))
         apps.append(app)
     return apps
@@ -267,7 +449,7 @@ def _n_draft():
     return count
 
 
-@memoize(timeout=timeouts.get('STATS_FRONTPAGE_TIMEOUT'))
+@memoize(timeout=timeouts.get('STATS_FRONTPAGE_TIMEOUT'), serializer='json')
 def get_draft(category=None, page=1, per_page=5):
     """Return list of draft projects"""
     sql = text('''SELECT app.id, app.name, app.short_name, app.created,
@@ -280,18 +462,19 @@ def get_draft(category=None, page=1, per_page=5):
                LIMIT :limit;''')
 
     offset = (page - 1) * per_page
-    results = session.execute(sql, dict(limit=per_page, offset=offset))
+    rows = session.execute(sql, dict(limit=per_page, offset=offset)).fetchall()
+    stats = _listing_stats([row.id for row in rows])
     apps = []
-    for row in results:
+    for row, (activity, progress, tasks, volunteers) in zip(rows, stats):
         app = dict(id=row.id, name=row.name, short_name=row.short_name,
                    created=row.created,
                    description=row.description,
                    owner=row.owner,
-                   last_activity=pretty_date(last_activity(row.id)),
-                   last_activity_raw=last_activity(row.id),
-                   overall_progress=overall_progress(row.id),
-                   n_tasks=n_tasks(row.id),
-                   n_volunteers=n_volunteers(row.id),
+                   last_activity=pretty_date(activity),
+                   last_activity_raw=activity,
+                   overall_progress=progress,
+                   n_tasks=tasks,
+                   n_volunteers=volunteers,
                    info=dict(json.loads(row.info)))
         apps.append(app)
     return apps
@@ -324,7 +507,7 @@ def n_count(category):
     return count
 
 
-@memoize(timeout=timeouts.get('APP_TIMEOUT'))
+@memoize(timeout=timeouts.get('APP_TIMEOUT'), serializer='json')
 def get(category, page=1, per_page=5):
     """Return a list of apps with at least one task and a task_presenter
        with a pagination for a given category"""
@@ -343,20 +526,22 @@ def get(category, page=1, per_page=5):
                LIMIT :limit;''')
 
     offset = (page - 1) * per_page
-    results = session.execute(sql, dict(category=category, limit=per_page, offset=offset))
+    rows = session.execute(sql, dict(category=category, limit=per_page,
+                                     offset=offset)).fetchall()
+    stats = _listing_stats([row.id for row in rows])
     apps = []
-    for row in results:
+    for row, (activity, progress, tasks, volunteers) in zip(rows, stats):
         app = dict(id=row.id,
                    name=row.name, short_name=row.short_name,
                    created=row.created,
                    description=row.description,
                    owner=row.owner,
                    featured=row.featured,
-                   last_activity=pretty_date(last_activity(row.id)),
-                   last_activity_raw=last_activity(row.id),
-                   overall_progress=overall_progress(row.id),
-                   n_tasks=n_tasks(row.id),
-                   n_volunteers=n_volunteers(row.id),
+                   last_activity=pretty_date(activity),
+                   last_activity_raw=activity,
+                   overall_progress=progress,
+                   n_tasks=tasks,
+                   n_volunteers=volunteers,
                    info=dict(json.loads(row.info)))
         apps.append(app)
     return apps
@@ -434,14 +619,17 @@ def delete_n_volunteers(app_id):
     delete_memoized(n_volunteers, app_id)
 
 
+def delete_counters(app_ids):
+    """Reset the task and task run counters of a list of apps in cache, at
+    once"""
+    counters = (n_tasks, n_completed_tasks, n_task_runs, overall_progress,
+                last_activity, n_registered_volunteers, n_anonymous_volunteers,
+                n_volunteers, browse_tasks)
+    delete_memoized_many([(counter, (app_id,)) for app_id in app_ids
+                          for counter in counters])
+
+
 def clean(app_id):
     """Clean all items in cache"""
     reset()
-    delete_n_tasks(app_id)
-    delete_n_completed_tasks(app_id)
-    delete_n_task_runs(app_id)
-    delete_overall_progress(app_id)
-    delete_last_activity(app_id)
-    delete_n_registered_volunteers(app_id)
-    delete_n_anonymous_volunteers(app_id)
-    delete_n_volunteers(app_id)
+    delete_project_memoized(app_id)
@@ -20,36 +20,35 @@ from sqlalchemy.sql import text
 from pybossa.core import db, timeouts
 from pybossa.cache import memoize, ONE_HOUR
 from pybossa.cache.apps import overall_progress
+from pybossa import seen_tasks
 
 
 
 session = db.slave_session
 
 
-@memoize(timeout=ONE_HOUR * 3)
+@memoize(timeout=ONE_HOUR * 3, project_arg='app_id')
 def n_available_tasks(app_id, user_id=None, user_ip=None):
     """Returns the number of tasks for a given app a user can contribute to,
     based on the completion of the app tasks, and previous task_runs submitted
-    by the user"""
-    if user_id and not user_ip:
-        query = text('''SELECT COUNT(id) AS n_tasks FROM task WHERE NOT EXISTS
-                       (SELECT task_id FROM task_run WHERE
-                       app_id=:app_id AND user_id=:user_id AND task_id=task.id)
-                       AND app_id=:app_id AND state !='completed';''')
-        result = session.execute(query, dict(app_id=app_id, user_id=user_id))
-    else:
-        if not user_ip:
-            user_ip = '127.0.0.1'
-        query = text('''SELECT COUNT(id) AS n_tasks FROM task WHERE NOT EXISTS
-                       (SELECT task_id FROM task_run WHERE
-                       app_id=:app_id AND user_ip=:user_ip AND task_id=task.id)
-                       AND app_id=:app_id AND state !='completed';''')
-
-        result = session.execute(query, dict(app_id=app_id, user_ip=user_ip))
-    n_tasks = 0
-    for row in result:
-        n_tasks = row.n_tasks
-    return n_tasks
+    by the user (read from the index in pybossa.seen_tasks)"""
+    seen_key = seen_tasks.key(app_id, user_id, user_ip)
+    if seen_tasks.count(seen_key) > seen_tasks.MAX_CHECKED:
+        seen_filter, params = seen_tasks.sql_filter(app_id, user_id, user_ip)
+        query = text('''SELECT COUNT(id) AS n_tasks FROM task
+                       WHERE app_id=:app_id AND state !='completed'
+                       AND %s;''' % seen_filter)
+        params['app_id'] = app_id
+        return session.execute(query, params).scalar()
+    # The open tasks minus the answered ones, looked up by primary key
+    query = text('''SELECT
+                   (SELECT COUNT(id) FROM task WHERE app_id=:app_id
+                    AND state !='completed') -
+                   (SELECT COUNT(id) FROM task WHERE id = ANY(:seen_task_ids)
+                    AND app_id=:app_id AND state !='completed')
+                   AS n_tasks;''')
+    return session.execute(query, dict(
+        app_id=app_id, seen_task_ids=seen_tasks.members(seen_key))).scalar()
 
 
 def check_contributing_state(app, user_id=None, user_ip=None):
@@ -0,0 +1,129 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SF Isle of Man Limited
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Invalidation of the cached counters of projects when their tasks or task
+runs change.
+
+The model events register the projects changed in the session, and their
+counters are deleted from the cache once the transaction commits, all of
+them at once. Nothing is deleted if the transaction is rolled back.
+
+The model events also queue the writes to the Redis indexes kept next to the
+DB (the seen tasks, the task pools, the last answers, the leaderboard and the
+volunteer counters) with on_commit, so they are applied only if the
+transaction commits. As the DB has already committed by then, a call that
+fails is logged and does not stop the others.
+
+Bulk changes, like task imports, are coalesced: once they end, the version of
+every project changed is bumped, which invalidates all its cached values with
+a single INCR.
+
+This module exports:
+    * project_changed: register the project of a changed task or task run
+    * on_commit: call a function once the transaction of a changed object
+      commits
+    * coalesced: context manager that delays the invalidations until it exits,
+      for code that commits many times, like the importers
+
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from pybossa.cache import delete_project_memoized
+
+
+PENDING = 'pybossa_changed_projects'
+PENDING_CALLS = 'pybossa_after_commit_calls'
+
+_deferred = threading.local()
+
+log = logging.getLogger(__name__)
+
+
+def project_changed(target):
+    """Register the project of a task or task run that has been inserted,
+    updated or deleted in the current transaction."""
+    session = object_session(target)
+    if session is None:  # pragma: no cover
+        _invalidate(set([target.app_id]))
+        return
+    session.info.setdefault(PENDING, set()).add(target.app_id)
+
+
+def on_commit(target, function, *args, **kwargs):
+    """Call function with the given arguments once the transaction of target
+    commits. Nothing is called if it is rolled back."""
+    session = object_session(target)
+    if session is None:  # pragma: no cover
+        function(*args, **kwargs)
+        return
+    session.info.setdefault(PENDING_CALLS, []).append((function, args,
+                                                       kwargs))
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    calls = session.info.pop(PENDING_CALLS, None)
+    for function, args, kwargs in calls or []:
+        _call(function, *args, **kwargs)
+    app_ids = session.info.pop(PENDING, None)
+    if app_ids:
+        _call(_invalidate, app_ids)
+
+
+def _call(function, *args, **kwargs):
+    """Call a function queued for after the commit, logging its errors, as
+    raising them would skip the rest of the calls of a transaction that is
+    already committed."""
+    try:
+        function(*args, **kwargs)
+    except Exception:
+        log.exception('%r failed after the commit', function)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop(PENDING, None)
+    session.info.pop(PENDING_CALLS, None)
+
+
+@contextmanager
+def coalesced():
+    """Delay the invalidations of the transactions committed inside the block
+    to its exit, where the versions of the projects changed are bumped."""
+    if getattr(_deferred, 'app_ids', None) is not None:
+        yield
+        return
+    _deferred.app_ids = set()
+    try:
+        yield
+    finally:
+        app_ids, _deferred.app_ids = _deferred.app_ids, None
+        for app_id in app_ids:
+            delete_project_memoized(app_id)
+
+
+def _invalidate(app_ids):
+    if getattr(_deferred, 'app_ids', None) is not None:
+        _deferred.app_ids.update(app_ids)
+        return
+    # pybossa.cache.apps imports the models, that import this module
+    from pybossa.cache import apps as cached_apps
+    cached_apps.delete_counters(app_ids)
@@ -0,0 +1,137 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SF Isle of Man Limited
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+In-process LRU cache used in front of Redis by pybossa.cache.
+
+Every worker keeps the most recently used cached values (as stored in Redis)
+for a few seconds. Invalidations are published on a Redis channel and
+applied by a listener thread in every worker.
+
+This module exports:
+    * LocalCache: a bounded LRU cache with a TTL per entry
+    * Listener: thread applying the published invalidations to a LocalCache
+    * apply_invalidation: apply an invalidation message to a LocalCache
+
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+
+log = logging.getLogger(__name__)
+
+
+class LocalCache(object):
+
+    """Thread safe LRU cache with a maximum number of entries and a TTL."""
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        """Return the value of a key, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                return None
+            # Move it to the end, as the most recently used
+            self._data[key] = entry
+            return value
+
+    def set(self, key, value, timeout):
+        """Store a value for timeout seconds, evicting the least recently used
+        entries if the cache is full."""
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.time() + timeout, value)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class Listener(threading.Thread):
+
+    """Daemon thread that applies the invalidations published on a Redis
+    channel to a LocalCache.
+
+    Messages are 'key:<key>' to drop a key, 'keys:' followed by several keys
+    separated by newlines, 'prefix:<prefix>' to drop all the keys starting
+    with a prefix, or 'all' to empty the cache. If the connection to Redis is
+    lost the whole cache is dropped, as invalidations may have been missed,
+    and the listener subscribes again.
+
+    """
+
+    def __init__(self, get_connection, channel, local_cache, retry=1):
+        super(Listener, self).__init__(name='pybossa-cache-listener')
+        self.daemon = True
+        self.get_connection = get_connection
+        self.channel = channel
+        self.local_cache = local_cache
+        self.retry = retry
+
+    def run(self):  # pragma: no cover
+        while True:
+            try:
+                pubsub = self.get_connection().pubsub()
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        apply_invalidation(self.local_cache, message['data'])
+            except Exception:
+                # The thread has no app context, so current_app.logger is
+                # not available here
+                log.exception('Invalidation listener of %s failed, '
+                              'retrying in %s seconds', self.channel,
+                              self.retry)
+            self.local_cache.clear()
+            time.sleep(self.retry)
+
+
+def apply_invalidation(local_cache, message):
+    """Apply an invalidation message to a local cache."""
+    if message.startswith('key:'):
+        local_cache.delete(message[len('key:'):])
+    elif message.startswith('keys:'):
+        for key in message[len('keys:'):].split('\n'):
+            local_cache.delete(key)
+    elif message.startswith('prefix:'):
+        local_cache.delete_prefix(message[len('prefix:'):])
+    else:
+        local_cache.clear()
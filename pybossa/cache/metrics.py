@@ -0,0 +1,113 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SF Isle of Man Limited
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Metrics of the functions cached by pybossa.cache.
+
+Every worker counts, for every cached function, the hits and misses, the
+time spent computing and storing the values and their serialized size, and
+the time spent reading from Redis. The counters are kept in memory and
+added every few seconds to a Redis hash shared by all the workers.
+
+This module exports:
+    * record: add to the counters of a cached function
+    * flush: add the counters of this worker to Redis
+    * get_all: return the metrics of every cached function
+    * reset: drop all the metrics
+
+"""
+import threading
+import time
+
+
+FIELDS = ('hits', 'misses', 'writes', 'compute_us', 'size', 'reads',
+          'redis_us')
+FLUSH_INTERVAL = 10
+
+_counters = {}
+_lock = threading.Lock()
+_last_flush = [time.time()]
+
+
+def _cache():
+    # pybossa.cache imports this module, so import it when used
+    import pybossa.cache
+    return pybossa.cache
+
+
+def metrics_key():
+    return "%s::metrics" % _cache().settings.REDIS_KEYPREFIX
+
+
+def record(name, **increments):
+    """Add the given increments to the counters of a cached function, and
+    flush them to Redis if they have not been flushed for a while."""
+    with _lock:
+        counters = _counters.setdefault(name, {})
+        for field, increment in increments.items():
+            counters[field] = counters.get(field, 0) + int(increment)
+    if time.time() - _last_flush[0] > FLUSH_INTERVAL:
+        flush()
+
+
+def flush():
+    """Add the counters of this worker to Redis, and reset them."""
+    with _lock:
+        counters = _counters.copy()
+        _counters.clear()
+        _last_flush[0] = time.time()
+    if not counters:
+        return
+    key = metrics_key()
+    p = _cache().cache_sentinel.master.pipeline()
+    for name, fields in counters.items():
+        for field, value in fields.items():
+            p.hincrby(key, '%s:%s' % (name, field), value)
+    p.execute()
+
+
+def get_all():
+    """Return a list of dicts with the metrics of every cached function of
+    all the workers, the ones that spent more time computing values first."""
+    flush()
+    metrics = {}
+    stored = _cache().cache_sentinel.slave.hgetall(metrics_key())
+    for field, value in stored.items():
+        name, field = field.rsplit(':', 1)
+        metrics.setdefault(name, dict.fromkeys(FIELDS, 0))[field] = int(value)
+    out = []
+    for name, entry in metrics.items():
+        calls = entry['hits'] + entry['misses']
+        out.append(dict(name=name,
+                        hits=entry['hits'],
+                        misses=entry['misses'],
+                        hit_ratio=float(entry['hits']) / (calls or 1),
+                        writes=entry['writes'],
+                        compute_ms=entry['compute_us'] / 1000.0,
+                        avg_compute_ms=(entry['compute_us'] / 1000.0 /
+                                        (entry['writes'] or 1)),
+                        avg_size=entry['size'] / (entry['writes'] or 1),
+                        avg_redis_ms=(entry['redis_us'] / 1000.0 /
+                                      (entry['reads'] or 1))))
+    return sorted(out, key=lambda entry: entry['compute_ms'], reverse=True)
+
+
+def reset():
+    """Drop all the metrics, of this worker and in Redis."""
+    with _lock:
+        _counters.clear()
+    _cache().cache_sentinel.master.delete(metrics_key())
@@ -19,7 +19,8 @@
 from flask import current_app
 from sqlalchemy.sql import text
 from pybossa.core import db
-from pybossa.cache import cache, memoize, ONE_DAY
+from pybossa import volunteer_counts, stats_rollups
+from pybossa.cache import cache, memoize, ONE_DAY, ONE_HOUR
 from pybossa.model.task import Task
 from pybossa.model.task_run import TaskRun
 from pybossa.cache import FIVE_MINUTES, memoize
@@ -33,13 +34,13 @@ from datetime import timedelta
 
 session = db.slave_session
 
-@memoize(timeout=ONE_DAY)
+@memoize(timeout=ONE_DAY, project_arg='app_id')
 def n_tasks(app_id):
     from .apps import n_tasks
     return n_tasks(app_id)
 
 
-@memoize(timeout=ONE_DAY)
+@memoize(timeout=ONE_DAY, project_arg='app_id', stale_timeout=ONE_HOUR)
 def stats_users(app_id):
     """Return users's stats for a given app_id"""
     users = {}
@@ -59,14 +60,17 @@ def stats_users(app_id):
     for row in results:
         auth_users.append([row.user_id, row.n_tasks])
 
-    sql = text('''SELECT count(distinct(task_run.user_id)) AS user_id FROM task_run
-               WHERE task_run.user_id IS NOT NULL AND
-               task_run.user_ip IS NULL AND
-               task_run.app_id=:app_id;''')
+    if volunteer_counts.enabled():
+        users['n_auth'] = volunteer_counts.count(volunteer_counts.AUTH, app_id)
+    else:
+        sql = text('''SELECT count(distinct(task_run.user_id)) AS user_id FROM task_run
+                   WHERE task_run.user_id IS NOT NULL AND
+                   task_run.user_ip IS NULL AND
+                   task_run.app_id=:app_id;''')
 
-    results = session.execute(sql, dict(app_id=app_id))
-    for row in results:
-        users['n_auth'] = row[0]
+        results = session.execute(sql, dict(app_id=app_id))
+        for row in results:
+            users['n_auth'] = row[0]
 
     # Get all Anonymous Users
     sql = text('''SELECT task_run.user_ip AS user_ip,
@@ -80,46 +84,66 @@ def stats_users(app_id):
     for row in results:
         anon_users.append([row.user_ip, row.n_tasks])
 
-    sql = text('''SELECT COUNT(DISTINCT(task_run.user_ip)) AS user_ip FROM task_run
-               WHERE task_run.user_ip IS NOT NULL AND
-               task_run.user_id IS NULL AND
-               task_run.app_id=:app_id;''')
+    if volunteer_counts.enabled():
+        users['n_anon'] = volunteer_counts.count(volunteer_counts.ANON, app_id)
+    else:
+        sql = text('''SELECT COUNT(DISTINCT(task_run.user_ip)) AS user_ip FROM task_run
+                   WHERE task_run.user_ip IS NOT NULL AND
+                   task_run.user_id IS NULL AND
+                   task_run.app_id=:app_id;''')
 
-    results = session.execute(sql, dict(app_id=app_id))
+        results = session.execute(sql, dict(app_id=app_id))
 
-    for row in results:
-        users['n_anon'] = row[0]
+        for row in results:
+            users['n_anon'] = row[0]
 
     return users, anon_users, auth_users
 
 
-@memoize(timeout=ONE_DAY)
+@memoize(timeout=ONE_DAY, project_arg='app_id', stale_timeout=ONE_HOUR)
 def stats_dates(app_id):
+    """Return the tasks completed in the last two weeks and the answers of
+    anonymous and authenticated users per day, from the app_stats_day
+    rollup, or from the task runs if the rollup is not complete"""
     dates = {}
     dates_anon = {}
     dates_auth = {}
 
-    total_n_tasks = n_tasks(app_id)
-
-    # Get all completed tasks
-    sql = text('''
-            WITH answers AS (
-                SELECT TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US') AS day, task.id, task.n_answers AS n_answers, COUNT(task_run.id) AS day_answers
-                FROM task_run, task WHERE task_run.app_id=:app_id AND task.id=task_run.task_id and TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US') >= NOW() - '2 week':: INTERVAL GROUP BY day, task.id)
-            SELECT to_char(day_of_completion, 'YYYY-MM-DD') AS day, COUNT(task_id) AS completed_tasks FROM (
-                SELECT MIN(day) AS day_of_completion, task_id FROM (
-                    SELECT ans1.day, ans1.id as task_id, floor(avg(ans1.n_answers)) AS n_answers, sum(ans2.day_answers) AS accum_answers
-                    FROM answers AS ans1 INNER JOIN answers AS ans2
-                    ON ans1.id=ans2.id WHERE ans1.day >= ans2.day
-                    GROUP BY ans1.id, ans1.day) AS answers_day_task
-                WHERE n_answers <= accum_answers
-                GROUP BY task_id) AS completed_tasks_by_day
-            GROUP BY day;
-               ''').execution_options(stream=True)
+    if stats_rollups.complete(app_id, session):
+        sql = text('''SELECT to_char(day, 'YYYY-MM-DD') AS d, n_answers_anon,
+                   n_answers_auth, n_completed_tasks,
+                   day >= NOW() - '2 week'::INTERVAL AS recent
+                   FROM app_stats_day WHERE app_id=:app_id;''')
+    else:
+        # A task is completed by its n_answers-th task run, as in the rollup
+        sql = text('''
+                   WITH answers AS (
+                       SELECT TO_DATE(task_run.finish_time,
+                                      'YYYY-MM-DD\THH24:MI:SS.US') AS day,
+                       task_run.user_id, task.n_answers,
+                       ROW_NUMBER() OVER (PARTITION BY task_run.task_id
+                                          ORDER BY task_run.id) AS n
+                       FROM task_run JOIN task ON task.id=task_run.task_id
+                       WHERE task_run.app_id=:app_id)
+                   SELECT to_char(day, 'YYYY-MM-DD') AS d,
+                   SUM(CASE WHEN user_id IS NULL THEN 1 ELSE 0 END)
+                       AS n_answers_anon,
+                   SUM(CASE WHEN user_id IS NULL THEN 0 ELSE 1 END)
+                       AS n_answers_auth,
+                   SUM(CASE WHEN n=n_answers THEN 1 ELSE 0 END)
+                       AS n_completed_tasks,
+                   day >= NOW() - '2 week'::INTERVAL AS recent
+                   FROM answers GROUP BY day;
+                   ''')
 
     results = session.execute(sql, dict(app_id=app_id))
     for row in results:
-        dates[row.day] = row.completed_tasks
+        if row.recent and row.n_completed_tasks:
+            dates[row.d] = row.n_completed_tasks
+        if row.n_answers_anon:
+            dates_anon[row.d] = row.n_answers_anon
+        if row.n_answers_auth:
+            dates_auth[row.d] = row.n_answers_auth
 
     # No completed tasks in the last 15 days
     if len(dates.keys()) == 0:
@@ -129,43 +153,17 @@ def stats_dates(app_id):
             tmp_date = base - datetime.timedelta(days=x)
             dates[tmp_date.strftime('%Y-%m-%d')] = 0
 
-    # Get all answers per date for auth
-    sql = text('''
-                WITH myquery AS (
-                    SELECT TO_DATE(finish_time, 'YYYY-MM-DD\THH24:MI:SS.US') as d,
-                                   COUNT(id)
-                    FROM task_run WHERE app_id=:app_id AND user_ip IS NULL GROUP BY d)
-               SELECT to_char(d, 'YYYY-MM-DD') as d, count from myquery;
-               ''').execution_options(stream=True)
-
-    results = session.execute(sql, dict(app_id=app_id))
-    for row in results:
-        dates_auth[row.d] = row.count
-
-    # Get all answers per date for anon
-    sql = text('''
-                WITH myquery AS (
-                    SELECT TO_DATE(finish_time, 'YYYY-MM-DD\THH24:MI:SS.US') as d,
-                                   COUNT(id)
-                    FROM task_run WHERE app_id=:app_id AND user_id IS NULL GROUP BY d)
-               SELECT to_char(d, 'YYYY-MM-DD') as d, count  from myquery;
-               ''').execution_options(stream=True)
-
-    results = session.execute(sql, dict(app_id=app_id))
-    for row in results:
-        dates_anon[row.d] = row.count
-
     return dates, dates_anon, dates_auth
 
 
-@memoize(timeout=ONE_DAY)
+@memoize(timeout=ONE_DAY, project_arg='app_id', stale_timeout=ONE_HOUR)
 def stats_hours(app_id):
+    """Return the answers of all, anonymous and authenticated users per hour
+    of the day, and their maximums, from the app_stats_hour rollup, or from
+    the task runs if the rollup is not complete"""
     hours = {}
     hours_anon = {}
     hours_auth = {}
-    max_hours = 0
-    max_hours_anon = 0
-    max_hours_auth = 0
 
     # initialize hours keys
     for i in range(0, 24):
@@ -173,110 +171,42 @@ def stats_hours(app_id):
         hours_anon[str(i).zfill(2)] = 0
         hours_auth[str(i).zfill(2)] = 0
 
-    # Get hour stats for all users
-    sql = text('''
-               WITH myquery AS
-                (SELECT to_char(
-                    DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                    ),
-                    'HH24') AS h, COUNT(id)
-                    FROM task_run WHERE app_id=:app_id GROUP BY h)
-               SELECT h, count from myquery;
-               ''').execution_options(stream=True)
+    if stats_rollups.complete(app_id, session):
+        sql = text('''SELECT hour, user_type, n_answers FROM app_stats_hour
+                   WHERE app_id=:app_id AND n_answers > 0;''')
+    else:
+        sql = text('''
+                   SELECT CAST(EXTRACT(HOUR FROM TO_TIMESTAMP(finish_time,
+                               'YYYY-MM-DD"T"HH24:MI:SS.US')) AS INTEGER)
+                       AS hour,
+                   CASE WHEN user_id IS NULL THEN 'anon' ELSE 'auth' END
+                       AS user_type,
+                   COUNT(id) AS n_answers
+                   FROM task_run WHERE app_id=:app_id
+                   GROUP BY hour, user_type;
+                   ''')
 
     results = session.execute(sql, dict(app_id=app_id))
-
-    for row in results:
-        hours[row.h] = row.count
-
-    # Get maximum stats for all users
-    sql = text('''
-               WITH myquery AS
-                (SELECT to_char(
-                    DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                    ),
-                    'HH24') AS h, COUNT(id)
-                    FROM task_run WHERE app_id=:app_id GROUP BY h)
-               SELECT max(count) from myquery;
-               ''').execution_options(stream=True)
-
-    results = session.execute(sql, dict(app_id=app_id))
-    for row in results:
-        max_hours = row.max
-
-    # Get hour stats for Anonymous users
-    sql = text('''
-               WITH myquery AS
-                (SELECT to_char(
-                    DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                    ),
-                    'HH24') AS h, COUNT(id)
-                    FROM task_run WHERE app_id=:app_id AND user_id IS NULL GROUP BY h)
-               SELECT h, count from myquery;
-               ''').execution_options(stream=True)
-
-    results = session.execute(sql, dict(app_id=app_id))
-
-    for row in results:
-        hours_anon[row.h] = row.count
-
-    # Get maximum stats for Anonymous users
-    sql = text('''
-               WITH myquery AS
-                (SELECT to_char(
-                    DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                    ),
-                    'HH24') AS h, COUNT(id)
-                    FROM task_run WHERE app_id=:app_id AND user_id IS NULL GROUP BY h)
-               SELECT max(count) from myquery;
-               ''').execution_options(stream=True)
-
-    results = session.execute(sql, dict(app_id=app_id))
-    for row in results:
-        max_hours_anon = row.max
-
-
-    # Get hour stats for Auth users
-    sql = text('''
-               WITH myquery AS
-                (SELECT to_char(
-                    DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                    ),
-                    'HH24') AS h, COUNT(id)
-                    FROM task_run WHERE app_id=:app_id AND user_ip IS NULL GROUP BY h)
-               SELECT h, count from myquery;
-               ''').execution_options(stream=True)
-
-    results = session.execute(sql, dict(app_id=app_id))
-
+    answered = set()
     for row in results:
-        hours_auth[row.h] = row.count
-
-    # Get hour stats for Anon users
-    sql = text('''
-               WITH myquery AS
-                (SELECT to_char(
-                    DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                    ),
-                    'HH24') AS h, COUNT(id)
-                    FROM task_run WHERE app_id=:app_id AND user_ip IS NULL GROUP BY h)
-               SELECT max(count) from myquery;
-               ''').execution_options(stream=True)
+        h = str(row.hour).zfill(2)
+        answered.add(h)
+        hours[h] += row.n_answers
+        if row.user_type == 'anon':
+            hours_anon[h] = row.n_answers
+        else:
+            hours_auth[h] = row.n_answers
 
-    results = session.execute(sql, dict(app_id=app_id))
-    for row in results:
-        max_hours_auth = row.max
+    # The maximums are None if there are no answers, as MAX in SQL
+    def maximum(values):
+        values = [values[h] for h in answered if values[h]]
+        return max(values) if values else None
 
-    return hours, hours_anon, hours_auth, max_hours, max_hours_anon, max_hours_auth
+    return hours, hours_anon, hours_auth, maximum(hours), \
+        maximum(hours_anon), maximum(hours_auth)
 
 
-@memoize(timeout=ONE_DAY)
+@memoize(timeout=ONE_DAY, project_arg='app_id')
 def stats_format_dates(app_id, dates, dates_anon, dates_auth):
     """Format dates stats into a JSON format"""
     dayNewStats = dict(label="Anon + Auth",   values=[])
@@ -317,7 +247,7 @@ def stats_format_dates(app_id, dates, dates_anon, dates_auth):
         dayCompletedTasks, dayTotalTasks
 
 
-@memoize(timeout=ONE_DAY)
+@memoize(timeout=ONE_DAY, project_arg='app_id')
 def stats_format_hours(app_id, hours, hours_anon, hours_auth,
                        max_hours, max_hours_anon, max_hours_auth):
     """Format hours stats into a JSON format"""
@@ -358,7 +288,7 @@ def stats_format_hours(app_id, hours, hours_anon, hours_auth,
     return hourNewStats, hourNewAnonStats, hourNewAuthStats
 
 
-@memoize(timeout=ONE_DAY)
+@memoize(timeout=ONE_DAY, project_arg='app_id')
 def stats_format_users(app_id, users, anon_users, auth_users, geo=False):
     """Format User Stats into JSON"""
     userStats = dict(label="User Statistics", values=[])
@@ -422,7 +352,7 @@ def stats_format_users(app_id, users, anon_users, auth_users, geo=False):
                 n_anon=users['n_anon'], n_auth=users['n_auth'])
 
 
-@memoize(timeout=ONE_DAY)
+@memoize(timeout=ONE_DAY, project_arg='app_id')
 def get_stats(app_id, geo=False):
     """Return the stats of a given app"""
     hours, hours_anon, hours_auth, max_hours, \
@@ -0,0 +1,71 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SF Isle of Man Limited
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Serializers for the values stored by pybossa.cache.
+
+Values are stored with a marker of their format: a null byte, the code of
+the serializer and whether they are compressed with zlib. Values without
+the marker are plain pickles, as stored by older versions, and they are
+also used for uncompressed pickles so older versions can still read them.
+
+This module exports:
+    * dumps: serialize a value with one of the SERIALIZERS
+    * loads: deserialize a value stored in any of the formats
+
+"""
+import json
+import zlib
+
+try:
+    import cPickle as pickle
+except ImportError:  # pragma: no cover
+    import pickle
+
+
+MARKER = '\x00'
+COMPRESSED = 'z'
+UNCOMPRESSED = '-'
+# Name: (code, dumps, loads)
+SERIALIZERS = {
+    'pickle': ('p', lambda value: pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+               lambda data: pickle.loads(data)),
+    'json': ('j', lambda value: json.dumps(value, separators=(',', ':')),
+             lambda data: json.loads(data))}
+LOADERS = dict((code, loads) for code, dumps, loads in SERIALIZERS.values())
+
+
+def dumps(value, serializer='pickle', compress_threshold=None):
+    """Serialize a value, compressing it if it is longer than
+    compress_threshold bytes."""
+    code, dump, load = SERIALIZERS[serializer]
+    data = dump(value)
+    if compress_threshold is not None and len(data) > compress_threshold:
+        return MARKER + code + COMPRESSED + zlib.compress(data)
+    if serializer == 'pickle':
+        return data
+    return MARKER + code + UNCOMPRESSED + data
+
+
+def loads(data):
+    """Deserialize a value stored by dumps."""
+    if not data.startswith(MARKER):
+        return pickle.loads(data)
+    code, flag, data = data[1], data[2], data[3:]
+    if flag == COMPRESSED:
+        data = zlib.decompress(data)
+    return LOADERS[code](data)
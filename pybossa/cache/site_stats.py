@@ -22,7 +22,8 @@ from sqlalchemy.sql import text
 from flask import current_app
 
 from pybossa.core import db
-from pybossa.cache import cache, ONE_DAY
+from pybossa import volunteer_counts
+from pybossa.cache import cache, ONE_DAY, ONE_HOUR
 
 session = db.slave_session
 
@@ -37,6 +38,8 @@ def n_auth_users():
 
 @cache(timeout=ONE_DAY, key_prefix="site_n_anon_users")
 def n_anon_users():
+    if volunteer_counts.enabled():
+        return volunteer_counts.count(volunteer_counts.ANON)
     sql = text('''SELECT COUNT(DISTINCT(task_run.user_ip))
                AS n_anon FROM task_run;''')
 
@@ -73,15 +76,16 @@ def n_task_runs_site():
     return n_task_runs or 0
 
 
-@cache(timeout=ONE_DAY, key_prefix="site_top5_apps_24_hours")
+@cache(timeout=ONE_DAY, key_prefix="site_top5_apps_24_hours",
+       stale_timeout=ONE_HOUR)
 def get_top5_apps_24_hours():
     # Top 5 Most active apps in last 24 hours
     sql = text('''SELECT app.id, app.name, app.short_name, app.info,
                COUNT(task_run.app_id) AS n_answers FROM app, task_run
                WHERE app.id=task_run.app_id
                AND app.hidden=0
-               AND DATE(task_run.finish_time) > NOW() - INTERVAL '24 hour'
-               AND DATE(task_run.finish_time) <= NOW()
+               AND task_run.finished_at > (NOW() AT TIME ZONE 'UTC')
+                                          - INTERVAL '24 hour'
                GROUP BY app.id
                ORDER BY n_answers DESC LIMIT 5;''')
 
@@ -94,14 +98,15 @@ def get_top5_apps_24_hours():
     return top5_apps_24_hours
 
 
-@cache(timeout=ONE_DAY, key_prefix="site_top5_users_24_hours")
+@cache(timeout=ONE_DAY, key_prefix="site_top5_users_24_hours",
+       stale_timeout=ONE_HOUR)
 def get_top5_users_24_hours():
     # Top 5 Most active users in last 24 hours
     sql = text('''SELECT "user".id, "user".fullname, "user".name,
                COUNT(task_run.app_id) AS n_answers FROM "user", task_run
                WHERE "user".id=task_run.user_id
-               AND DATE(task_run.finish_time) > NOW() - INTERVAL '24 hour'
-               AND DATE(task_run.finish_time) <= NOW()
+               AND task_run.finished_at > (NOW() AT TIME ZONE 'UTC')
+                                          - INTERVAL '24 hour'
                GROUP BY "user".id
                ORDER BY n_answers DESC LIMIT 5;''')
 
@@ -115,7 +120,8 @@ def get_top5_users_24_hours():
     return top5_users_24_hours
 
 
-@cache(timeout=ONE_DAY, key_prefix="site_locs")
+@cache(timeout=ONE_DAY, key_prefix="site_locs", stale_timeout=ONE_HOUR,
+       background=True)
 def get_locs(): # pragma: no cover
     # All IP addresses from anonymous users to create a map
     locs = []
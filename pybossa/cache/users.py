@@ -17,6 +17,7 @@
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 from sqlalchemy.sql import text
 from pybossa.core import db, timeouts
+from pybossa import leaderboard
 from pybossa.cache import cache, memoize, delete_memoized
 from pybossa.util import pretty_date
 from pybossa.model.user import User
@@ -28,73 +29,35 @@ session = db.slave_session
 
 @memoize(timeout=timeouts.get('USER_TIMEOUT'))
 def get_leaderboard(n, user_id):
-    """Return the top n users with their rank."""
-    sql = text('''
-               WITH global_rank AS (
-                    WITH scores AS (
-                        SELECT user_id, COUNT(*) AS score FROM task_run
-                        WHERE user_id IS NOT NULL GROUP BY user_id)
-                    SELECT user_id, score, rank() OVER (ORDER BY score desc)
-                    FROM scores)
-               SELECT rank, id, name, fullname, email_addr, info, score FROM global_rank
-               JOIN public."user" on (user_id=public."user".id) ORDER BY rank
-               LIMIT :limit;
-               ''')
-
-    results = session.execute(sql, dict(limit=n))
-
+    """Return the top n users with their rank, and the user with user_id if
+    they are not in the top n."""
+    ranks = leaderboard.top(n)
+    if user_id != 'anonymous' and user_id not in [r[0] for r in ranks]:
+        rank, score = leaderboard.rank_and_score(user_id)
+        # Users with no task runs are shown with no rank
+        ranks.append((user_id, rank or -1, score or -1))
+    users = _get_users([r[0] for r in ranks])
     top_users = []
-    user_in_top = False
-    for row in results:
-        if (row.id == user_id):
-            user_in_top = True
-        user=dict(
-            rank=row.rank,
-            id=row.id,
-            name=row.name,
-            fullname=row.fullname,
-            email_addr=row.email_addr,
-            info=dict(json.loads(row.info)),
-            score=row.score)
-        top_users.append(user)
-    if (user_id != 'anonymous'):
-        if not user_in_top:
-            sql = text('''
-                       WITH global_rank AS (
-                            WITH scores AS (
-                                SELECT user_id, COUNT(*) AS score FROM task_run
-                                WHERE user_id IS NOT NULL GROUP BY user_id)
-                            SELECT user_id, score, rank() OVER (ORDER BY score desc)
-                            FROM scores)
-                       SELECT rank, id, name, fullname, email_addr, info, score FROM global_rank
-                       JOIN public."user" on (user_id=public."user".id)
-                       WHERE user_id=:user_id ORDER BY rank;
-                       ''')
-            user_rank = session.execute(sql, dict(user_id=user_id))
-            u = User.query.get(user_id)
-            # Load by default user data with no rank
-            user=dict(
-                rank=-1,
-                id=u.id,
-                name=u.name,
-                fullname=u.fullname,
-                email_addr=u.email_addr,
-                info=u.info,
-                score=-1)
-            for row in user_rank: # pragma: no cover
-                user=dict(
-                    rank=row.rank,
-                    id=row.id,
-                    name=row.name,
-                    fullname=row.fullname,
-                    email_addr=row.email_addr,
-                    info=dict(json.loads(row.info)),
-                    score=row.score)
-            top_users.append(user)
-
+    for uid, rank, score in ranks:
+        if uid in users:
+            top_users.append(dict(users[uid], rank=rank, score=score))
     return top_users
 
 
+def _get_users(user_ids):
+    """Return a dict with the details of the users with the given ids."""
+    if not user_ids:
+        return {}
+    sql = text('''SELECT id, name, fullname, email_addr, info FROM "user"
+               WHERE id = ANY(:user_ids);''')
+    results = session.execute(sql, dict(user_ids=user_ids))
+    return dict((row.id, dict(id=row.id, name=row.name,
+                              fullname=row.fullname,
+                              email_addr=row.email_addr,
+                              info=dict(json.loads(row.info))))
+                for row in results)
+
+
 @cache(key_prefix="front_page_top_users",
        timeout=timeouts.get('USER_TOP_TIMEOUT'))
 def get_top(n=10):
@@ -147,24 +110,9 @@ def get_user_summary(name):
         return None
 
 
-@memoize(timeout=timeouts.get('USER_TIMEOUT'))
 def rank_and_score(user_id):
-    # See: https://gist.github.com/tokumine/1583695
-    sql = text('''
-               WITH global_rank AS (
-                    WITH scores AS (
-                        SELECT user_id, COUNT(*) AS score FROM task_run
-                        WHERE user_id IS NOT NULL GROUP BY user_id)
-                    SELECT user_id, score, rank() OVER (ORDER BY score desc)
-                    FROM scores)
-               SELECT * from global_rank WHERE user_id=:user_id;
-               ''')
-    results = session.execute(sql, dict(user_id=user_id))
-    rank_and_score = dict(rank=None, score=None)
-    for row in results:
-        rank_and_score['rank'] = row.rank
-        rank_and_score['score'] = row.score
-    return rank_and_score
+    rank, score = leaderboard.rank_and_score(user_id)
+    return dict(rank=rank, score=score)
 
 
 def apps_contributed(user_id):
@@ -56,6 +56,7 @@ def create_app(run_as_server=True):
     setup_exporter(app)
     mail.init_app(app)
     sentinel.init_app(app)
+    cache_sentinel.init_app(app)
     signer.init_app(app)
     if app.config.get('SENTRY_DSN'): # pragma: no cover
         sentr = Sentry(app)
@@ -343,6 +344,16 @@ def setup_hooks(app):
             h.add('X-RateLimit-Reset', str(limit.reset))
         return response
 
+    @app.after_request
+    def inject_x_cache_headers(response):
+        if app.config.get('CACHE_DEBUG_HEADERS'):
+            from pybossa.cache import get_request_stats
+            stats = get_request_stats()
+            response.headers.add('X-Cache-Redis-Calls',
+                                 str(stats['redis_calls']))
+            response.headers.add('X-Cache-Memo-Hits', str(stats['memo_hits']))
+        return response
+
     @app.before_request
     def api_authentication():
         """ Attempt API authentication on a per-request basis."""
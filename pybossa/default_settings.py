@@ -50,6 +50,10 @@ UPLOAD_METHOD = 'local'
 ## Default number of users shown in the leaderboard
 LEADERBOARD = 20
 
+## Count the distinct volunteers of the projects and the site with Redis
+## HyperLogLogs (about 1% error) instead of COUNT(DISTINCT) queries
+APPROXIMATE_VOLUNTEER_COUNTS = False
+
 ## Default configuration for debug toolbar
 ENABLE_DEBUG_TOOLBAR = False
 
@@ -57,8 +61,29 @@ ENABLE_DEBUG_TOOLBAR = False
 REDIS_CACHE_ENABLED = False
 REDIS_SENTINEL = [('localhost', 26379)]
 REDIS_MASTER = 'mymaster'
+# Masters of the cache shards, and their Sentinel servers (REDIS_SENTINEL if
+# None). If there are none, the cache uses REDIS_MASTER too
+REDIS_CACHE_MASTERS = []
+REDIS_CACHE_SENTINEL = None
 
 REDIS_KEYPREFIX = 'pybossa_cache'
+# In-process cache in front of Redis: max number of values kept by every
+# worker (0 disables it) and for how many seconds
+LOCAL_CACHE_SIZE = 0
+LOCAL_CACHE_TIMEOUT = 5
+# Values with a stale timeout are recomputed by a single caller: seconds it
+# keeps the lock, and seconds the rest wait for a value that is not cached
+CACHE_LOCK_TIMEOUT = 60
+CACHE_LOCK_WAIT = 2
+# Store the cached values with a format marker, compressing the ones longer
+# than CACHE_COMPRESS_THRESHOLD bytes
+CACHE_COMPACT_VALUES = True
+CACHE_COMPRESS_THRESHOLD = 1024
+# Record the hits, misses and timings of the cached functions (see
+# /admin/cache)
+CACHE_METRICS = True
+# Add the X-Cache-Redis-Calls and X-Cache-Memo-Hits headers to the responses
+CACHE_DEBUG_HEADERS = False
 
 ## Default cache timeouts
 # App cache
@@ -82,6 +107,13 @@ PRESENTERS = ["basic", "image", "sound", "video", "map", "pdf"]
 LIMIT = 300
 PER = 15 * 60
 
+# Expiration time for the task leases given by the /newtask API endpoint, so
+# tasks are not sent to more volunteers than needed. They are disabled by
+# default, as they change which tasks the schedulers return
+TASK_LEASE_TIMEOUT = 0
+# Maximum number of tasks returned by a single /newtask?limit=N API request
+MAX_NEWTASK_LIMIT = 20
+
 # Expiration time for password protected project cookies
 PASSWD_COOKIE_TIMEOUT = 60 * 30
 
@@ -2,7 +2,8 @@
 This module exports all the extensions used by PyBossa.
 
 The objects are:
-    * sentinel: for caching data, ratelimiting, etc.
+    * sentinel: for ratelimiting, feeds, queues, etc.
+    * cache_sentinel: the Redis shards for caching data
     * signer: for signing emails, cookies, etc.
     * mail: for sending emails,
     * login_manager: to handle account sigin/signout
@@ -17,14 +18,16 @@ The objects are:
     * newsletter: for subscribing users to Mailchimp newsletter
 
 """
-__all__ = ['sentinel', 'db', 'signer', 'mail', 'login_manager', 'facebook',
-           'twitter', 'google', 'misaka', 'babel', 'gravatar', 'uploader',
-           'csrf', 'timeouts', 'debug_toolbar', 'ratelimits', 'queues',
-           'user_repo', 'project_repo', 'task_repo', 'blog_repo', 'newsletter']
+__all__ = ['sentinel', 'cache_sentinel', 'db', 'signer', 'mail',
+           'login_manager', 'facebook', 'twitter', 'google', 'misaka', 'babel',
+           'gravatar', 'uploader', 'csrf', 'timeouts', 'debug_toolbar',
+           'ratelimits', 'queues', 'user_repo', 'project_repo', 'task_repo',
+           'blog_repo', 'newsletter']
 
 # CACHE
-from pybossa.sentinel import Sentinel
+from pybossa.sentinel import Sentinel, ShardedSentinel
 sentinel = Sentinel()
+cache_sentinel = ShardedSentinel()
 
 # DB
 from flask.ext.sqlalchemy import SQLAlchemy
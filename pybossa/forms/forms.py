@@ -94,6 +94,7 @@ class TaskSchedulerForm(Form):
                         choices=[('default', lazy_gettext('Default')),
                                  ('breadth_first', lazy_gettext('Breadth First')),
                                  ('depth_first', lazy_gettext('Depth First')),
+                                 ('depth_first_pool', lazy_gettext('Depth First (Redis pool)')),
                                  ('random', lazy_gettext('Random'))])
 
 
@@ -22,7 +22,7 @@ import requests
 from flask.ext.babel import gettext
 from pybossa.util import unicode_csv_reader
 from pybossa.model.task import Task
-from pybossa.cache import apps as cached_apps
+from pybossa.cache import invalidation
 
 
 class BulkImportException(Exception):
@@ -178,24 +178,23 @@ class _BulkTaskEpiCollectPlusImport(_BulkTaskImport):
 def create_tasks(task_repo, tasks_data, project_id):
     empty = True
     n = 0
-    for task_data in tasks_data:
-        task = Task(app_id=project_id)
-        [setattr(task, k, v) for k, v in task_data.iteritems()]
-        found = task_repo.get_task_by(app_id=project_id, info=task.info)
-        if found is None:
-            task_repo.save(task)
-            n += 1
-            empty = False
+    # Every task is committed apart: invalidate the cached values of the
+    # project once, at the end
+    with invalidation.coalesced():
+        for task_data in tasks_data:
+            task = Task(app_id=project_id)
+            [setattr(task, k, v) for k, v in task_data.iteritems()]
+            found = task_repo.get_task_by(app_id=project_id, info=task.info)
+            if found is None:
+                task_repo.save(task)
+                n += 1
+                empty = False
     if empty:
         msg = gettext('It looks like there were no new records to import')
         return msg
     msg = str(n) + " " + gettext('new tasks were imported successfully')
     if n == 1:
         msg = str(n) + " " + gettext('new task was imported successfully')
-    cached_apps.delete_n_tasks(project_id)
-    cached_apps.delete_n_task_runs(project_id)
-    cached_apps.delete_overall_progress(project_id)
-    cached_apps.delete_last_activity(project_id)
     return msg
 
 
@@ -16,6 +16,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 """Jobs module for running background tasks in PyBossa server."""
+from collections import OrderedDict
 from flask.ext.mail import Message
 from pybossa.core import mail
 from pybossa.util import with_cache_disabled
@@ -23,6 +24,8 @@ from pybossa.util import with_cache_disabled
 
 MINUTE = 60
 HOUR = 60 * 60
+# Projects whose counters are computed at once by the stats jobs
+STATS_CHUNK = 100
 
 def get_scheduled_jobs(): # pragma: no cover
     """Return a list of scheduled jobs."""
@@ -72,10 +75,14 @@ def project_export(id):
 def get_project_jobs():
     """Return a list of jobs based on user type."""
     from pybossa.cache import apps as cached_apps
-    return create_dict_jobs(cached_apps.get_from_pro_user(),
-                            get_app_stats,
-                            interval=(10 * MINUTE),
-                            timeout=(10 * MINUTE))
+    app_ids = [app['id'] for app in cached_apps.get_from_pro_user()]
+    jobs = []
+    for i in range(0, len(app_ids), STATS_CHUNK):
+        jobs.append(dict(name=get_apps_stats,
+                         args=[app_ids[i:i + STATS_CHUNK]], kwargs={},
+                         interval=(10 * MINUTE),
+                         timeout=(10 * MINUTE)))
+    return jobs
 
 def create_dict_jobs(data, function,
                      interval=(24 * HOUR), timeout=(10 * MINUTE)):
@@ -105,6 +112,19 @@ def get_app_stats(id, short_name): # pragma: no cover
     stats.get_stats(id, current_app.config.get('GEO'))
 
 
+@with_cache_disabled
+def get_apps_stats(app_ids): # pragma: no cover
+    """Get stats for a chunk of apps, computing the counters of all of them
+    at once."""
+    import pybossa.cache.apps as cached_apps
+    import pybossa.cache.project_stats as stats
+    from flask import current_app
+
+    cached_apps.warm_counters(app_ids)
+    for app_id in app_ids:
+        stats.get_stats(app_id, current_app.config.get('GEO'))
+
+
 @with_cache_disabled
 def warm_up_stats(): # pragma: no cover
     """Background job for warming stats."""
@@ -132,37 +152,26 @@ def warm_cache(): # pragma: no cover
     from pybossa.core import create_app
     app = create_app(run_as_server=False)
     # Cache 3 pages
-    apps_cached = []
+    apps_to_warm = OrderedDict()
     pages = range(1, 4)
     import pybossa.cache.apps as cached_apps
     import pybossa.cache.categories as cached_cat
     import pybossa.cache.users as cached_users
     import pybossa.cache.project_stats as stats
 
-    def warm_app(id, short_name, featured=False):
-        if id not in apps_cached:
-            cached_apps.get_app(short_name)
-            cached_apps.n_tasks(id)
-            n_task_runs = cached_apps.n_task_runs(id)
-            cached_apps.overall_progress(id)
-            cached_apps.last_activity(id)
-            cached_apps.n_completed_tasks(id)
-            cached_apps.n_volunteers(id)
-            if n_task_runs >= 1000 or featured:
-                print ("Getting stats for %s as it has %s task runs" %
-                       (short_name, n_task_runs))
-                stats.get_stats(id, app.config.get('GEO'))
-            apps_cached.append(id)
+    def add_app(id, short_name, featured=False):
+        featured = featured or apps_to_warm.get(id, (None, False))[1]
+        apps_to_warm[id] = (short_name, featured)
 
     # Cache top projects
     apps = cached_apps.get_top()
     for a in apps:
-        warm_app(a['id'], a['short_name'])
+        add_app(a['id'], a['short_name'])
     for page in pages:
         apps = cached_apps.get_featured('featured', page,
                                         app.config['APPS_PER_PAGE'])
         for a in apps:
-            warm_app(a['id'], a['short_name'], featured=True)
+            add_app(a['id'], a['short_name'], featured=True)
 
     # Categories
     categories = cached_cat.get_used()
@@ -172,7 +181,19 @@ def warm_cache(): # pragma: no cover
                                    page,
                                    app.config['APPS_PER_PAGE'])
             for a in apps:
-                warm_app(a['id'], a['short_name'])
+                add_app(a['id'], a['short_name'])
+
+    # The counters of a chunk of projects are computed at once
+    app_ids = apps_to_warm.keys()
+    for i in range(0, len(app_ids), STATS_CHUNK):
+        counters = cached_apps.warm_counters(app_ids[i:i + STATS_CHUNK])
+        for id in app_ids[i:i + STATS_CHUNK]:
+            short_name, featured = apps_to_warm[id]
+            n_task_runs = counters.get(id, {}).get('n_task_runs', 0)
+            if n_task_runs >= 1000 or featured:
+                print ("Getting stats for %s as it has %s task runs" %
+                       (short_name, n_task_runs))
+                stats.get_stats(id, app.config.get('GEO'))
     # Users
     cached_users.get_leaderboard(app.config['LEADERBOARD'], 'anonymous')
     cached_users.get_top()
@@ -185,8 +206,8 @@ def get_non_updated_apps():
     from sqlalchemy.sql import text
     from pybossa.model.app import App
     from pybossa.core import db
-    sql = text('''SELECT id FROM app WHERE TO_DATE(updated,
-                'YYYY-MM-DD\THH24:MI:SS.US') <= NOW() - '3 month':: INTERVAL
+    sql = text('''SELECT id FROM app
+               WHERE updated_at <= (NOW() AT TIME ZONE 'UTC') - '3 month'::INTERVAL
                AND contacted != True LIMIT 25''')
     results = db.slave_session.execute(sql)
     apps = []
@@ -252,3 +273,24 @@ def import_tasks(tasks_info, app_id):
                      subject=subject, body=body)
     send_mail(mail_dict)
     return msg
+
+
+def rebuild_leaderboard():
+    """Build the leaderboard of the users from the task_run table, queued
+    when it is read before it is built."""
+    from pybossa import leaderboard
+    return leaderboard.rebuild()
+
+
+@with_cache_disabled
+def refresh_cached(module_name, function_name, args, kwargs, lock):
+    """Recompute and store the cached value of a call to a function decorated
+    with pybossa.cache.cache or memoize, releasing the lock taken by the
+    caller that enqueued the job."""
+    from importlib import import_module
+    from pybossa.core import cache_sentinel
+    try:
+        function = getattr(import_module(module_name), function_name)
+        return function(*args, **kwargs)
+    finally:
+        cache_sentinel.shard(lock).master.delete(lock)
@@ -0,0 +1,99 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SF Isle of Man Limited
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Last answer given to every task, for the incremental scheduler.
+
+The info of the last task run of a task is stored in Redis when a task run
+of an incremental project is posted, so the incremental scheduler can send
+it along with the task without reading the task_run table. Every answer is
+stored with the task.n_task_runs counter it set: if the counter of the task
+no longer matches, as it got answers while its project used another
+scheduler or some were deleted, the answer is read again from the DB and
+stored. Entries that are missing (expired or lost) are read again too.
+
+This module exports:
+    * save: store the last answer of a task
+    * clear: drop the last answer of a task, so it is read again from the DB
+    * get_many: return the last answers of some tasks
+
+"""
+import json
+from sqlalchemy.sql import text
+from pybossa.core import db, sentinel
+
+
+LAST_ANSWER_KEY = 'pybossa:sched:last_answer:task:%s'
+LAST_ANSWER_TIMEOUT = 7 * 24 * 60 * 60
+
+
+def save(task_id, info, n_task_runs):
+    """Store the info of the last task run of a task, that set its
+    n_task_runs counter."""
+    sentinel.master.setex(LAST_ANSWER_KEY % task_id, LAST_ANSWER_TIMEOUT,
+                          _dumps(info, n_task_runs))
+
+
+def clear(task_id):
+    """Drop the last answer of a task."""
+    sentinel.master.delete(LAST_ANSWER_KEY % task_id)
+
+
+def get_many(tasks):
+    """Return a dict with the last answer of every task, by id (None for the
+    tasks without answers), using a single Redis round trip if all of them
+    are stored for the current n_task_runs of the tasks."""
+    if not tasks:
+        return {}
+    values = sentinel.master.mget([LAST_ANSWER_KEY % task.id
+                                   for task in tasks])
+    answers = {}
+    missing = {}
+    for task, value in zip(tasks, values):
+        entry = json.loads(value) if value is not None else None
+        if (isinstance(entry, dict) and
+                entry.get('n_task_runs') == task.n_task_runs and
+                'info' in entry):
+            answers[task.id] = entry['info']
+        else:
+            missing[task.id] = task.n_task_runs
+    if missing:
+        answers.update(_load(missing))
+    return answers
+
+
+def _dumps(info, n_task_runs):
+    return json.dumps(dict(info=info, n_task_runs=n_task_runs))
+
+
+def _load(n_task_runs):
+    """Read the last answers of some tasks, given as a dict with their
+    n_task_runs by id, from the DB and store them. Tasks without answers are
+    stored too, so they do not hit the DB again."""
+    sql = text('''SELECT DISTINCT ON (task_id) task_id, info FROM task_run
+               WHERE task_id = ANY(:task_ids)
+               ORDER BY task_id, finish_time DESC, id DESC;''')
+    results = db.session.execute(sql, dict(task_ids=n_task_runs.keys()))
+    answers = dict.fromkeys(n_task_runs)
+    for row in results:
+        answers[row.task_id] = json.loads(row.info) if row.info else None
+    p = sentinel.master.pipeline()
+    for task_id, info in answers.items():
+        p.setex(LAST_ANSWER_KEY % task_id, LAST_ANSWER_TIMEOUT,
+                _dumps(info, n_task_runs[task_id]))
+    p.execute()
+    return answers
@@ -0,0 +1,214 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SF Isle of Man Limited
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Global leaderboard of the authenticated users.
+
+The score of every user, the number of task runs they have posted, is kept in
+a Redis sorted set. It is kept up to date by the TaskRun model events. It is
+built from the task_run table by a job in the cache queue the first time it
+is read, or by the rebuild_leaderboard command of cli.py, e.g. after bulk SQL
+changes that skip the model events.
+
+Ranks work like the SQL rank() window function: users with the same score
+share the same rank. Until the leaderboard is built, the ranks are read from
+the task_run table.
+
+This module exports:
+    * add: add a task run to the score of a user
+    * remove: remove a task run from the score of a user
+    * top: return the rank and score of the top n users
+    * rank_and_score: return the rank and score of a user
+    * rebuild: rebuild the leaderboard from the task_run table
+
+"""
+import uuid
+from rq import Queue
+from sqlalchemy.sql import text
+from pybossa.core import db, sentinel
+
+
+LEADERBOARD_KEY = 'pybossa:leaderboard'
+LEADERBOARD_SEEDED_KEY = 'pybossa:leaderboard:seeded'
+LEADERBOARD_TMP_KEY = 'pybossa:leaderboard:tmp:%s'
+# Set while a job to build the leaderboard is queued, so only one is
+LEADERBOARD_QUEUED_KEY = 'pybossa:leaderboard:queued'
+# Only one worker rebuilds the leaderboard at a time. The lock holds the id
+# of the last task run read by the rebuild and the key of the new leaderboard
+REBUILD_LOCK_KEY = 'pybossa:leaderboard:rebuild'
+REBUILD_LOCK_TIMEOUT = 10 * 60
+SEED_CHUNK = 10000
+
+# Add to the score of a user (ARGV[1]) the increment ARGV[2], for the task
+# run ARGV[3]. While a rebuild is running, the task runs it does not read are
+# counted in the new leaderboard too, so they are not lost when it replaces
+# the current one
+UPDATE_SCRIPT = """
+local function update(key)
+    redis.call('ZINCRBY', key, ARGV[2], ARGV[1])
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', 0)
+end
+update(KEYS[1])
+local rebuild = redis.call('GET', KEYS[2])
+if rebuild then
+    local last_id, tmp_key = string.match(rebuild, '^(%d+):(.+)$')
+    if tonumber(ARGV[3]) > tonumber(last_id) then
+        update(tmp_key)
+    end
+end
+"""
+
+# Replace the leaderboard (KEYS[2]) with the rebuilt one (KEYS[1]), mark it
+# as seeded (KEYS[3]) and release the rebuild lock (KEYS[4]) at once
+REPLACE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('RENAME', KEYS[1], KEYS[2])
+else
+    redis.call('DEL', KEYS[2])
+end
+redis.call('SET', KEYS[3], 1)
+redis.call('DEL', KEYS[4])
+"""
+
+
+def add(user_id, task_run_id):
+    """Add a task run to the score of a user."""
+    _update(user_id, task_run_id, 1)
+
+
+def remove(user_id, task_run_id):
+    """Remove a task run from the score of a user, dropping the users that
+    have no task runs left."""
+    _update(user_id, task_run_id, -1)
+
+
+def _update(user_id, task_run_id, increment):
+    if user_id is not None:
+        sentinel.master.eval(UPDATE_SCRIPT, 2, LEADERBOARD_KEY,
+                             REBUILD_LOCK_KEY, int(user_id), increment,
+                             int(task_run_id))
+
+
+def top(n):
+    """Return a list of (user_id, rank, score) with the top n users."""
+    if not _seeded():
+        return _top_from_db(n)
+    out = []
+    members = sentinel.master.zrevrange(LEADERBOARD_KEY, 0, n - 1,
+                                        withscores=True)
+    for i, (member, score) in enumerate(members):
+        score = int(score)
+        if not out or out[-1][2] != score:
+            rank = i + 1
+        out.append((int(member), rank, score))
+    return out
+
+
+def rank_and_score(user_id):
+    """Return the (rank, score) of a user, or (None, None) if the user has
+    not posted any task run."""
+    if not _seeded():
+        return _rank_and_score_from_db(user_id)
+    score = sentinel.master.zscore(LEADERBOARD_KEY, int(user_id))
+    if score is None:
+        return None, None
+    score = int(score)
+    # The users with a higher score, as ZREVRANK does not handle ties
+    higher = sentinel.master.zcount(LEADERBOARD_KEY, '(%s' % score, '+inf')
+    return higher + 1, score
+
+
+def rebuild():
+    """Rebuild the leaderboard from the task_run table. Return the number of
+    users read from it, or None if another rebuild is running.
+
+    The task runs posted while it runs are added to the new leaderboard by
+    add. The ones that were being posted when it started may be missed.
+
+    """
+    last_id = db.slave_session.execute(
+        text('SELECT COALESCE(MAX(id), 0) FROM task_run')).scalar()
+    tmp_key = LEADERBOARD_TMP_KEY % uuid.uuid4().hex
+    if not sentinel.master.set(REBUILD_LOCK_KEY, '%s:%s' % (last_id, tmp_key),
+                               nx=True, ex=REBUILD_LOCK_TIMEOUT):
+        return None
+    try:
+        sql = text('''SELECT user_id, COUNT(*) AS score FROM task_run
+                   WHERE user_id IS NOT NULL AND id <= :last_id
+                   GROUP BY user_id;''').execution_options(stream=True)
+        results = db.slave_session.execute(sql, dict(last_id=last_id))
+        p = sentinel.master.pipeline()
+        n = 0
+        for n, row in enumerate(results, 1):
+            # ZINCRBY keeps the task runs added in the meantime
+            p.zincrby(tmp_key, row.user_id, row.score)
+            if n % SEED_CHUNK == 0:
+                p.execute()
+        p.execute()
+        sentinel.master.eval(REPLACE_SCRIPT, 4, tmp_key, LEADERBOARD_KEY,
+                             LEADERBOARD_SEEDED_KEY, REBUILD_LOCK_KEY)
+        return n
+    except Exception:
+        p = sentinel.master.pipeline()
+        p.delete(tmp_key)
+        p.delete(REBUILD_LOCK_KEY)
+        p.execute()
+        raise
+
+
+def _seeded():
+    """Return whether the leaderboard is built. If it is not, a job is queued
+    to build it, unless one already is."""
+    if sentinel.master.exists(LEADERBOARD_SEEDED_KEY):
+        return True
+    if sentinel.master.set(LEADERBOARD_QUEUED_KEY, 1, nx=True,
+                           ex=REBUILD_LOCK_TIMEOUT):
+        _rebuild_queue().enqueue('pybossa.jobs.rebuild_leaderboard')
+    return False
+
+
+def _rebuild_queue():
+    return Queue('cache', connection=sentinel.master)
+
+
+def _top_from_db(n):
+    """Return the top n users from the task_run table, until the
+    leaderboard is built."""
+    sql = text('''WITH scores AS (
+                    SELECT user_id, COUNT(*) AS score FROM task_run
+                    WHERE user_id IS NOT NULL GROUP BY user_id)
+               SELECT user_id, score, rank() OVER (ORDER BY score DESC)
+               FROM scores ORDER BY rank LIMIT :limit;''')
+    results = db.slave_session.execute(sql, dict(limit=n))
+    return [(row.user_id, row.rank, row.score) for row in results]
+
+
+def _rank_and_score_from_db(user_id):
+    """Return the (rank, score) of a user from the task_run table, until the
+    leaderboard is built."""
+    sql = text('''WITH global_rank AS (
+                    WITH scores AS (
+                        SELECT user_id, COUNT(*) AS score FROM task_run
+                        WHERE user_id IS NOT NULL GROUP BY user_id)
+                    SELECT user_id, score, rank() OVER (ORDER BY score DESC)
+                    FROM scores)
+               SELECT rank, score FROM global_rank
+               WHERE user_id=:user_id;''')
+    row = db.slave_session.execute(sql, dict(user_id=user_id)).fetchone()
+    if row is None:
+        return None, None
+    return row.rank, row.score
@@ -25,7 +25,7 @@ from sqlalchemy import Text
 from sqlalchemy.orm import relationship, backref, class_mapper
 from sqlalchemy.ext.mutable import Mutable
 from sqlalchemy.types import TypeDecorator
-from sqlalchemy import event
+from sqlalchemy import event, inspect
 from sqlalchemy.engine import reflection
 from sqlalchemy.schema import (
     MetaData,
@@ -53,9 +53,15 @@ log = logging.getLogger(__name__)
 
 class DomainObject(object):
 
+    #: Timestamp columns kept in sync with the ISO string columns, by name.
+    #: They are for the queries only, so dictize leaves them out.
+    _timestamp_columns = {}
+
     def dictize(self):
         out = {}
         for col in self.__table__.c:
+            if col.name in self._timestamp_columns:
+                continue
             out[col.name] = getattr(self, col.name)
         return out
 
@@ -156,6 +162,37 @@ def make_timestamp():
     return now.isoformat()
 
 
+def parse_timestamp(value):
+    """Return the datetime of an ISO timestamp made by make_timestamp, or
+    None if it is empty or invalid."""
+    if not value:
+        return None
+    for format in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.datetime.strptime(value, format)
+        except ValueError:
+            pass
+    return None
+
+
+def sync_timestamps(mapper, conn, target):
+    """Set the _timestamp_columns of a domain object from its ISO string
+    columns, before inserting or updating it. Empty string columns get
+    make_timestamp on insert, as their column defaults do, and on update if
+    they have an onupdate default, which the flush would apply too late."""
+    state = inspect(target)
+    for timestamp_column, column in target._timestamp_columns.items():
+        if not state.has_identity:
+            if getattr(target, column) is None:
+                setattr(target, column, make_timestamp())
+        elif not state.attrs[column].history.has_changes():
+            if mapper.columns[column].onupdate is None:
+                continue
+            setattr(target, column, make_timestamp())
+        setattr(target, timestamp_column,
+                parse_timestamp(getattr(target, column)))
+
+
 def make_uuid():
     return str(uuid.uuid4())
 
@@ -170,8 +207,9 @@ def update_redis(obj):
 
 def update_app_timestamp(mapper, conn, target):
     """Update method to be used by the relationship objects."""
-    sql_query = ("update app set updated='%s' where id=%s" %
-                 (make_timestamp(), target.app_id))
+    now = make_timestamp()
+    sql_query = ("update app set updated='%s', updated_at='%s' where id=%s" %
+                 (now, now, target.app_id))
     conn.execute(sql_query)
 
 
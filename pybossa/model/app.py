@@ -16,14 +16,16 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 
-from sqlalchemy import Integer, Boolean, Unicode, Float, UnicodeText, Text
-from sqlalchemy.schema import Column, ForeignKey
+from sqlalchemy import Integer, Boolean, Unicode, Float, UnicodeText, Text, \
+    DateTime
+from sqlalchemy.schema import Column, ForeignKey, Index
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy import event
 
 
 from pybossa.core import db, signer
-from pybossa.model import DomainObject, JSONType, JSONEncodedDict, make_timestamp, update_redis
+from pybossa.model import DomainObject, JSONType, JSONEncodedDict, make_timestamp, update_redis, \
+    sync_timestamps
 from pybossa.model.task import Task
 from pybossa.model.task_run import TaskRun
 from pybossa.model.category import Category
@@ -42,6 +44,8 @@ class App(db.Model, DomainObject):
     created = Column(Text, default=make_timestamp)
     #: UTC timestamp when the project is updated (or any of its relationships)
     updated = Column(Text, default=make_timestamp, onupdate=make_timestamp)
+    #: updated as a timestamp, for the time range queries
+    updated_at = Column(DateTime)
     #: Project name
     name = Column(Unicode(length=255), unique=True, nullable=False)
     #: Project slug for the URL
@@ -82,6 +86,10 @@ class App(db.Model, DomainObject):
     category = relationship(Category)
     blogposts = relationship(Blogpost, cascade='all, delete-orphan', backref='app')
 
+    _timestamp_columns = dict(updated_at='updated')
+
+    __table_args__ = (Index('app_updated_at_idx', 'updated_at'),)
+
 
 
     def needs_password(self):
@@ -123,6 +131,10 @@ def empty_string_to_none(mapper, conn, target):
     if target.description == '':
         target.description = None
 
+event.listen(App, 'before_insert', sync_timestamps)
+event.listen(App, 'before_update', sync_timestamps)
+
+
 @event.listens_for(App, 'after_insert')
 def add_event(mapper, conn, target):
     """Update PyBossa feed with new app."""
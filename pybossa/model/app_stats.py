@@ -0,0 +1,61 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SF Isle of Man Limited
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+
+from sqlalchemy import Integer, Text, Date
+from sqlalchemy.schema import Column, ForeignKey
+
+from pybossa.core import db
+from pybossa.model import DomainObject
+
+
+
+class AppStatsDay(db.Model, DomainObject):
+    '''Answers and completed tasks of a project per day.'''
+
+    __tablename__ = 'app_stats_day'
+
+    #: App.id of the project
+    app_id = Column(Integer, ForeignKey('app.id', ondelete='CASCADE'),
+                    primary_key=True)
+    #: UTC day, from the TaskRun.finish_time
+    day = Column(Date, primary_key=True)
+    #: Number of answers of anonymous users
+    n_answers_anon = Column(Integer, default=0, server_default='0',
+                            nullable=False)
+    #: Number of answers of authenticated users
+    n_answers_auth = Column(Integer, default=0, server_default='0',
+                            nullable=False)
+    #: Number of tasks that got their last needed answer that day
+    n_completed_tasks = Column(Integer, default=0, server_default='0',
+                               nullable=False)
+
+
+class AppStatsHour(db.Model, DomainObject):
+    '''Answers of a project per hour of the day and type of user.'''
+
+    __tablename__ = 'app_stats_hour'
+
+    #: App.id of the project
+    app_id = Column(Integer, ForeignKey('app.id', ondelete='CASCADE'),
+                    primary_key=True)
+    #: UTC hour of the day (0 to 23), from the TaskRun.finish_time
+    hour = Column(Integer, primary_key=True)
+    #: 'anon' or 'auth'
+    user_type = Column(Text, primary_key=True)
+    #: Number of answers
+    n_answers = Column(Integer, default=0, server_default='0', nullable=False)
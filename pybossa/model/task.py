@@ -16,15 +16,17 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 
-from sqlalchemy import Integer, Boolean, Float, UnicodeText, Text
-from sqlalchemy.schema import Column, ForeignKey
+from sqlalchemy import Integer, Boolean, Float, UnicodeText, Text, DateTime
+from sqlalchemy.schema import Column, ForeignKey, Index
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy import event
 
 from pybossa.core import db
 from pybossa.model import DomainObject, JSONType, JSONEncodedDict, \
-    make_timestamp, update_redis, update_app_timestamp
+    make_timestamp, update_redis, update_app_timestamp, sync_timestamps
 from pybossa.model.task_run import TaskRun
+from pybossa import task_pool
+from pybossa.cache import invalidation
 
 
 
@@ -40,6 +42,8 @@ class Task(db.Model, DomainObject):
     id = Column(Integer, primary_key=True)
     #: UTC timestamp when the task was created.
     created = Column(Text, default=make_timestamp)
+    #: created as a timestamp, for the time range queries
+    created_at = Column(DateTime)
     #: Project.ID that this task is associated with.
     app_id = Column(Integer, ForeignKey('app.id', ondelete='CASCADE'), nullable=False)
     #: Task.state: ongoing or completed.
@@ -53,9 +57,19 @@ class Task(db.Model, DomainObject):
     info = Column(JSONType, default=dict)
     #: Number of answers to collect for this task.
     n_answers = Column(Integer, default=30)
+    #: Number of answers collected so far for this task.
+    n_task_runs = Column(Integer, default=0, server_default='0')
 
     task_runs = relationship(TaskRun, cascade='all, delete, delete-orphan', backref='task')
 
+    _timestamp_columns = dict(created_at='created')
+
+    __table_args__ = (Index('task_app_id_n_task_runs_idx',
+                            'app_id', 'n_task_runs', 'id'),
+                      Index('task_app_id_id_idx', 'app_id', 'id'),
+                      Index('task_app_id_created_at_idx',
+                            'app_id', 'created_at'))
+
 
     def pct_status(self):
         """Returns the percentage of Tasks that are completed"""
@@ -64,6 +78,10 @@ class Task(db.Model, DomainObject):
         else:  # pragma: no cover
             return float(0)
 
+event.listen(Task, 'before_insert', sync_timestamps)
+event.listen(Task, 'before_update', sync_timestamps)
+
+
 @event.listens_for(Task, 'after_insert')
 def add_event(mapper, conn, target):
     """Update PyBossa feed with new task."""
@@ -87,3 +105,32 @@ def add_event(mapper, conn, target):
 def update_app(mapper, conn, target):
     """Update app updated timestamp."""
     update_app_timestamp(mapper, conn, target)
+
+
+@event.listens_for(Task, 'after_insert')
+@event.listens_for(Task, 'after_update')
+def update_task_pool(mapper, conn, target):
+    """Keep the Redis pool of open tasks of the app in sync, once the
+    transaction commits."""
+    if target.state == 'completed':
+        invalidation.on_commit(target, task_pool.remove_task, target.app_id,
+                               target.id)
+    else:
+        invalidation.on_commit(target, task_pool.add_task, target.app_id,
+                               target.id, target.priority_0)
+
+
+@event.listens_for(Task, 'after_delete')
+def remove_from_task_pool(mapper, conn, target):
+    """Remove the task from the Redis pool of open tasks of the app, once the
+    transaction commits."""
+    invalidation.on_commit(target, task_pool.remove_task, target.app_id,
+                           target.id)
+
+
+@event.listens_for(Task, 'after_insert')
+@event.listens_for(Task, 'after_update')
+@event.listens_for(Task, 'after_delete')
+def invalidate_cached_counters(mapper, conn, target):
+    """Reset the cached counters of the app once the transaction commits."""
+    invalidation.project_changed(target)
@@ -16,14 +16,19 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
 from datetime import datetime
-from sqlalchemy import Integer, Text
-from sqlalchemy.schema import Column, ForeignKey
+from sqlalchemy import Integer, Text, DateTime
+from sqlalchemy.schema import Column, ForeignKey, Index
 from sqlalchemy import event
+from sqlalchemy.sql import text
 
 from pybossa.core import db, queues
 from pybossa.model import DomainObject, JSONType, make_timestamp, update_redis, \
-    update_app_timestamp, webhook
+    update_app_timestamp, webhook, sync_timestamps
+from pybossa import task_pool, task_lease, seen_tasks, last_answers, \
+    stats_rollups, leaderboard, volunteer_counts
+from pybossa.cache import invalidation
 
 
 
@@ -37,6 +42,8 @@ class TaskRun(db.Model, DomainObject):
     id = Column(Integer, primary_key=True)
     #: UTC timestamp for when TaskRun is created.
     created = Column(Text, default=make_timestamp)
+    #: created as a timestamp, for the time range queries
+    created_at = Column(DateTime)
     #: Project.id of the project associated with this TaskRun.
     app_id = Column(Integer, ForeignKey('app.id'), nullable=False)
     #: Task.id of the task associated with this TaskRun.
@@ -47,6 +54,8 @@ class TaskRun(db.Model, DomainObject):
     #: User.ip of the user contributing the TaskRun (only if anonymous)
     user_ip = Column(Text)
     finish_time = Column(Text, default=make_timestamp)
+    #: finish_time as a timestamp, for the time range queries
+    finished_at = Column(DateTime)
     timeout = Column(Integer)
     calibration = Column(Integer)
     #: Value of the answer.
@@ -59,6 +68,16 @@ class TaskRun(db.Model, DomainObject):
         }
     '''
 
+    _timestamp_columns = dict(created_at='created', finished_at='finish_time')
+
+    __table_args__ = (Index('task_run_app_id_finished_at_idx',
+                            'app_id', 'finished_at'),
+                      Index('task_run_finished_at_idx', 'finished_at'))
+
+
+event.listen(TaskRun, 'before_insert', sync_timestamps)
+event.listen(TaskRun, 'before_update', sync_timestamps)
+
 
 @event.listens_for(TaskRun, 'after_insert')
 def update_task_state(mapper, conn, target):
@@ -94,17 +113,39 @@ def update_task_state(mapper, conn, target):
                        action_updated='UserContribution')
         # Add the event
         update_redis(obj)
+    # The Redis indexes are updated only if the task run is committed
+    on_commit = invalidation.on_commit
+    on_commit(target, seen_tasks.add, target.app_id, target.task_id,
+              user_id=target.user_id, user_ip=target.user_ip)
+    on_commit(target, leaderboard.add, target.user_id, target.id)
+    on_commit(target, volunteer_counts.add, target.app_id,
+              user_id=target.user_id, user_ip=target.user_ip)
+    on_commit(target, task_lease.release, target.task_id,
+              user_id=target.user_id, user_ip=target.user_ip)
+    # Keep the task counter used by the breadth_first scheduler up to date.
+    # It is incremented in place, as the row lock makes concurrent answers
+    # to the same task wait for each other and count every answer
+    sql_query = text('''UPDATE task SET n_task_runs=n_task_runs + 1
+                     WHERE id=:task_id RETURNING n_task_runs, n_answers''')
+    n_task_runs, task_n_answers = conn.execute(
+        sql_query, task_id=target.task_id).fetchone()
+    # Keep the last answer sent by the incremental scheduler up to date. The
+    # answers of other projects are not stored: last_answers reads them again
+    # if the project switches to it, as they no longer match n_task_runs
+    if _app_sched(app_obj['info']) == 'incremental':
+        on_commit(target, last_answers.save, target.task_id, target.info,
+                  n_task_runs)
+    # Only the answer that reaches n_answers completes the task
+    stats_rollups.add_answer(conn, target,
+                             completed=n_task_runs == task_n_answers)
     # Check if Task.state should be updated
-    sql_query = ('select count(id) from task_run \
-                 where task_run.task_id=%s') % target.task_id
-    n_answers = conn.scalar(sql_query)
-    sql_query = ('select n_answers from task \
-                 where task.id=%s') % target.task_id
-    task_n_answers = conn.scalar(sql_query)
-    if (n_answers) >= task_n_answers:
+    if n_task_runs >= task_n_answers:
         sql_query = ("UPDATE task SET state=\'completed\' \
                      where id=%s") % target.task_id
         conn.execute(sql_query)
+        on_commit(target, task_pool.remove_task, target.app_id,
+                  target.task_id)
+        on_commit(target, task_lease.clear, target.task_id)
         update_redis(app_obj)
         # PUSH changes via the webhook
         if app_obj['webhook']:
@@ -117,8 +158,44 @@ def update_task_state(mapper, conn, target):
 
 
 
+@event.listens_for(TaskRun, 'after_delete')
+def update_task_n_task_runs(mapper, conn, target):
+    """Update the task.n_task_runs counter, the index of seen tasks, the
+    leaderboard, the volunteer counters, the last answer of the task and the
+    stats rollups when a task run is deleted."""
+    on_commit = invalidation.on_commit
+    on_commit(target, seen_tasks.remove, target.app_id, target.task_id,
+              user_id=target.user_id, user_ip=target.user_ip)
+    on_commit(target, leaderboard.remove, target.user_id, target.id)
+    # A HyperLogLog cannot forget a volunteer, so it is seeded again
+    if volunteer_counts.enabled():
+        on_commit(target, volunteer_counts.reset, target.app_id)
+    on_commit(target, last_answers.clear, target.task_id)
+    stats_rollups.remove_answer(conn, target)
+    sql_query = text('''UPDATE task SET n_task_runs=n_task_runs - 1
+                     WHERE id=:task_id''')
+    conn.execute(sql_query, task_id=target.task_id)
+
+
+def _app_sched(app_info):
+    """Return the scheduler of a project from its info column, as read by a
+    raw SQL query."""
+    try:
+        return json.loads(app_info).get('sched')
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
 @event.listens_for(TaskRun, 'after_insert')
 @event.listens_for(TaskRun, 'after_update')
 def update_app(mapper, conn, target):
     """Update app updated timestamp."""
     update_app_timestamp(mapper, conn, target)
+
+
+@event.listens_for(TaskRun, 'after_insert')
+@event.listens_for(TaskRun, 'after_update')
+@event.listens_for(TaskRun, 'after_delete')
+def invalidate_cached_counters(mapper, conn, target):
+    """Reset the cached counters of the app once the transaction commits."""
+    invalidation.project_changed(target)
@@ -22,6 +22,7 @@ from sqlalchemy.exc import IntegrityError
 from pybossa.model.task import Task
 from pybossa.model.task_run import TaskRun
 from pybossa.exc import WrongObjectError, DBIntegrityError
+from pybossa import task_pool
 
 
 
@@ -126,6 +127,8 @@ class TaskRepository(object):
                    ''')
         self.db.session.execute(sql, dict(n_answers=n_answer, app_id=project.id))
         self.db.session.commit()
+        # Task states changed without firing the model events
+        task_pool.reset(project.id)
 
 
     def _validate_can_be(self, action, element):
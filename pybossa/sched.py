@@ -19,28 +19,88 @@
 #import json
 #from flask import Blueprint, request, url_for, flash, redirect, abort
 #from flask import abort, request, make_response, current_app
+from flask import current_app
 from sqlalchemy.sql import text
-from pybossa.model.app import App
 from pybossa.model.task import Task
-from pybossa.model.task_run import TaskRun
 from pybossa.core import db
+from pybossa import task_pool, task_lease, seen_tasks, last_answers
+from pybossa import sched_metrics
+import pkg_resources
 import random
+import time
 
 
 
 session = db.slave_session
+# Extra candidates read when tasks with active leases have to be skipped
+LEASE_LOOKAHEAD = 20
+# Number of candidates read by the schedulers that support an offset
+CANDIDATES_WINDOW = 10
+# Setuptools entry point group of the scheduler plugins
+ENTRY_POINT_GROUP = 'pybossa.schedulers'
+# Scheduler plugins, loaded on first use
+_plugins = None
 
 def new_task(app_id, sched, user_id=None, user_ip=None, offset=0):
     '''Get a new task by calling the appropriate scheduler function.
     '''
-    sched_map = {
-        'default': get_depth_first_task,
-        'breadth_first': get_breadth_first_task,
-        'depth_first': get_depth_first_task,
-        'random': get_random_task,
-        'incremental': get_incremental_task}
-    scheduler = sched_map.get(sched, sched_map['default'])
-    return scheduler(app_id, user_id, user_ip, offset=offset)
+    tasks = new_tasks(app_id, sched, user_id, user_ip, offset=offset, limit=1)
+    return tasks[0] if tasks else None
+
+
+def new_tasks(app_id, sched, user_id=None, user_ip=None, offset=0, limit=1):
+    '''Get up to limit distinct new tasks in a single scheduler pass.
+
+    The call is timed and recorded in pybossa.sched_metrics, labelled by
+    project and scheduler, with the number of candidates it considered.
+    Schedulers that do not report their candidates are counted as having
+    considered the tasks they return.
+    '''
+    schedulers = get_schedulers()
+    if sched not in schedulers:
+        sched = 'default'
+    start = time.time()
+    sched_metrics.start()
+    try:
+        tasks = schedulers[sched](app_id, user_id, user_ip, offset=offset,
+                                  limit=limit)
+    finally:
+        n_candidates = sched_metrics.stop()
+    sched_metrics.record(app_id, sched, time.time() - start,
+                         max(n_candidates, len(tasks)), len(tasks))
+    return tasks
+
+
+def get_schedulers():
+    '''Return a dict with all the available schedulers, by name.
+
+    Besides the built-in ones, schedulers can be added by other packages
+    through the pybossa.schedulers setuptools entry point, e.g.::
+
+        entry_points={'pybossa.schedulers': [
+            'my_sched = my_package.sched:get_my_tasks']}
+
+    A scheduler is called as scheduler(app_id, user_id, user_ip, offset=0,
+    limit=1) and returns a list with up to limit tasks. Plugins cannot
+    replace the built-in schedulers.
+    '''
+    global _plugins
+    if _plugins is None:
+        _plugins = _load_plugins()
+    schedulers = dict(_plugins)
+    schedulers.update(SCHEDULERS)
+    return schedulers
+
+
+def _load_plugins():
+    plugins = {}
+    for entry_point in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP):
+        try:
+            plugins[entry_point.name] = entry_point.load()
+        except Exception as e:  # pragma: no cover
+            current_app.logger.error('Cannot load scheduler %s: %s'
+                                     % (entry_point.name, e))
+    return plugins
 
 
 def get_breadth_first_task(app_id, user_id=None, user_ip=None, n_answers=30, offset=0):
@@ -51,79 +111,149 @@ def get_breadth_first_task(app_id, user_id=None, user_ip=None, n_answers=30, off
     (this is not a big issue as all it means is that you may end up with some
     tasks run more than is strictly needed!)
     """
-    # Uncomment the next three lines to profile the sched function
-    #import timeit
-    #T = timeit.Timer(lambda: get_candidate_tasks(app_id, user_id,
-    #                  user_ip, n_answers))
-    #print "First algorithm: %s" % T.timeit(number=1)
-    if user_id and not user_ip:
-        sql = text('''
-                   SELECT task.id, COUNT(task_run.task_id) AS taskcount FROM task
-                   LEFT JOIN task_run ON (task.id = task_run.task_id) WHERE NOT EXISTS
-                   (SELECT 1 FROM task_run WHERE app_id=:app_id AND
-                   user_id=:user_id AND task_id=task.id)
-                   AND task.app_id=:app_id AND task.state !='completed'
-                   group by task.id ORDER BY taskcount, id ASC LIMIT 10;
-                   ''')
-        tasks = session.execute(sql, dict(app_id=app_id, user_id=user_id))
-    else:
-        if not user_ip: # pragma: no cover
-            user_ip = '127.0.0.1'
-        sql = text('''
-                   SELECT task.id, COUNT(task_run.task_id) AS taskcount FROM task
-                   LEFT JOIN task_run ON (task.id = task_run.task_id) WHERE NOT EXISTS
-                   (SELECT 1 FROM task_run WHERE app_id=:app_id AND
-                   user_ip=:user_ip AND task_id=task.id)
-                   AND task.app_id=:app_id AND task.state !='completed'
-                   group by task.id ORDER BY taskcount, id ASC LIMIT 10;
-                   ''')
-
-        # results will be list of (taskid, count)
-        tasks = session.execute(sql, dict(app_id=app_id, user_ip=user_ip))
+    return _first(get_breadth_first_tasks(app_id, user_id, user_ip,
+                                          offset=offset))
+
+
+def get_breadth_first_tasks(app_id, user_id=None, user_ip=None, offset=0, limit=1):
+    """Gets up to limit tasks with the least number of task runs.
+
+    The number of task runs is read from the task.n_task_runs counter, kept
+    up to date by the TaskRun model events, so the tasks are read in order
+    from the task_app_id_n_task_runs_idx index instead of being aggregated.
+    """
     # ignore n_answers for the present - we will just keep going once we've
     # done as many as we need
-    tasks = [x[0] for x in tasks]
-    if tasks:
-        if (offset == 0):
-            return session.query(Task).get(tasks[0])
-        else:
-            if (offset < len(tasks)):
-                return session.query(Task).get(tasks[offset])
-            else:
-                return None
-    else: # pragma: no cover
-        return None
+    task_ids = get_candidate_task_ids(app_id, user_id, user_ip,
+                                      limit=_window(limit),
+                                      order_by='n_task_runs ASC, id ASC')
+    return _load_tasks(task_ids[offset:offset + limit])
 
 
 def get_depth_first_task(app_id, user_id=None, user_ip=None, n_answers=30, offset=0):
     """Gets a new task for a given project"""
+    return _first(get_depth_first_tasks(app_id, user_id, user_ip,
+                                        offset=offset))
+
+
+def get_depth_first_tasks(app_id, user_id=None, user_ip=None, offset=0, limit=1):
+    """Gets up to limit new tasks for a given project"""
     # Uncomment the next three lines to profile the sched function
     #import timeit
-    #T = timeit.Timer(lambda: get_candidate_tasks(app_id, user_id,
-    #                  user_ip, n_answers))
+    #T = timeit.Timer(lambda: get_candidate_task_ids(app_id, user_id,
+    #                  user_ip))
     #print "First algorithm: %s" % T.timeit(number=1)
-    candidate_tasks = get_candidate_tasks(app_id, user_id, user_ip, n_answers, offset=offset)
-    total_remaining = len(candidate_tasks)
-    #print "Available tasks %s " % total_remaining
-    if total_remaining == 0:
-        return None
-    if (offset == 0):
-        return candidate_tasks[0]
-    else:
-        if (offset < len(candidate_tasks)):
-            return candidate_tasks[offset]
-        else:
-            return None
+    task_ids = get_candidate_task_ids(app_id, user_id, user_ip,
+                                      limit=_window(limit))
+    return _load_tasks(task_ids[offset:offset + limit])
+
+
+def get_depth_first_pool_task(app_id, user_id=None, user_ip=None, n_answers=30, offset=0):
+    """Gets a new task for a given project using its Redis pool of open tasks.
+
+    It returns the same task as get_depth_first_task, but the candidates are
+    picked from the pool in pybossa.task_pool instead of running the task_run
+    anti-join, so the DB is only hit to load the chosen task.
+    """
+    return _first(get_depth_first_pool_tasks(app_id, user_id, user_ip,
+                                             offset=offset))
+
+
+def get_depth_first_pool_tasks(app_id, user_id=None, user_ip=None, offset=0, limit=1):
+    """Gets up to limit new tasks for a given project using its Redis pool of
+    open tasks. While another worker builds the pool, or if the replica lags
+    behind it, the candidates are read from the DB."""
+    while True:
+        candidate_ids = task_pool.candidates(
+            app_id, user_id, user_ip, limit=_lookahead(offset + limit))
+        if candidate_ids is not None:
+            sched_metrics.count_candidates(len(candidate_ids))
+            tasks = _load_pool_tasks(app_id, candidate_ids)
+            if tasks is None:
+                continue
+            if len(tasks) == len(candidate_ids):
+                tasks = _skip_leased_tasks(tasks, user_id, user_ip)
+                return tasks[offset:offset + limit]
+        # The pool is being built, or the replica lags behind it
+        candidate_ids = get_candidate_task_ids(app_id, user_id, user_ip,
+                                               limit=offset + limit)
+        return _load_tasks(candidate_ids[offset:])
+
+
+def _load_pool_tasks(app_id, task_ids):
+    """Load the tasks picked from the pool of a project. If some of them are
+    completed, they are removed from the pool and None is returned, so the
+    caller picks them again.
+
+    The tasks that are not found are left out, but kept in the pool, as the
+    replica may not have them yet.
+    """
+    tasks = _load_tasks(task_ids)
+    stale_ids = [task.id for task in tasks if task.state == 'completed']
+    if not stale_ids:
+        return tasks
+    # The pool is out of date for these tasks, so fix it
+    for task_id in stale_ids:
+        task_pool.remove_task(app_id, task_id)
+    return None
 
 
 def get_random_task(app_id, user_id=None, user_ip=None, n_answers=30, offset=0):
-    """Returns a random task for the user"""
-    app = session.query(App).get(app_id)
-    from random import choice
-    if len(app.tasks) > 0:
-        return choice(app.tasks)
-    else:
-        return None
+    """Returns a random task for the user.
+
+    It is picked uniformly at random among the open tasks of the project
+    that the user has not answered yet, from the pool in pybossa.task_pool,
+    so the DB is only hit to load the chosen task.
+    """
+    return _first(get_random_tasks(app_id, user_id, user_ip, offset=offset))
+
+
+def get_random_tasks(app_id, user_id=None, user_ip=None, offset=0, limit=1):
+    """Returns up to limit distinct random tasks for the user.
+
+    While another worker builds the pool of the project, if the user has
+    answered most of its tasks, or if the replica lags behind the pool, the
+    tasks are read from the DB with _get_random_tasks_from_db instead.
+    """
+    while True:
+        task_ids = task_pool.random_candidates(app_id, user_id, user_ip,
+                                               limit=_lookahead(limit))
+        if task_ids is not None:
+            sched_metrics.count_candidates(len(task_ids))
+            tasks = _load_pool_tasks(app_id, task_ids)
+            if tasks is None:
+                continue
+            if len(tasks) == len(task_ids):
+                return _skip_leased_tasks(tasks, user_id, user_ip)[:limit]
+        return _get_random_tasks_from_db(app_id, user_id, user_ip, limit)
+
+
+def _get_random_tasks_from_db(app_id, user_id=None, user_ip=None, limit=1):
+    """Returns up to limit tasks for the user, starting at a random task.
+
+    It picks a random id between the lowest and the highest task id of the
+    project and returns the first open tasks from that id on (wrapping around
+    to the lowest id) that the user has not answered yet. Both queries are
+    index reads, but the picks are not uniform: tasks that follow a gap in
+    the ids, or a run of completed or answered tasks, are more likely to be
+    picked than the rest, and the tasks following the random one are
+    returned too.
+    """
+    sql = text('''SELECT MIN(id) AS min_id, MAX(id) AS max_id FROM task
+               WHERE app_id=:app_id''')
+    bounds = session.execute(sql, dict(app_id=app_id)).first()
+    if bounds is None or bounds.min_id is None:
+        return []
+    pivot = random.randint(bounds.min_id, bounds.max_id)
+    task_ids = []
+    for id_filter in ('id >= :pivot', 'id < :pivot'):
+        task_ids += get_candidate_task_ids(app_id, user_id, user_ip,
+                                           limit=limit - len(task_ids),
+                                           order_by='id ASC', filters=id_filter,
+                                           params=dict(pivot=pivot))
+        if len(task_ids) == limit:
+            break
+    return _load_tasks(task_ids)
 
 
 def get_incremental_task(app_id, user_id=None, user_ip=None, n_answers=30, offset=0):
@@ -132,48 +262,137 @@ def get_incremental_task(app_id, user_id=None, user_ip=None, n_answers=30, offse
     It is an important strategy when dealing with large tasks, as
     transcriptions.
     """
-    candidate_tasks = get_candidate_tasks(app_id, user_id, user_ip,
-                                          n_answers, offset=0)
-    total_remaining = len(candidate_tasks)
-    if total_remaining == 0:
-        return None
-    rand = random.randrange(0, total_remaining)
-    task = candidate_tasks[rand]
-    #Find last answer for the task
-    q = session.query(TaskRun)\
-          .filter(TaskRun.task_id == task.id)\
-          .order_by(TaskRun.finish_time.desc())
-    last_task_run = q.first()
-    if last_task_run:
-        task.info['last_answer'] = last_task_run.info
-        #TODO: As discussed in GitHub #53
-        # it is necessary to create a lock in the task!
-    return task
+    return _first(get_incremental_tasks(app_id, user_id, user_ip,
+                                        offset=offset))
+
+
+def get_incremental_tasks(app_id, user_id=None, user_ip=None, offset=0, limit=1):
+    """Get up to limit random new tasks with their last given answer."""
+    task_ids = get_candidate_task_ids(app_id, user_id, user_ip,
+                                      limit=_window(limit))
+    if not task_ids:
+        return []
+    tasks = _load_tasks(random.sample(task_ids, min(limit, len(task_ids))))
+    # As discussed in GitHub #53 tasks have to be locked while they are
+    # transcribed: the task leases in pybossa.task_lease take care of it
+    answers = last_answers.get_many(tasks)
+    return [_with_last_answer(task, answers.get(task.id)) for task in tasks]
 
 
 def get_candidate_tasks(app_id, user_id=None, user_ip=None, n_answers=30, offset=0):
     """Gets all available tasks for a given project and user"""
-    rows = None
-    if user_id and not user_ip:
-        query = text('''
-                     SELECT id FROM task WHERE NOT EXISTS
-                     (SELECT task_id FROM task_run WHERE
-                     app_id=:app_id AND user_id=:user_id AND task_id=task.id)
-                     AND app_id=:app_id AND state !='completed'
-                     ORDER BY priority_0 DESC, id ASC LIMIT 10''')
-        rows = session.execute(query, dict(app_id=app_id, user_id=user_id))
-    else:
-        if not user_ip:
-            user_ip = '127.0.0.1'
-        query = text('''
-                     SELECT id FROM task WHERE NOT EXISTS
-                     (SELECT task_id FROM task_run WHERE
-                     app_id=:app_id AND user_ip=:user_ip AND task_id=task.id)
-                     AND app_id=:app_id AND state !='completed'
-                     ORDER BY priority_0 DESC, id ASC LIMIT 10''')
-        rows = session.execute(query, dict(app_id=app_id, user_ip=user_ip))
-
-    tasks = []
-    for t in rows:
-        tasks.append(session.query(Task).get(t.id))
-    return tasks
+    task_ids = get_candidate_task_ids(app_id, user_id, user_ip)
+    return _load_tasks(task_ids)
+
+
+def get_candidate_task_ids(app_id, user_id=None, user_ip=None, limit=10,
+                           order_by='priority_0 DESC, id ASC', filters=None,
+                           params=None):
+    """Return the ids of the open tasks of a project the user has not
+    answered yet.
+
+    This is the candidate query shared by all the schedulers: they only
+    change the order of the candidates (and may add extra SQL filters), and
+    then load just the tasks they return with _load_tasks. The tasks the
+    user has already answered are read from pybossa.seen_tasks, instead of
+    scanning the task_run table: the query reads enough candidates to skip
+    all of them, and they are dropped with SISMEMBER. For users that have
+    answered more than seen_tasks.MAX_CHECKED tasks they are excluded with
+    an SQL anti-join instead.
+
+    If task leases are enabled (TASK_LEASE_TIMEOUT), the tasks whose active
+    leases already cover the answers they still need are skipped.
+    """
+    n_rows = _lookahead(limit)
+    seen_key = seen_tasks.key(app_id, user_id, user_ip)
+    n_seen = seen_tasks.count(seen_key)
+    query_filters = [filters] if filters else []
+    query_params = dict(app_id=app_id)
+    if n_seen > seen_tasks.MAX_CHECKED:
+        seen_filter, seen_params = seen_tasks.sql_filter(app_id, user_id,
+                                                         user_ip)
+        query_filters.append(seen_filter)
+        query_params.update(seen_params)
+        n_seen = 0
+    extra_filters = ''.join('AND %s ' % f for f in query_filters)
+    query = text('''
+                 SELECT id, n_answers, n_task_runs FROM task
+                 WHERE app_id=:app_id AND state !='completed' %s
+                 ORDER BY %s LIMIT :limit''' % (extra_filters, order_by))
+    query_params['limit'] = n_rows + n_seen
+    query_params.update(params or {})
+    rows = session.execute(query, query_params).fetchall()
+    sched_metrics.count_candidates(len(rows))
+    if n_seen:
+        unseen = set(seen_tasks.unseen(seen_key, [row.id for row in rows]))
+        rows = [row for row in rows if row.id in unseen][:n_rows]
+    rows = _skip_leased_tasks(rows, user_id, user_ip)
+    return [row.id for row in rows[:limit]]
+
+
+def _leases_enabled():
+    return bool(current_app.config.get('TASK_LEASE_TIMEOUT'))
+
+
+def _lookahead(limit):
+    """Return how many candidates to read to serve limit tasks, with room to
+    skip the leased ones if task leases are enabled."""
+    return limit + LEASE_LOOKAHEAD if _leases_enabled() else limit
+
+
+def _skip_leased_tasks(rows, user_id=None, user_ip=None):
+    """Apply _skip_leased to the candidates (rows or tasks) if task leases
+    are enabled."""
+    if _leases_enabled() and rows:
+        return _skip_leased(rows, user_id, user_ip)
+    return rows
+
+
+def _skip_leased(rows, user_id=None, user_ip=None):
+    """Remove the candidates whose active leases (by other users) already
+    cover the answers they still need. If every candidate is covered none
+    is removed, so volunteers always get a task while there are any."""
+    leases = task_lease.n_leases([row.id for row in rows], user_id, user_ip)
+    available = [row for row in rows
+                 if leases[row.id] < (row.n_answers or 0) - (row.n_task_runs or 0)]
+    return available or rows
+
+
+def _window(limit):
+    """Return how many candidates to read to serve limit tasks, so offsets
+    keep working over the first (at least) 10 candidates."""
+    return max(CANDIDATES_WINDOW, limit)
+
+
+def _with_last_answer(task, last_answer):
+    """Return a copy of the task, not bound to the session, with its last
+    answer in info, so the task in the session is never modified."""
+    if last_answer is None:
+        return task
+    columns = dict((col.name, getattr(task, col.name))
+                   for col in Task.__table__.c)
+    columns['info'] = dict(task.info or {}, last_answer=last_answer)
+    return Task(**columns)
+
+
+def _first(tasks):
+    return tasks[0] if tasks else None
+
+
+def _load_tasks(task_ids):
+    """Load all the candidate tasks in one query, keeping their order."""
+    if not task_ids:
+        return []
+    tasks = session.query(Task).filter(Task.id.in_(task_ids)).all()
+    tasks_by_id = dict((task.id, task) for task in tasks)
+    return [tasks_by_id[task_id] for task_id in task_ids
+            if task_id in tasks_by_id]
+
+
+SCHEDULERS = {
+    'default': get_depth_first_tasks,
+    'breadth_first': get_breadth_first_tasks,
+    'depth_first': get_depth_first_tasks,
+    'depth_first_pool': get_depth_first_pool_tasks,
+    'random': get_random_tasks,
+    'incremental': get_incremental_tasks}
@@ -0,0 +1,155 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SF Isle of Man Limited
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Latency metrics of the task schedulers.
+
+Every scheduler call made through pybossa.sched.new_tasks is recorded,
+labelled by project and scheduler: the number of calls and of empty results,
+the total and maximum time spent, and the number of candidate tasks the
+scheduler considered. The schedulers report their candidates with
+count_candidates while the call is in progress.
+
+Every worker keeps the metrics in memory and adds them every few seconds to
+a Redis hash shared by all the workers, as pybossa.cache.metrics does. The
+maximum times are merged by a Lua script, so the flushes of several workers
+cannot overwrite a higher maximum.
+
+This module exports:
+    * start: start counting the candidates of a scheduler call
+    * count_candidates: add to the candidates of the call in progress
+    * stop: stop counting and return the candidates of the call
+    * record: record a scheduler call
+    * flush: add the metrics of this worker to Redis
+    * get_all: return the metrics of every project and scheduler
+    * reset: drop all the metrics
+
+"""
+import threading
+import time
+from pybossa.core import sentinel
+
+
+METRICS_KEY = 'pybossa:sched:metrics'
+FIELDS = ('calls', 'empty', 'candidates', 'time_us', 'max_time_us')
+FLUSH_INTERVAL = 10
+
+# ARGV holds the number of counters, the (field, increment) pairs of the
+# counters and then the (field, value) pairs of the maximums
+FLUSH_SCRIPT = """
+local n = tonumber(ARGV[1])
+for i = 2, 2 * n, 2 do
+    redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+for i = 2 * n + 2, #ARGV, 2 do
+    local current = tonumber(redis.call('HGET', KEYS[1], ARGV[i]) or '0')
+    if tonumber(ARGV[i + 1]) > current then
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+"""
+
+_counters = {}
+_maximums = {}
+_lock = threading.Lock()
+_last_flush = [time.time()]
+_current = threading.local()
+
+
+def start():
+    """Start counting the candidates of a scheduler call in this thread."""
+    _current.candidates = 0
+
+
+def count_candidates(n):
+    """Add n to the candidates considered by the scheduler call in progress
+    in this thread, if any."""
+    if getattr(_current, 'candidates', None) is not None:
+        _current.candidates += n
+
+
+def stop():
+    """Stop counting and return the candidates of the call in this
+    thread."""
+    candidates = getattr(_current, 'candidates', None) or 0
+    _current.candidates = None
+    return candidates
+
+
+def record(app_id, sched, elapsed, n_candidates, n_tasks):
+    """Record a call to a scheduler that took elapsed seconds, considered
+    n_candidates tasks and returned n_tasks tasks, and flush the metrics to
+    Redis if they have not been flushed for a while."""
+    prefix = '%s:%s:' % (app_id, sched)
+    elapsed_us = int(round(elapsed * 1000000))
+    increments = dict(calls=1, candidates=n_candidates, time_us=elapsed_us,
+                      empty=int(n_tasks == 0))
+    with _lock:
+        for name, increment in increments.items():
+            _counters[prefix + name] = (_counters.get(prefix + name, 0) +
+                                        increment)
+        field = prefix + 'max_time_us'
+        _maximums[field] = max(_maximums.get(field, 0), elapsed_us)
+    if time.time() - _last_flush[0] > FLUSH_INTERVAL:
+        flush()
+
+
+def flush():
+    """Add the metrics of this worker to Redis, and reset them."""
+    with _lock:
+        counters = _counters.copy()
+        maximums = _maximums.copy()
+        _counters.clear()
+        _maximums.clear()
+        _last_flush[0] = time.time()
+    if not counters and not maximums:
+        return
+    args = [len(counters)]
+    for field, value in counters.items() + maximums.items():
+        args.extend([field, value])
+    sentinel.master.eval(FLUSH_SCRIPT, 1, METRICS_KEY, *args)
+
+
+def get_all():
+    """Return a list of dicts with the metrics of every project and
+    scheduler of all the workers, slowest (by average time) first."""
+    flush()
+    metrics = {}
+    for field, value in sentinel.slave.hgetall(METRICS_KEY).items():
+        app_id, field = field.split(':', 1)
+        sched, name = field.rsplit(':', 1)
+        entry = metrics.setdefault((app_id, sched),
+                                   dict.fromkeys(FIELDS, 0))
+        entry[name] = int(value)
+    out = []
+    for (app_id, sched), entry in metrics.items():
+        calls = entry['calls'] or 1
+        out.append(dict(app_id=int(app_id), sched=sched,
+                        calls=entry['calls'],
+                        empty=entry['empty'],
+                        avg_candidates=float(entry['candidates']) / calls,
+                        avg_ms=entry['time_us'] / 1000.0 / calls,
+                        max_ms=entry['max_time_us'] / 1000.0))
+    return sorted(out, key=lambda entry: entry['avg_ms'], reverse=True)
+
+
+def reset():
+    """Drop all the metrics, of this worker and in Redis."""
+    with _lock:
+        _counters.clear()
+        _maximums.clear()
+    sentinel.master.delete(METRICS_KEY)
@@ -0,0 +1,218 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SF Isle of Man Limited
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Index of the tasks every user has already answered.
+
+Every (project, user) pair gets a Redis set with the ids of the tasks the user
+has answered, so the schedulers and the availability counts can exclude them
+without scanning the task_run table. Sets are seeded lazily from the task_run
+table, kept up to date by the TaskRun model events, and dropped after a while
+of inactivity. They can be rebuilt from the task_run table with the
+rebuild_seen_tasks command of cli.py, e.g. after losing Redis data.
+
+The task runs are added to the sets even if they are not seeded yet, so a
+seeding that read the task_run table before the task run was committed does
+not lose it: the set is only flagged as seeded by the seeding itself.
+
+The keys of the sets of every project are tracked in an index set, so they
+can be dropped without scanning the whole keyspace.
+
+Candidate tasks are checked against the set of a user with SISMEMBER. For
+users that have answered more than MAX_CHECKED tasks of a project, the
+queries exclude them with an SQL anti-join over the task_run table instead.
+
+This module exports:
+    * add: record that a user has answered a task
+    * remove: forget that a user has answered a task
+    * seen_task_ids: return the ids of the tasks a user has answered
+    * key: return the key of the set of a user, seeding it if needed
+    * members: return the ids of the tasks in the set of a user
+    * count: return the number of tasks in the set of a user
+    * unseen: return the given tasks that are not in the set of a user
+    * sql_filter: return an SQL condition that excludes the tasks a user
+      has answered
+    * reset: drop the sets of a project, so they are seeded again
+    * rebuild: rebuild the sets from the task_run table
+
+"""
+from sqlalchemy.sql import text
+from pybossa.core import db, sentinel
+
+
+SEEN_KEY = 'pybossa:sched:seen:app:%s:user:%s'
+# The keys of the sets of a project, and the projects that have sets
+SEEN_INDEX_KEY = 'pybossa:sched:seen:index:app:%s'
+SEEN_APPS_KEY = 'pybossa:sched:seen:index'
+# Sets of idle users are dropped after one hour
+SEEN_TIMEOUT = 60 * 60
+# Task ids start at 1, so 0 flags a set as seeded from the DB
+SEEDED_MARKER = 0
+SEED_CHUNK = 10000
+# Users with more answered tasks are excluded with sql_filter
+MAX_CHECKED = 1000
+
+
+def _user_key(user_id=None, user_ip=None):
+    if user_id is None and not user_ip:
+        user_ip = '127.0.0.1'
+    return user_id or user_ip
+
+
+def add(app_id, task_id, user_id=None, user_ip=None):
+    """Record that a user has answered a task, creating their set if it is
+    missing. It is still seeded from the task_run table when it is used."""
+    seen_key = SEEN_KEY % (app_id, _user_key(user_id, user_ip))
+    p = sentinel.master.pipeline()
+    p.sadd(seen_key, task_id)
+    p.expire(seen_key, SEEN_TIMEOUT)
+    _track(p, app_id, seen_key)
+    p.execute()
+
+
+def remove(app_id, task_id, user_id=None, user_ip=None):
+    """Forget that a user has answered a task."""
+    sentinel.master.srem(SEEN_KEY % (app_id, _user_key(user_id, user_ip)),
+                         task_id)
+
+
+def seen_task_ids(app_id, user_id=None, user_ip=None):
+    """Return a list with the ids of the tasks a user has answered."""
+    return members(key(app_id, user_id, user_ip))
+
+
+def members(seen_key):
+    """Return a list with the ids of the tasks in the set seen_key."""
+    task_ids = sentinel.master.smembers(seen_key)
+    return [int(task_id) for task_id in task_ids
+            if int(task_id) != SEEDED_MARKER]
+
+
+def count(seen_key):
+    """Return the number of tasks in the set seen_key."""
+    return max(sentinel.master.scard(seen_key) - 1, 0)
+
+
+def unseen(seen_key, task_ids):
+    """Return the ids in task_ids that are not in the set seen_key, in the
+    same order."""
+    p = sentinel.master.pipeline()
+    for task_id in task_ids:
+        p.sismember(seen_key, task_id)
+    return [task_id for task_id, seen in zip(task_ids, p.execute())
+            if not seen]
+
+
+def sql_filter(app_id, user_id=None, user_ip=None):
+    """Return an SQL condition over the task table that excludes the tasks a
+    user has answered, and the parameters it needs."""
+    if user_id and not user_ip:
+        column, value = 'user_id', user_id
+    else:
+        column, value = 'user_ip', _user_key(user_id, user_ip)
+    condition = '''NOT EXISTS (SELECT 1 FROM task_run
+                   WHERE task_run.task_id=task.id
+                   AND task_run.app_id=:seen_app_id
+                   AND task_run.%s=:seen_user)''' % column
+    return condition, dict(seen_app_id=app_id, seen_user=value)
+
+
+def key(app_id, user_id=None, user_ip=None):
+    """Return the key of the set of a user, seeding it from the task_run table
+    if it is missing."""
+    seen_key = SEEN_KEY % (app_id, _user_key(user_id, user_ip))
+    index_key = SEEN_INDEX_KEY % app_id
+    if sentinel.master.sismember(seen_key, SEEDED_MARKER):
+        # The index outlives all the sets it tracks
+        p = sentinel.master.pipeline()
+        p.expire(seen_key, SEEN_TIMEOUT)
+        p.expire(index_key, SEEN_TIMEOUT)
+        p.execute()
+        return seen_key
+    if user_id and not user_ip:
+        sql = text('''SELECT task_id FROM task_run WHERE app_id=:app_id
+                   AND user_id=:user_id;''')
+        results = db.session.execute(sql, dict(app_id=app_id,
+                                               user_id=user_id))
+    else:
+        sql = text('''SELECT task_id FROM task_run WHERE app_id=:app_id
+                   AND user_ip=:user_ip;''')
+        results = db.session.execute(
+            sql, dict(app_id=app_id, user_ip=_user_key(user_id, user_ip)))
+    p = sentinel.master.pipeline()
+    p.sadd(seen_key, SEEDED_MARKER)
+    for row in results:
+        p.sadd(seen_key, row.task_id)
+    p.expire(seen_key, SEEN_TIMEOUT)
+    _track(p, app_id, seen_key)
+    p.execute()
+    return seen_key
+
+
+def reset(app_id):
+    """Drop the sets of all the users of a project."""
+    _delete_sets([app_id])
+
+
+def rebuild(app_id=None):
+    """Rebuild the sets of a project, or of all of them, from the task_run
+    table. Return the number of sets built."""
+    if app_id:
+        _delete_sets([app_id])
+    else:
+        _delete_sets(sentinel.master.smembers(SEEN_APPS_KEY))
+    sql = '''SELECT app_id, COALESCE(CAST(user_id AS TEXT), user_ip) AS usr,
+             task_id FROM task_run'''
+    if app_id:
+        sql += ' WHERE app_id=:app_id'
+    results = db.session.execute(text(sql).execution_options(stream=True),
+                                 dict(app_id=app_id))
+    seen_keys = set()
+    p = sentinel.master.pipeline()
+    for n, row in enumerate(results, 1):
+        seen_key = SEEN_KEY % (row.app_id, row.usr or '127.0.0.1')
+        if seen_key not in seen_keys:
+            seen_keys.add(seen_key)
+            p.sadd(seen_key, SEEDED_MARKER)
+            p.expire(seen_key, SEEN_TIMEOUT)
+            _track(p, row.app_id, seen_key)
+        p.sadd(seen_key, row.task_id)
+        if n % SEED_CHUNK == 0:
+            p.execute()
+    p.execute()
+    return len(seen_keys)
+
+
+def _track(pipeline, app_id, seen_key):
+    """Add a set to the index of its project, with the pipeline."""
+    pipeline.sadd(SEEN_INDEX_KEY % app_id, seen_key)
+    pipeline.expire(SEEN_INDEX_KEY % app_id, SEEN_TIMEOUT)
+    pipeline.sadd(SEEN_APPS_KEY, app_id)
+
+
+def _delete_sets(app_ids):
+    """Drop the sets in the indexes of the given projects. The sets added to
+    an index in the meantime are kept in it."""
+    for app_id in app_ids:
+        index_key = SEEN_INDEX_KEY % app_id
+        seen_keys = list(sentinel.master.smembers(index_key))
+        if not seen_keys:
+            continue
+        p = sentinel.master.pipeline()
+        p.delete(*seen_keys)
+        p.srem(index_key, *seen_keys)
+        p.execute()
@@ -1,3 +1,6 @@
+import bisect
+import hashlib
+from collections import namedtuple, OrderedDict
 from redis import sentinel
 
 
@@ -11,5 +14,124 @@ class Sentinel(object):
     def init_app(self, app):
         self.connection = sentinel.Sentinel(app.config['REDIS_SENTINEL'],
                                                   socket_timeout=0.1)
-        self.master = self.connection.master_for('mymaster')
-        self.slave = self.connection.slave_for('mymaster')
+        master_name = app.config.get('REDIS_MASTER', 'mymaster')
+        self.master = self.connection.master_for(master_name)
+        self.slave = self.connection.slave_for(master_name)
+
+
+Shard = namedtuple('Shard', ['name', 'master', 'slave'])
+
+
+class ShardedSentinel(object):
+
+    """Sentinel managed Redis masters (shards) for the cache, with the keys
+    routed by consistent hashing.
+
+    The shards are the REDIS_CACHE_MASTERS monitored by the
+    REDIS_CACHE_SENTINEL sentinels (REDIS_SENTINEL by default). If there are
+    none, the cache uses the REDIS_MASTER instance. master and slave are the
+    connections of the first shard, for the values that are not routed by
+    key.
+
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        if app is not None: # pragma: no cover
+            self.init_app(app)
+
+    def init_app(self, app):
+        sentinels = (app.config.get('REDIS_CACHE_SENTINEL') or
+                     app.config['REDIS_SENTINEL'])
+        masters = (app.config.get('REDIS_CACHE_MASTERS') or
+                   [app.config.get('REDIS_MASTER', 'mymaster')])
+        self.connection = sentinel.Sentinel(sentinels, socket_timeout=0.1)
+        self.shards = OrderedDict(
+            (name, Shard(name, self.connection.master_for(name),
+                         self.connection.slave_for(name)))
+            for name in masters)
+        self.ring = HashRing(self.shards.keys())
+        first = self.shards.values()[0]
+        self.master = first.master
+        self.slave = first.slave
+
+    def shard(self, key):
+        """Return the shard of a key."""
+        return self.shards[self.ring.get_node(key)]
+
+    def group(self, keys):
+        """Return a list of (shard, indexes) with the indexes of the keys
+        stored in every shard."""
+        groups = OrderedDict()
+        for i, key in enumerate(keys):
+            groups.setdefault(self.ring.get_node(key), []).append(i)
+        return [(self.shards[name], indexes)
+                for name, indexes in groups.items()]
+
+    def pipeline(self):
+        return ShardedPipeline(self)
+
+
+class ShardedPipeline(object):
+
+    """Pipeline on the masters of a ShardedSentinel.
+
+    Every command is queued in the pipeline of the shard of its first
+    argument, the key, so multi-key commands are not supported. execute runs
+    the pipelines, one round trip per shard, and returns the results in the
+    order the commands were queued.
+
+    """
+
+    def __init__(self, sharded):
+        self.sharded = sharded
+        self.pipelines = OrderedDict()
+        self._order = []
+
+    def __getattr__(self, name):
+        def command(key, *args, **kwargs):
+            shard = self.sharded.shard(key)
+            if shard.name not in self.pipelines:
+                self.pipelines[shard.name] = [shard.master.pipeline(), 0]
+            pipeline = self.pipelines[shard.name]
+            getattr(pipeline[0], name)(key, *args, **kwargs)
+            self._order.append((shard.name, pipeline[1]))
+            pipeline[1] += 1
+            return self
+        return command
+
+    def execute(self):
+        results = dict((name, pipeline.execute())
+                       for name, (pipeline, n) in self.pipelines.items())
+        return [results[name][i] for name, i in self._order]
+
+
+class HashRing(object):
+
+    """Consistent hashing of keys to nodes.
+
+    Every node gets a number of points in the ring, and a key belongs to the
+    node of the first point after its hash. Adding or removing a node only
+    moves the keys of its points.
+
+    """
+
+    def __init__(self, nodes, replicas=160):
+        self.nodes = list(nodes)
+        points = sorted((_hash('%s:%s' % (node, i)), node)
+                        for node in self.nodes for i in range(replicas))
+        self._hashes = [point[0] for point in points]
+        self._nodes = [point[1] for point in points]
+
+    def get_node(self, key):
+        """Return the node of a key."""
+        if len(self.nodes) == 1:
+            return self.nodes[0]
+        i = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[i]
+
+
+def _hash(key):
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    return int(hashlib.md5(key).hexdigest()[:8], 16)
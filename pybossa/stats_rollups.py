@@ -0,0 +1,225 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SF Isle of Man Limited
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Rollups of the answers of every project by day and by hour of the day.
+
+The project stats read the app_stats_day and app_stats_hour tables instead of
+scanning the task_run table, so their cost depends on the number of days,
+not on the number of answers. The rows are kept up to date by the TaskRun
+model events, and can be rebuilt from the task_run table with the
+rebuild_stats_rollups command of cli.py, e.g. after a bulk insert that skips
+the model events. Until then, the stats of the projects whose rollups do not
+count all their task runs are read from the task_run table.
+
+This module exports:
+    * add_answer: count a new task run, and the task it completes
+    * remove_answer: discount a deleted task run
+    * complete: whether the rollups of a project count all its task runs
+    * rebuild: rebuild the rollups from the task_run table, in chunks of tasks
+
+"""
+from sqlalchemy import and_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import text
+from pybossa.core import db
+from pybossa.model.app_stats import AppStatsDay, AppStatsHour
+
+
+REBUILD_CHUNK = 10000
+
+
+def _user_type(user_id):
+    return 'anon' if user_id is None else 'auth'
+
+
+def _day_and_hour(finished_at):
+    if finished_at is None:
+        return None, None
+    return finished_at.date(), finished_at.hour
+
+
+def add_answer(conn, task_run, completed=False):
+    """Count a task run inserted with the given connection. If completed,
+    its task got the last answer it needed."""
+    day, hour = _day_and_hour(task_run.finished_at)
+    if day is None:
+        return
+    user_type = _user_type(task_run.user_id)
+    _increment(conn, AppStatsDay.__table__,
+               dict(app_id=task_run.app_id, day=day),
+               {'n_answers_%s' % user_type: 1,
+                'n_completed_tasks': 1 if completed else 0})
+    _increment(conn, AppStatsHour.__table__,
+               dict(app_id=task_run.app_id, hour=hour, user_type=user_type),
+               dict(n_answers=1))
+
+
+def remove_answer(conn, task_run):
+    """Discount a task run deleted with the given connection. If its task
+    was completed, the completion is moved to the day of the answer that
+    completes it now, or discounted if it is no longer completed."""
+    day, hour = _day_and_hour(task_run.finished_at)
+    if day is not None:
+        user_type = _user_type(task_run.user_id)
+        _increment(conn, AppStatsDay.__table__,
+                   dict(app_id=task_run.app_id, day=day),
+                   {'n_answers_%s' % user_type: -1}, insert=False)
+        _increment(conn, AppStatsHour.__table__,
+                   dict(app_id=task_run.app_id, hour=hour,
+                        user_type=user_type),
+                   dict(n_answers=-1), insert=False)
+    _move_completion(conn, task_run)
+
+
+def _move_completion(conn, task_run):
+    """Move the completion of the task of a deleted task run to the day of
+    its n_answers-th remaining answer (by id), as rebuild counts it."""
+    sql = text('SELECT n_answers FROM task WHERE id=:task_id')
+    n_answers = conn.execute(sql, task_id=task_run.task_id).scalar()
+    if not n_answers:
+        return
+    sql = text('''SELECT id, finished_at FROM task_run WHERE task_id=:task_id
+               ORDER BY id LIMIT :limit''')
+    rows = conn.execute(sql, task_id=task_run.task_id,
+                        limit=n_answers).fetchall()
+    answers = sorted([(row.id, row.finished_at) for row in rows] +
+                     [(task_run.id, task_run.finished_at)])
+    if len(answers) < n_answers:
+        return
+    old_day = _day_and_hour(answers[n_answers - 1][1])[0]
+    new_day = None
+    if len(rows) == n_answers:
+        new_day = _day_and_hour(rows[-1].finished_at)[0]
+    if old_day == new_day:
+        return
+    if old_day is not None:
+        _increment(conn, AppStatsDay.__table__,
+                   dict(app_id=task_run.app_id, day=old_day),
+                   dict(n_completed_tasks=-1), insert=False)
+    if new_day is not None:
+        _increment(conn, AppStatsDay.__table__,
+                   dict(app_id=task_run.app_id, day=new_day),
+                   dict(n_completed_tasks=1))
+
+
+def complete(app_id, session=None):
+    """Return whether the rollups of a project count all its task runs, as
+    kept by the task.n_task_runs counters. They do not until rebuild runs,
+    nor while some task runs have no finished_at."""
+    session = session or db.slave_session
+    sql = text('''SELECT
+               (SELECT COALESCE(SUM(n_task_runs), 0) FROM task
+                WHERE app_id=:app_id) =
+               (SELECT COALESCE(SUM(n_answers_anon + n_answers_auth), 0)
+                FROM app_stats_day WHERE app_id=:app_id)''')
+    return bool(session.execute(sql, dict(app_id=app_id)).scalar())
+
+
+def _increment(conn, table, keys, counters, insert=True):
+    """Add to the counters of the row with the given keys, inserting it if it
+    does not exist yet and insert is True."""
+    where = and_(*[table.c[name] == value for name, value in keys.items()])
+    values = dict((name, table.c[name] + n) for name, n in counters.items())
+    update = table.update().where(where).values(**values)
+    if conn.execute(update).rowcount or not insert:
+        return
+    savepoint = conn.begin_nested()
+    try:
+        conn.execute(table.insert().values(**dict(keys, **counters)))
+        savepoint.commit()
+    except IntegrityError:
+        # Inserted by a concurrent transaction in the meantime
+        savepoint.rollback()
+        conn.execute(update)
+
+
+def rebuild(app_id=None):
+    """Rebuild the rollups of a project, or of all of them, from the task_run
+    table. The tasks are read in chunks of REBUILD_CHUNK ids, committing each
+    chunk. Return the number of task runs counted.
+
+    The answers posted while it runs may be counted twice, so run it while
+    the projects are quiet.
+
+    """
+    where = ' AND task_run.app_id=:app_id' if app_id else ''
+    params = dict(app_id=app_id)
+    for table in (AppStatsDay.__table__, AppStatsHour.__table__):
+        delete = table.delete()
+        if app_id:
+            delete = delete.where(table.c.app_id == app_id)
+        db.session.execute(delete)
+    sql = 'SELECT MIN(id), MAX(id) FROM task'
+    if app_id:
+        sql += ' WHERE app_id=:app_id'
+    first_id, last_id = db.session.execute(text(sql), params).fetchone()
+    db.session.commit()
+    if first_id is None:
+        return 0
+    n_task_runs = 0
+    for low in range(first_id, last_id + 1, REBUILD_CHUNK):
+        params.update(low=low, high=low + REBUILD_CHUNK - 1)
+        n_task_runs += _rebuild_chunk(where, params)
+        db.session.commit()
+    return n_task_runs
+
+
+def _rebuild_chunk(where, params):
+    """Count the task runs of the tasks with ids between low and high."""
+    conn = db.session.connection()
+    chunk = ('task_run.task_id BETWEEN :low AND :high'
+             ' AND task_run.finished_at IS NOT NULL' + where)
+    sql = text('''SELECT task_run.app_id,
+               CAST(task_run.finished_at AS DATE) AS day,
+               SUM(CASE WHEN user_id IS NULL THEN 1 ELSE 0 END) AS n_anon,
+               SUM(CASE WHEN user_id IS NULL THEN 0 ELSE 1 END) AS n_auth
+               FROM task_run WHERE %s GROUP BY app_id, day;''' % chunk)
+    n_task_runs = 0
+    for row in conn.execute(sql, params):
+        n_task_runs += row.n_anon + row.n_auth
+        _increment(conn, AppStatsDay.__table__,
+                   dict(app_id=row.app_id, day=row.day),
+                   dict(n_answers_anon=row.n_anon, n_answers_auth=row.n_auth))
+    sql = text('''SELECT task_run.app_id,
+               CAST(EXTRACT(HOUR FROM task_run.finished_at) AS INTEGER)
+                    AS hour,
+               CASE WHEN user_id IS NULL THEN 'anon' ELSE 'auth' END
+                    AS user_type,
+               COUNT(task_run.id) AS n_answers
+               FROM task_run WHERE %s GROUP BY app_id, hour, user_type;'''
+               % chunk)
+    for row in conn.execute(sql, params):
+        _increment(conn, AppStatsHour.__table__,
+                   dict(app_id=row.app_id, hour=row.hour,
+                        user_type=row.user_type),
+                   dict(n_answers=row.n_answers))
+    # A task is completed by its n_answers-th task run, as in the TaskRun
+    # model events
+    sql = text('''SELECT app_id, day, COUNT(task_id) AS n_completed_tasks
+               FROM (SELECT task_run.app_id, task_run.task_id, task.n_answers,
+                     CAST(task_run.finished_at AS DATE) AS day,
+                     ROW_NUMBER() OVER (PARTITION BY task_run.task_id
+                                        ORDER BY task_run.id) AS n
+                     FROM task_run JOIN task ON task.id=task_run.task_id
+                     WHERE %s) AS answers
+               WHERE n=n_answers GROUP BY app_id, day;''' % chunk)
+    for row in conn.execute(sql, params):
+        _increment(conn, AppStatsDay.__table__,
+                   dict(app_id=row.app_id, day=row.day),
+                   dict(n_completed_tasks=row.n_completed_tasks))
+    return n_task_runs
@@ -0,0 +1,84 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SF Isle of Man Limited
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Task leases for the task schedulers.
+
+When a task is sent to a volunteer a lease is recorded for it, so the
+schedulers can skip the tasks that already have enough volunteers working on
+them to collect all the answers they still need. Leases are stored in Redis,
+one sorted set per task with the expiration time of every lease as score, so
+they expire on their own, and they are released when the volunteer posts the
+task run.
+
+This module exports:
+    * acquire: record a lease of a task for a user
+    * release: remove the lease of a task for a user
+    * clear: remove all the leases of a task
+    * n_leases: return the number of active leases of some tasks
+
+"""
+import time
+from pybossa.core import sentinel
+
+
+LEASE_KEY = 'pybossa:sched:lease:task:%s'
+
+
+def _user_key(user_id=None, user_ip=None):
+    return user_id or user_ip or '127.0.0.1'
+
+
+def acquire(task_ids, timeout, user_id=None, user_ip=None):
+    """Record a lease of the given tasks for a user, during timeout seconds."""
+    expires = time.time() + timeout
+    usr = _user_key(user_id, user_ip)
+    p = sentinel.master.pipeline()
+    for task_id in task_ids:
+        key = LEASE_KEY % task_id
+        p.zadd(key, expires, usr)
+        p.expire(key, timeout)
+    p.execute()
+
+
+def release(task_id, user_id=None, user_ip=None):
+    """Remove the lease of a task for a user."""
+    sentinel.master.zrem(LEASE_KEY % task_id, _user_key(user_id, user_ip))
+
+
+def clear(task_id):
+    """Remove all the leases of a task."""
+    sentinel.master.delete(LEASE_KEY % task_id)
+
+
+def n_leases(task_ids, user_id=None, user_ip=None):
+    """Return a dict with the number of active leases of every task, not
+    counting the lease of the given user."""
+    now = time.time()
+    usr = _user_key(user_id, user_ip)
+    p = sentinel.master.pipeline()
+    for task_id in task_ids:
+        p.zcount(LEASE_KEY % task_id, now, '+inf')
+        p.zscore(LEASE_KEY % task_id, usr)
+    results = p.execute()
+    leases = {}
+    for i, task_id in enumerate(task_ids):
+        count, own_lease = results[2 * i], results[2 * i + 1]
+        if own_lease is not None and own_lease >= now:
+            count -= 1
+        leases[task_id] = count
+    return leases
@@ -0,0 +1,258 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SF Isle of Man Limited
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Redis-backed pool of open tasks for the task schedulers.
+
+Every project gets a sorted set with the ids of its open (not completed)
+tasks, ordered like get_candidate_tasks does (priority_0 DESC, id ASC). It is
+seeded lazily from the DB and kept up to date by the Task and TaskRun model
+events. The tasks a user has already answered are read from the index in
+pybossa.seen_tasks.
+
+A pool is built in a temporary key that replaces the current one once it is
+complete, by one worker at a time, which extends its lock while it reads the
+tasks. The tasks added or removed meanwhile are
+applied to both. Until a pool is built, candidates and random_candidates
+return None and the schedulers read the candidates from the DB.
+
+This module exports:
+    * add_task: add (or re-rank) a task in the pool of its project
+    * remove_task: remove a task from the pool of its project
+    * candidates: return the ordered ids of the tasks a user can answer
+    * random_candidates: return the ids of random tasks a user can answer
+    * reset: drop the pool of a project, so it is seeded again
+
+"""
+import random
+import uuid
+from sqlalchemy.sql import text
+from pybossa.core import db, sentinel
+from pybossa import seen_tasks
+
+
+POOL_KEY = 'pybossa:sched:pool:app:%s'
+POOL_SEEDED_KEY = 'pybossa:sched:pool:app:%s:seeded'
+POOL_TMP_KEY = 'pybossa:sched:pool:app:%s:tmp:%s'
+# Only one worker builds a pool at a time. The lock holds the key of the
+# pool being built, and it is extended after every SEED_CHUNK tasks read
+POOL_LOCK_KEY = 'pybossa:sched:pool:app:%s:lock'
+POOL_LOCK_TIMEOUT = 60
+# Pools are rebuilt from the DB once a day, so bulk SQL updates that skip the
+# model events cannot leave them out of sync forever
+POOL_TIMEOUT = 24 * 60 * 60
+SEED_CHUNK = 10000
+PAGE_SIZE = 100
+# Random tasks drawn from a pool for every task asked to random_candidates
+RANDOM_DRAWS = 20
+
+# Add (ARGV[1] is ZADD) the member ARGV[2] with the score ARGV[3] to the pool
+# KEYS[1] if it is seeded (KEYS[2]), or remove it (ZREM). While the pool is
+# being built (KEYS[3] is locked) the new pool gets the change too
+UPDATE_SCRIPT = """
+local function update(key)
+    if ARGV[1] == 'ZADD' then
+        redis.call('ZADD', key, ARGV[3], ARGV[2])
+    else
+        redis.call('ZREM', key, ARGV[2])
+    end
+end
+if ARGV[1] == 'ZREM' or redis.call('EXISTS', KEYS[2]) == 1 then
+    update(KEYS[1])
+end
+local tmp_key = redis.call('GET', KEYS[3])
+if tmp_key then
+    update(tmp_key)
+end
+"""
+
+# Replace the pool (KEYS[2]) with the one built in KEYS[1], mark it as seeded
+# (KEYS[3]) for ARGV[1] seconds and release the lock (KEYS[4]) at once. If
+# the lock is no longer held for KEYS[1], e.g. after a reset, the new pool is
+# dropped and 0 is returned
+REPLACE_SCRIPT = """
+if redis.call('GET', KEYS[4]) ~= KEYS[1] then
+    redis.call('DEL', KEYS[1])
+    return 0
+end
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('RENAME', KEYS[1], KEYS[2])
+    redis.call('PERSIST', KEYS[2])
+else
+    redis.call('DEL', KEYS[2])
+end
+redis.call('SET', KEYS[3], 1, 'EX', ARGV[1])
+redis.call('DEL', KEYS[4])
+return 1
+"""
+
+# Extend the lock KEYS[2] and the pool built in KEYS[1] for ARGV[1] seconds
+# if the lock is still held for it. Otherwise drop the pool and return 0
+EXTEND_SCRIPT = """
+if redis.call('GET', KEYS[2]) ~= KEYS[1] then
+    redis.call('DEL', KEYS[1])
+    return 0
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return 1
+"""
+
+# Drop the pool built in KEYS[1] and release the lock KEYS[2] if it is still
+# held for it
+RELEASE_SCRIPT = """
+redis.call('DEL', KEYS[1])
+if redis.call('GET', KEYS[2]) == KEYS[1] then
+    redis.call('DEL', KEYS[2])
+end
+"""
+
+
+def _member(task_id):
+    """Return the pool member for a task id.
+
+    Members are zero padded so tasks with the same priority are returned in
+    ascending id order, as Redis sorts ties lexicographically.
+
+    """
+    return '%012d' % int(task_id)
+
+
+def _score(priority_0):
+    return -float(priority_0 or 0)
+
+
+def add_task(app_id, task_id, priority_0=0):
+    """Add a task to the pool of its project if the pool is being used."""
+    _update(app_id, 'ZADD', task_id, _score(priority_0))
+
+
+def remove_task(app_id, task_id):
+    """Remove a task from the pool of its project."""
+    _update(app_id, 'ZREM', task_id)
+
+
+def _update(app_id, command, task_id, score=0):
+    sentinel.master.eval(UPDATE_SCRIPT, 3, POOL_KEY % app_id,
+                         POOL_SEEDED_KEY % app_id, POOL_LOCK_KEY % app_id,
+                         command, _member(task_id), score)
+
+
+def reset(app_id):
+    """Drop the pool of a project. It will be seeded again on next use, and
+    a pool being built from older data is discarded."""
+    p = sentinel.master.pipeline()
+    p.delete(POOL_SEEDED_KEY % app_id)
+    p.delete(POOL_KEY % app_id)
+    p.delete(POOL_LOCK_KEY % app_id)
+    p.execute()
+
+
+def candidates(app_id, user_id=None, user_ip=None, limit=10):
+    """Return up to limit ids of open tasks the user has not answered yet,
+    or None if the pool is being built by another worker.
+
+    The ids are sorted by priority_0 DESC, id ASC, the same order used by
+    pybossa.sched.get_candidate_tasks.
+
+    """
+    if not _seed_pool(app_id):
+        return None
+    answered_key = seen_tasks.key(app_id, user_id, user_ip)
+    pool_key = POOL_KEY % app_id
+    task_ids = []
+    start = 0
+    while len(task_ids) < limit:
+        members = sentinel.master.zrange(pool_key, start, start + PAGE_SIZE - 1)
+        if not members:
+            break
+        p = sentinel.master.pipeline()
+        for member in members:
+            p.sismember(answered_key, int(member))
+        answered = p.execute()
+        task_ids += [int(member) for member, done in zip(members, answered)
+                     if not done]
+        start += PAGE_SIZE
+    return task_ids[:limit]
+
+
+def random_candidates(app_id, user_id=None, user_ip=None, limit=1):
+    """Return up to limit distinct ids of open tasks the user has not
+    answered yet, picked uniformly at random, or None if the pool is being
+    built by another worker or the draws do not find enough of them.
+
+    Up to RANDOM_DRAWS random ranks of the pool are drawn for every task
+    asked, and the tasks the user has answered are rejected, so every task
+    the user can answer is equally likely and the cost does not depend on
+    the size of the pool. If the user has answered most of the tasks and the
+    draws are not enough, the caller reads the tasks from the DB instead.
+
+    """
+    if not _seed_pool(app_id):
+        return None
+    answered_key = seen_tasks.key(app_id, user_id, user_ip)
+    pool_key = POOL_KEY % app_id
+    size = sentinel.master.zcard(pool_key)
+    ranks = random.sample(xrange(size), min(size, RANDOM_DRAWS * limit))
+    p = sentinel.master.pipeline()
+    for rank in ranks:
+        p.zrange(pool_key, rank, rank)
+    drawn = [int(members[0]) for members in p.execute() if members]
+    task_ids = seen_tasks.unseen(answered_key, drawn)[:limit]
+    # If the whole pool was drawn there are no more tasks to find
+    if len(task_ids) < limit and len(ranks) < size:
+        return None
+    return task_ids
+
+
+def _seed_pool(app_id):
+    """Build the pool of a project from the task table if it is missing.
+    Return False if it is still being built."""
+    if sentinel.master.exists(POOL_SEEDED_KEY % app_id):
+        return True
+    lock_key = POOL_LOCK_KEY % app_id
+    tmp_key = POOL_TMP_KEY % (app_id, uuid.uuid4().hex)
+    if not sentinel.master.set(lock_key, tmp_key, nx=True,
+                               ex=POOL_LOCK_TIMEOUT):
+        return False
+    try:
+        sql = text('''SELECT id, priority_0 FROM task WHERE app_id=:app_id
+                   AND state !='completed';''').execution_options(stream=True)
+        results = db.slave_session.execute(sql, dict(app_id=app_id))
+        p = sentinel.master.pipeline()
+        for n, row in enumerate(results, 1):
+            p.zadd(tmp_key, _score(row.priority_0), _member(row.id))
+            if n % SEED_CHUNK == 0 and not _extend_lock(p, tmp_key, lock_key):
+                return False
+        if not _extend_lock(p, tmp_key, lock_key):
+            return False
+        return sentinel.master.eval(REPLACE_SCRIPT, 4, tmp_key,
+                                    POOL_KEY % app_id,
+                                    POOL_SEEDED_KEY % app_id, lock_key,
+                                    POOL_TIMEOUT) == 1
+    except Exception:
+        sentinel.master.eval(RELEASE_SCRIPT, 2, tmp_key, lock_key)
+        raise
+
+
+def _extend_lock(pipeline, tmp_key, lock_key):
+    """Execute the pipeline that is building a pool, extending its lock so
+    no other worker starts building it while the build goes on. The pool of
+    a worker that dies is dropped with its lock. Return False if the lock
+    was lost, e.g. after a reset."""
+    pipeline.eval(EXTEND_SCRIPT, 2, tmp_key, lock_key, POOL_LOCK_TIMEOUT)
+    return pipeline.execute()[-1] == 1
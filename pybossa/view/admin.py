@@ -33,8 +33,11 @@ import pybossa.model as model
 from pybossa.util import admin_required, UnicodeWriter
 from pybossa.cache import apps as cached_apps
 from pybossa.cache import categories as cached_cat
+from pybossa.cache import metrics as cache_metrics
+from pybossa.cache import get_counters, reset_counters
 from pybossa.auth import require
 from pybossa.core import project_repo, user_repo
+from pybossa import sched, sched_metrics
 import json
 from StringIO import StringIO
 
@@ -105,6 +108,32 @@ def featured(app_id=None):
         return abort(500)
 
 
+@blueprint.route('/schedulers', methods=['GET', 'DELETE'])
+@login_required
+@admin_required
+def schedulers():
+    """Return the available task schedulers and their latency metrics, by
+    project, in JSON. DELETE resets the metrics."""
+    if request.method == 'DELETE':
+        sched_metrics.reset()
+    data = dict(schedulers=sorted(sched.get_schedulers()),
+                metrics=sched_metrics.get_all())
+    return Response(json.dumps(data), mimetype='application/json')
+
+
+@blueprint.route('/cache', methods=['GET', 'DELETE'])
+@login_required
+@admin_required
+def cache():
+    """Return the metrics of the cached functions of all the workers in JSON.
+    DELETE resets them."""
+    if request.method == 'DELETE':
+        cache_metrics.reset()
+        reset_counters()
+    data = dict(metrics=cache_metrics.get_all(), counters=get_counters())
+    return Response(json.dumps(data), mimetype='application/json')
+
+
 @blueprint.route('/users', methods=['GET', 'POST'])
 @login_required
 @admin_required
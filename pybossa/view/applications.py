@@ -389,7 +389,7 @@ def update(short_name):
         project_repo.add_log_entry(new_application, 'update', 'web')
         project_repo.update(new_application)
         cached_apps.delete_app(short_name)
-        cached_apps.reset()
+        cached_apps.clean(new_application.id)
         cached_cat.reset()
         cached_apps.get_app(new_application.short_name)
         flash(gettext('Project updated!'), 'success')
@@ -823,10 +823,6 @@ def delete_tasks(short_name):
         task_repo.delete_all(tasks)
         msg = gettext("All the tasks and associated task runs have been deleted")
         flash(msg, 'success')
-        cached_apps.delete_last_activity(app.id)
-        cached_apps.delete_n_tasks(app.id)
-        cached_apps.delete_n_task_runs(app.id)
-        cached_apps.delete_overall_progress(app.id)
         return redirect(url_for('.tasks', short_name=app.short_name))
 
 
@@ -1178,6 +1174,10 @@ def task_scheduler(short_name):
      overall_progress, last_activity) = app_by_shortname(short_name)
     title = app_title(app, gettext('Task Scheduler'))
     form = TaskSchedulerForm()
+    # Add the schedulers installed as plugins
+    form.sched.choices = form.sched.choices + [
+        (name, name) for name in sorted(sched.get_schedulers())
+        if name not in sched.SCHEDULERS]
 
     def respond():
         return render_template('/applications/task_scheduler.html',
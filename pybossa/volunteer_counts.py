@@ -0,0 +1,233 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SF Isle of Man Limited
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Approximate counts of distinct volunteers, with Redis HyperLogLogs.
+
+When APPROXIMATE_VOLUNTEER_COUNTS is enabled, every project gets a
+HyperLogLog with its authenticated volunteers (user ids) and another one with
+its anonymous volunteers (IPs), and so does the whole site. They are seeded
+lazily from the task_run table and fed by the TaskRun model events, so
+counting the volunteers takes constant time and memory, with a standard error
+of 0.81%. A HyperLogLog cannot forget a volunteer, so they are rebuilt from
+the task_run table once a day.
+
+A counter is built in a temporary key that replaces the current one once it
+is complete, by one worker at a time. The volunteers added meanwhile are
+added to both. While a counter is built for the first time, the volunteers
+are counted in the task_run table.
+
+This module exports:
+    * enabled: return True if the approximate counts are in use
+    * add: add the volunteer of a task run to the counters
+    * count: return the approximate number of volunteers of a project or of
+      the site
+    * count_many: return the approximate number of volunteers of several
+      projects
+    * reset: drop the counters of a project, so they are seeded again
+
+"""
+import uuid
+from flask import current_app
+from sqlalchemy.sql import text
+from pybossa.core import db, sentinel
+
+
+COUNTER_KEY = 'pybossa:volunteers:%s:%s'
+COUNTER_SEEDED_KEY = 'pybossa:volunteers:%s:%s:seeded'
+COUNTER_TMP_KEY = 'pybossa:volunteers:%s:%s:tmp:%s'
+# Only one worker builds a counter at a time. The lock holds the key of the
+# counter being built
+COUNTER_LOCK_KEY = 'pybossa:volunteers:%s:%s:lock'
+COUNTER_LOCK_TIMEOUT = 10 * 60
+# Counters are rebuilt from the DB once a day, to drop the volunteers of
+# deleted task runs
+COUNTER_TIMEOUT = 24 * 60 * 60
+SEED_CHUNK = 10000
+AUTH = 'auth'
+ANON = 'anon'
+SITE = 'site'
+
+# Add the volunteer ARGV[1] to the counters of a project and of the site. For
+# each of them KEYS has the counter, its seeded flag and its lock: the
+# counter gets the volunteer if it is seeded, and so does the counter being
+# built if it is locked
+ADD_SCRIPT = """
+for i = 1, #KEYS, 3 do
+    if redis.call('EXISTS', KEYS[i + 1]) == 1 then
+        redis.call('PFADD', KEYS[i], ARGV[1])
+    end
+    local tmp_key = redis.call('GET', KEYS[i + 2])
+    if tmp_key then
+        redis.call('PFADD', tmp_key, ARGV[1])
+    end
+end
+"""
+
+# Replace the counter (KEYS[2]) with the one built in KEYS[1], mark it as
+# seeded (KEYS[3]) for ARGV[1] seconds and release the lock (KEYS[4]) at
+# once. If the lock is no longer held for KEYS[1], e.g. after a reset, the
+# new counter is dropped and 0 is returned
+REPLACE_SCRIPT = """
+if redis.call('GET', KEYS[4]) ~= KEYS[1] then
+    redis.call('DEL', KEYS[1])
+    return 0
+end
+redis.call('RENAME', KEYS[1], KEYS[2])
+redis.call('PERSIST', KEYS[2])
+redis.call('SET', KEYS[3], 1, 'EX', ARGV[1])
+redis.call('DEL', KEYS[4])
+return 1
+"""
+
+# Drop the counter built in KEYS[1] and release the lock KEYS[2] if it is
+# still held for it
+RELEASE_SCRIPT = """
+redis.call('DEL', KEYS[1])
+if redis.call('GET', KEYS[2]) == KEYS[1] then
+    redis.call('DEL', KEYS[2])
+end
+"""
+
+
+def enabled():
+    """Return True if the volunteers are counted with the HyperLogLogs."""
+    return current_app.config.get('APPROXIMATE_VOLUNTEER_COUNTS', False)
+
+
+def _scope(app_id):
+    return 'app:%s' % app_id if app_id else SITE
+
+
+def _kind(user_id, user_ip):
+    """Return the kind of volunteer of a task run, as the exact counts do."""
+    if user_id is not None and user_ip is None:
+        return AUTH, user_id
+    if user_ip is not None and user_id is None:
+        return ANON, user_ip
+    return None, None
+
+
+def add(app_id, user_id=None, user_ip=None):
+    """Add the volunteer of a task run to the counters of its project and of
+    the site."""
+    if not enabled():
+        return
+    kind, volunteer = _kind(user_id, user_ip)
+    if kind is None:
+        return
+    keys = []
+    for scope in (_scope(app_id), SITE):
+        keys += [COUNTER_KEY % (scope, kind),
+                 COUNTER_SEEDED_KEY % (scope, kind),
+                 COUNTER_LOCK_KEY % (scope, kind)]
+    sentinel.master.eval(ADD_SCRIPT, len(keys), *(keys + [volunteer]))
+
+
+def count(kind, app_id=None):
+    """Return the approximate number of volunteers (AUTH or ANON) of a
+    project, or of the site if app_id is None."""
+    if not _seed(kind, app_id):
+        return _count_from_db(kind, app_id)
+    return sentinel.master.execute_command(
+        'PFCOUNT', COUNTER_KEY % (_scope(app_id), kind))
+
+
+def count_many(kind, app_ids):
+    """Return a list with the approximate number of volunteers (AUTH or ANON)
+    of every project, in the order of app_ids."""
+    seeded = [_seed(kind, app_id) for app_id in app_ids]
+    p = sentinel.master.pipeline()
+    for app_id in [app_id for app_id, ok in zip(app_ids, seeded) if ok]:
+        p.execute_command('PFCOUNT', COUNTER_KEY % (_scope(app_id), kind))
+    counts = iter(p.execute())
+    return [next(counts) if ok else _count_from_db(kind, app_id)
+            for app_id, ok in zip(app_ids, seeded)]
+
+
+def reset(app_id):
+    """Drop the counters of a project. A counter being built from older data
+    is discarded."""
+    p = sentinel.master.pipeline()
+    for kind in (AUTH, ANON):
+        p.delete(COUNTER_KEY % (_scope(app_id), kind))
+        p.delete(COUNTER_SEEDED_KEY % (_scope(app_id), kind))
+        p.delete(COUNTER_LOCK_KEY % (_scope(app_id), kind))
+    p.execute()
+
+
+def _volunteers_sql(kind, app_id=None):
+    """Return the SQL query of the distinct volunteers of a project, or of
+    the site."""
+    column, other = ('user_id', 'user_ip') if kind == AUTH else \
+        ('user_ip', 'user_id')
+    sql = '''SELECT DISTINCT %s AS volunteer FROM task_run
+             WHERE %s IS NOT NULL AND %s IS NULL''' % (column, column, other)
+    if app_id:
+        sql += ' AND app_id=:app_id'
+    return sql
+
+
+def _count_from_db(kind, app_id=None):
+    """Return the exact number of volunteers, while the counter is being
+    built."""
+    sql = 'SELECT COUNT(*) FROM (%s) AS volunteers' % _volunteers_sql(kind,
+                                                                     app_id)
+    return db.slave_session.execute(text(sql), dict(app_id=app_id)).scalar()
+
+
+def _seed(kind, app_id=None):
+    """Build a counter from the task_run table if it is missing or it has
+    not been rebuilt in the last COUNTER_TIMEOUT seconds. Return False if
+    there is no counter to read while it is being built."""
+    scope = _scope(app_id)
+    counter_key = COUNTER_KEY % (scope, kind)
+    if sentinel.master.exists(COUNTER_SEEDED_KEY % (scope, kind)):
+        return True
+    lock_key = COUNTER_LOCK_KEY % (scope, kind)
+    tmp_key = COUNTER_TMP_KEY % (scope, kind, uuid.uuid4().hex)
+    if not sentinel.master.set(lock_key, tmp_key, nx=True,
+                               ex=COUNTER_LOCK_TIMEOUT):
+        # The counter of the last day is still good while it is rebuilt
+        return bool(sentinel.master.exists(counter_key))
+    try:
+        results = db.slave_session.execute(
+            text(_volunteers_sql(kind, app_id)).execution_options(stream=True),
+            dict(app_id=app_id))
+        volunteers = []
+        for row in results:
+            volunteers.append(row.volunteer)
+            if len(volunteers) == SEED_CHUNK:
+                _pfadd(tmp_key, volunteers)
+                volunteers = []
+        # PFADD with no elements creates the (empty) counter too
+        _pfadd(tmp_key, volunteers)
+        return sentinel.master.eval(REPLACE_SCRIPT, 4, tmp_key, counter_key,
+                                    COUNTER_SEEDED_KEY % (scope, kind),
+                                    lock_key, COUNTER_TIMEOUT) == 1
+    except Exception:
+        sentinel.master.eval(RELEASE_SCRIPT, 2, tmp_key, lock_key)
+        raise
+
+
+def _pfadd(tmp_key, volunteers):
+    """Add volunteers to the counter being built. It is dropped with its lock
+    if the worker dies."""
+    p = sentinel.master.pipeline()
+    p.execute_command('PFADD', tmp_key, *volunteers)
+    p.expire(tmp_key, COUNTER_LOCK_TIMEOUT)
+    p.execute()
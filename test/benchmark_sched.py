@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SF Isle of Man Limited
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Benchmark of the task schedulers against a synthetic project.
+
+It rebuilds the test DB (settings_test.py) and flushes its Redis, creates a
+project with the given number of tasks, users and task runs, and times
+pybossa.sched.new_task for every scheduler, for authenticated and anonymous
+users. The results are written as JSON, so runs can be compared across
+commits:
+
+    cd test
+    python benchmark_sched.py --tasks 1000000 --task-runs 3000000 \\
+        --output sched-$(git rev-parse --short HEAD).json
+
+The project, category and users are created with the test factories. Tasks
+and task runs are bulk inserted with the same defaults as TaskFactory and
+TaskRunFactory, because saving millions of them one by one through the
+repositories would take hours. The task runs follow a Zipf-like
+distribution: a few users post most of the answers, and the tasks with the
+lowest ids get most of them, as it happens with the depth first schedulers.
+
+WARNING: it drops all the data of the test DB and Redis.
+"""
+import bisect
+import json
+import optparse
+import os
+import random
+import subprocess
+import time
+from datetime import datetime
+
+from default import db, flask_app, rebuild_db, sentinel
+from factories import AppFactory, UserFactory, reset_all_pk_sequences
+from pybossa.model.task import Task
+from pybossa.model.task_run import TaskRun
+from pybossa import sched
+
+
+CHUNK = 10000
+ANONYMOUS_IP = '10.0.0.%s'
+
+
+def zipf_weights(n, skew):
+    """Return the cumulative Zipf-like weights of n items."""
+    weights = []
+    total = 0.0
+    for i in range(n):
+        total += 1.0 / (i + 1) ** skew
+        weights.append(total)
+    return weights
+
+
+def pick(cumulative_weights, rnd):
+    """Return the index of an item chosen with the given weights."""
+    target = rnd.random() * cumulative_weights[-1]
+    return bisect.bisect_left(cumulative_weights, target)
+
+
+def create_project(n_tasks, n_answers, rnd):
+    """Create a project with n_tasks tasks and return it."""
+    project = AppFactory.create()
+    app_id = project.id
+    rows = []
+    for i in range(n_tasks):
+        now = datetime.utcnow()
+        rows.append(dict(app_id=app_id, created=now.isoformat(),
+                         created_at=now, state=u'ongoing', quorum=0, calibration=0,
+                         priority_0=rnd.choice([0.0, 0.0, 0.0, 0.5, 1.0]),
+                         n_answers=n_answers, n_task_runs=0,
+                         info={'question': 'Task %s' % i}))
+        if len(rows) == CHUNK:
+            db.session.execute(Task.__table__.insert(), rows)
+            rows = []
+    if rows:
+        db.session.execute(Task.__table__.insert(), rows)
+    db.session.commit()
+    return project
+
+
+def create_task_runs(project, users, n_task_runs, n_anonymous, skew, rnd):
+    """Create n_task_runs task runs of the project tasks, by the given users
+    and n_anonymous anonymous users, with a skewed distribution."""
+    app_id = project.id
+    task_ids = [row.id for row in db.session.execute(
+        'SELECT id FROM task WHERE app_id=%s ORDER BY id' % app_id)]
+    contributors = [(user.id, None) for user in users]
+    contributors += [(None, ANONYMOUS_IP % i) for i in range(n_anonymous)]
+    task_weights = zipf_weights(len(task_ids), skew)
+    user_weights = zipf_weights(len(contributors), skew)
+    max_runs = len(task_ids) * len(contributors)
+    n_task_runs = min(n_task_runs, max_runs)
+    done = set()
+    rows = []
+    attempts = 0
+    while len(done) < n_task_runs and attempts < n_task_runs * 10:
+        attempts += 1
+        task_id = task_ids[pick(task_weights, rnd)]
+        user_id, user_ip = contributors[pick(user_weights, rnd)]
+        if (task_id, user_id, user_ip) in done:
+            continue
+        done.add((task_id, user_id, user_ip))
+        now = datetime.utcnow()
+        rows.append(dict(app_id=app_id, task_id=task_id, user_id=user_id,
+                         user_ip=user_ip, created=now.isoformat(),
+                         created_at=now, finish_time=now.isoformat(),
+                         finished_at=now,
+                         info={'answer': rnd.choice(['Yes', 'No'])}))
+        if len(rows) == CHUNK:
+            db.session.execute(TaskRun.__table__.insert(), rows)
+            rows = []
+    if rows:
+        db.session.execute(TaskRun.__table__.insert(), rows)
+    # Bulk inserts skip the TaskRun model events, so update the tasks here
+    db.session.execute('''
+        UPDATE task SET n_task_runs=counts.n_task_runs,
+        state=CASE WHEN counts.n_task_runs >= task.n_answers
+                   THEN 'completed' ELSE task.state END
+        FROM (SELECT task_id, COUNT(id) AS n_task_runs FROM task_run
+              WHERE app_id=%s GROUP BY task_id) AS counts
+        WHERE task.id=counts.task_id''' % app_id)
+    db.session.commit()
+    db.session.execute('ANALYZE')
+    db.session.commit()
+    return len(done)
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = int(round((len(values) - 1) * percent / 100.0))
+    return values[index]
+
+
+def time_scheduler(project_id, sched_name, user_id, user_ip, repeat):
+    """Time new_task for a scheduler and user. The first (cold) call, that
+    seeds the Redis indexes, is reported apart."""
+    timings = []
+    for i in range(repeat + 1):
+        db.session.remove()
+        start = time.time()
+        sched.new_task(project_id, sched_name, user_id, user_ip)
+        timings.append((time.time() - start) * 1000)
+    warm = timings[1:] or timings
+    return dict(cold_ms=timings[0],
+                min_ms=min(warm),
+                mean_ms=sum(warm) / len(warm),
+                median_ms=percentile(warm, 50),
+                p95_ms=percentile(warm, 95),
+                max_ms=max(warm),
+                repeat=repeat)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD']).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(options):
+    rnd = random.Random(options.seed)
+    with flask_app.app_context():
+        rebuild_db()
+        reset_all_pk_sequences()
+        sentinel.master.flushall()
+        start = time.time()
+        users = UserFactory.create_batch(options.users)
+        project = create_project(options.tasks, options.n_answers, rnd)
+        n_task_runs = create_task_runs(project, users, options.task_runs,
+                                       options.anonymous, options.skew, rnd)
+        setup_s = time.time() - start
+        # The sessions are removed between calls, so keep the plain ids
+        project_id, user_ids = project.id, [user.id for user in users]
+        # The most active users, that have answered most tasks, and the
+        # least active ones
+        profiles = [('authenticated_heavy', user_ids[0], None),
+                    ('authenticated_light', user_ids[-1], None),
+                    ('anonymous_heavy', None, ANONYMOUS_IP % 0),
+                    ('anonymous_new', None, '10.0.1.1')]
+        if not options.anonymous:
+            profiles = [p for p in profiles if p[0] != 'anonymous_heavy']
+        results = []
+        schedulers = options.schedulers or sorted(sched.get_schedulers())
+        for sched_name in schedulers:
+            for profile, user_id, user_ip in profiles:
+                result = time_scheduler(project_id, sched_name, user_id,
+                                        user_ip, options.repeat)
+                result.update(sched=sched_name, user=profile)
+                results.append(result)
+                print '%-20s %-20s median %8.2f ms  p95 %8.2f ms' % (
+                    sched_name, profile, result['median_ms'],
+                    result['p95_ms'])
+        return dict(commit=git_commit(),
+                    date=datetime.utcnow().isoformat(),
+                    params=dict(tasks=options.tasks,
+                                task_runs=n_task_runs,
+                                users=options.users,
+                                anonymous=options.anonymous,
+                                n_answers=options.n_answers,
+                                skew=options.skew,
+                                seed=options.seed,
+                                repeat=options.repeat),
+                    setup_s=setup_s,
+                    results=results)
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--tasks', type='int', default=100000,
+                      help='Number of tasks of the project')
+    parser.add_option('--task-runs', dest='task_runs', type='int',
+                      default=300000, help='Number of task runs')
+    parser.add_option('--users', type='int', default=1000,
+                      help='Number of authenticated users')
+    parser.add_option('--anonymous', type='int', default=1000,
+                      help='Number of anonymous users')
+    parser.add_option('--n-answers', dest='n_answers', type='int', default=5,
+                      help='Answers needed to complete a task')
+    parser.add_option('--skew', type='float', default=1.1,
+                      help='Skew of the Zipf-like answer distribution')
+    parser.add_option('--repeat', type='int', default=50,
+                      help='Timed calls per scheduler and user')
+    parser.add_option('--seed', type='int', default=42,
+                      help='Seed of the random data')
+    parser.add_option('--sched', dest='schedulers', action='append',
+                      help='Scheduler to time (default: all of them)')
+    parser.add_option('--output', default='benchmark_sched.json',
+                      help='JSON file for the results')
+    options, args = parser.parse_args()
+    results = run(options)
+    with open(options.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print 'Results written to %s' % os.path.abspath(options.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -17,6 +17,7 @@
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 from helper import web
 from default import model, db
+from pybossa import seen_tasks, last_answers
 
 
 class Helper(web.Helper):
@@ -49,6 +50,10 @@ class Helper(web.Helper):
         db.session.commit()
         # Update task.state
         db.session.query(model.task.Task).filter_by(app_id=app_id)\
-                  .update({"state": "ongoing"})
+                  .update({"state": "ongoing", "n_task_runs": 0})
         db.session.commit()
+        # Bulk deletes skip the TaskRun model events
+        seen_tasks.reset(app_id)
+        for task in db.session.query(model.task.Task).filter_by(app_id=app_id):
+            last_answers.clear(task.id)
         db.session.remove()
@@ -23,6 +23,7 @@ from pybossa.model.app import App
 from pybossa.model.category import Category
 from pybossa.model.task import Task
 from pybossa.model.task_run import TaskRun
+from pybossa import seen_tasks
 
 
 class Helper(Test):
@@ -128,6 +129,8 @@ class Helper(Test):
         """Deletes all TaskRuns for a given app_id"""
         db.session.query(TaskRun).filter_by(app_id=1).delete()
         db.session.commit()
+        # Bulk deletes skip the TaskRun model events
+        seen_tasks.reset(1)
 
     def task_settings_scheduler(self, method="POST", short_name='sampleapp',
                                 sched="default"):
@@ -26,6 +26,7 @@ from pybossa.model.user import User
 from pybossa.model.app import App
 from pybossa.model.task import Task
 from pybossa.model.category import Category
+from pybossa import sched_metrics
 
 
 FakeRequest = namedtuple('FakeRequest', ['text', 'status_code', 'headers'])
@@ -695,3 +696,64 @@ class TestAdmin(web.Helper):
         assert category['name'] in res.data, err_msg
         output = db.session.query(Category).get(obj.id)
         assert output.id == category['id'], err_msg
+
+    @with_context
+    def test_admin_schedulers_as_admin(self):
+        """Test ADMIN schedulers returns the schedulers and their metrics"""
+        sched_metrics.reset()
+        self.register()
+        self.signin()
+        self.new_application()
+        self.new_task(1)
+        self.app.get('/api/app/1/newtask')
+
+        res = self.app.get('/admin/schedulers')
+        data = json.loads(res.data)
+
+        assert res.mimetype == 'application/json', res
+        assert 'depth_first' in data['schedulers'], data
+        assert data['metrics'][0]['app_id'] == 1, data
+        assert data['metrics'][0]['sched'] == 'default', data
+        assert data['metrics'][0]['calls'] == 1, data
+
+        res = self.app.delete('/admin/schedulers')
+        data = json.loads(res.data)
+        assert data['metrics'] == [], data
+
+    @with_context
+    def test_admin_schedulers_as_user(self):
+        """Test ADMIN schedulers is forbidden for non admin users"""
+        self.register()
+        self.signout()
+        self.register(name="tester2", email="tester2@tester.com",
+                      password="tester")
+        res = self.app.get('/admin/schedulers', follow_redirects=True)
+        assert res.status == "403 FORBIDDEN", res.status
+
+    @with_context
+    def test_admin_cache_as_admin(self):
+        """Test ADMIN cache returns the metrics of the cached functions"""
+        self.register()
+        self.signin()
+        self.app.get('/')
+
+        res = self.app.get('/admin/cache')
+        data = json.loads(res.data)
+
+        assert res.mimetype == 'application/json', res
+        names = [entry['name'] for entry in data['metrics']]
+        assert 'front_page_top_apps' in names, names
+
+        res = self.app.delete('/admin/cache')
+        data = json.loads(res.data)
+        assert data['metrics'] == [], data
+
+    @with_context
+    def test_admin_cache_as_user(self):
+        """Test ADMIN cache is forbidden for non admin users"""
+        self.register()
+        self.signout()
+        self.register(name="tester2", email="tester2@tester.com",
+                      password="tester")
+        res = self.app.get('/admin/cache', follow_redirects=True)
+        assert res.status == "403 FORBIDDEN", res.status
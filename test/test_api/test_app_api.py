@@ -582,3 +582,69 @@ class TestAppAPI(TestAPI):
         url = '/api/app/%s/newtask?offset=1000' % app.id
         res = self.app.get(url)
         assert res.data == '{}', res.data
+
+
+    @with_context
+    def test_newtask_limit(self):
+        """Test API project new_task method returns a list of distinct tasks
+        when limit is given"""
+        app = AppFactory.create()
+        TaskFactory.create_batch(3, app=app)
+
+        res = self.app.get('/api/app/%s/newtask?limit=2' % app.id)
+        tasks = json.loads(res.data)
+
+        assert res.mimetype == 'application/json', res
+        assert len(tasks) == 2, tasks
+        assert tasks[0]['id'] != tasks[1]['id'], tasks
+        for task in tasks:
+            assert_equal(task['app_id'], app.id)
+
+        # The offset is applied before the limit
+        res = self.app.get('/api/app/%s/newtask?limit=5&offset=2' % app.id)
+        tasks = json.loads(res.data)
+        assert len(tasks) == 1, tasks
+
+        # An empty list is returned when there are no more tasks
+        res = self.app.get('/api/app/%s/newtask?limit=5&offset=1000' % app.id)
+        assert res.data == '[]', res.data
+
+    @with_context
+    def test_newtask_limit_is_bounded(self):
+        """Test API project new_task method limit is bounded by the
+        MAX_NEWTASK_LIMIT setting"""
+        app = AppFactory.create()
+        TaskFactory.create_batch(3, app=app)
+
+        with patch.dict(self.flask_app.config, {'MAX_NEWTASK_LIMIT': 2}):
+            res = self.app.get('/api/app/%s/newtask?limit=3' % app.id)
+        tasks = json.loads(res.data)
+
+        assert len(tasks) == 2, tasks
+
+    @with_context
+    def test_newtask_limit_marks_all_tasks_as_requested(self):
+        """Test API project new_task method allows posting a task run for
+        every task returned with limit"""
+        app = AppFactory.create()
+        TaskFactory.create_batch(2, app=app)
+
+        res = self.app.get('/api/app/%s/newtask?limit=2' % app.id)
+        tasks = json.loads(res.data)
+
+        for task in tasks:
+            data = dict(app_id=app.id, task_id=task['id'], info='answer')
+            res = self.app.post('/api/taskrun', data=json.dumps(data))
+            assert res.status_code == 200, res.data
+
+    @with_context
+    def test_newtask_wrong_limit(self):
+        """Test API project new_task method fails with a wrong limit"""
+        app = AppFactory.create()
+        TaskFactory.create(app=app)
+
+        res = self.app.get('/api/app/%s/newtask?limit=0' % app.id)
+        err = json.loads(res.data)
+
+        assert res.status_code == 415, res.status_code
+        assert err['exception_cls'] == 'ValueError', err
@@ -217,6 +217,27 @@ class TestTaskAPI(TestAPI):
         assert err['exception_cls'] == 'TypeError', err
 
 
+    @with_context
+    def test_task_n_task_runs_cannot_be_written(self):
+        """Test API task POST and PUT ignore n_task_runs, which is counted
+        from the task runs"""
+        user = UserFactory.create()
+        app = AppFactory.create(owner=user)
+        task = TaskFactory.create(app=app, n_answers=2)
+        TaskRunFactory.create(task=task)
+        url = '/api/task/%s?api_key=%s' % (task.id, user.api_key)
+
+        res = self.app.put(url, data=json.dumps(dict(n_task_runs=0)))
+        assert_equal(res.status, '200 OK', res.data)
+        assert task_repo.get_task(task.id).n_task_runs == 1
+
+        data = dict(app_id=app.id, info={}, n_task_runs=5)
+        res = self.app.post('/api/task?api_key=%s' % user.api_key,
+                            data=json.dumps(data))
+        assert_equal(res.status, '200 OK', res.data)
+        assert json.loads(res.data)['n_task_runs'] == 0, res.data
+
+
     @with_context
     def test_task_delete(self):
         """Test API task delete"""
@@ -17,10 +17,17 @@
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 
 import hashlib
-from mock import patch
+import os
+from flask import Flask
+from mock import patch, MagicMock
+from pybossa import cache as cache_module
 from pybossa.cache import (get_key_to_hash, get_hash_key, cache, memoize,
-                           delete_cached, delete_memoized)
-from pybossa.sentinel import Sentinel
+                           delete_cached, delete_memoized,
+                           delete_project_memoized, get_counters,
+                           get_request_stats, set_memoized_many)
+from pybossa.cache.local import LocalCache, apply_invalidation
+from pybossa.cache import serializers, metrics
+from pybossa.sentinel import ShardedSentinel, HashRing
 from settings_test import REDIS_SENTINEL, REDIS_KEYPREFIX
 
 
@@ -63,13 +70,111 @@ class TestCacheHashFunctions(object):
 
 
 
+class TestCacheSerializers(object):
+
+    def test_values_are_loaded_in_every_format(self):
+        """Test CACHE serializers load the values stored in every format"""
+        value = {'tasks': range(10), 'name': u'caf\xe9'}
+        for serializer in serializers.SERIALIZERS:
+            for compress_threshold in (None, 0):
+                data = serializers.dumps(value, serializer, compress_threshold)
+                loaded = serializers.loads(data)
+                assert loaded == value, (serializer, loaded)
+
+
+    def test_uncompressed_pickles_have_no_marker(self):
+        """Test CACHE serializers store uncompressed pickles as plain pickles,
+        and load the values stored by older versions"""
+        import cPickle
+
+        data = serializers.dumps([1, 2])
+
+        assert cPickle.loads(data) == [1, 2]
+        assert serializers.loads(cPickle.dumps([1, 2])) == [1, 2]
+
+
+    def test_long_values_are_compressed(self):
+        """Test CACHE serializers compress the values above the threshold"""
+        value = ['a long value'] * 100
+
+        data = serializers.dumps(value, 'json', compress_threshold=100)
+
+        assert data.startswith(serializers.MARKER + 'jz'), data[:3]
+        assert len(data) < len(serializers.dumps(value, 'json'))
+
+
+
+class TestShardedSentinel(object):
+
+    def sharded(self, names):
+        sharded = ShardedSentinel()
+        sharded.shards = dict((name, MagicMock(name=name)) for name in names)
+        for name, shard in sharded.shards.items():
+            shard.name = name
+            shard.master.pipeline.return_value.execute.return_value = [name]
+        sharded.ring = HashRing(names)
+        return sharded
+
+    def test_hash_ring_spreads_the_keys(self):
+        """Test SHARDED SENTINEL spreads the keys over all the nodes, and
+        adding a node only moves the keys it gets"""
+        ring = HashRing(['a', 'b', 'c'])
+        keys = ['key:%s' % i for i in range(3000)]
+        nodes = [ring.get_node(key) for key in keys]
+        new_nodes = [HashRing(['a', 'b', 'c', 'd']).get_node(key)
+                     for key in keys]
+
+        for node in 'abc':
+            assert 700 < nodes.count(node) < 1300, nodes.count(node)
+        moved = [(old, new) for old, new in zip(nodes, new_nodes) if old != new]
+        assert all(new == 'd' for old, new in moved), moved
+        assert 500 < len(moved) < 1000, len(moved)
+
+    def test_group_routes_the_keys_by_shard(self):
+        """Test SHARDED SENTINEL groups the keys by their shard"""
+        sharded = self.sharded(['a', 'b'])
+        keys = ['key:%s' % i for i in range(20)]
+
+        groups = sharded.group(keys)
+
+        assert sorted(i for shard, indexes in groups for i in indexes) == \
+            range(20), groups
+        for shard, indexes in groups:
+            assert all(sharded.shard(keys[i]) is shard for i in indexes)
+
+    def test_pipeline_returns_the_results_in_order(self):
+        """Test SHARDED SENTINEL pipelines run once per shard, and return the
+        results in the order of the commands"""
+        sharded = self.sharded(['a', 'b'])
+        keys = ['key:%s' % i for i in range(2)]
+        while sharded.shard(keys[0]) is sharded.shard(keys[-1]):
+            keys.append('key:%s' % len(keys))
+        keys = [keys[0], keys[-1]]
+
+        p = sharded.pipeline()
+        for key in keys:
+            p.get(key)
+        results = p.execute()
+
+        assert results == [sharded.shard(key).name for key in keys], results
+        for key in keys:
+            pipeline = sharded.shard(key).master.pipeline.return_value
+            pipeline.get.assert_called_once_with(key)
+            assert pipeline.execute.call_count == 1
+
+
 class FakeApp(object):
     def __init__(self):
         self.config = { 'REDIS_SENTINEL': REDIS_SENTINEL }
 
-test_sentinel = Sentinel(app=FakeApp())
+test_sentinel = ShardedSentinel(app=FakeApp())
+
 
-@patch('pybossa.cache.sentinel', new=test_sentinel)
+def memoized_keys():
+    """Return the memoized values stored, without the tag sets"""
+    return test_sentinel.master.keys('%s:*_args:*' % REDIS_KEYPREFIX)
+
+@patch('pybossa.cache.cache_sentinel', new=test_sentinel)
 class TestCacheMemoizeFunctions(object):
 
     @classmethod
@@ -246,11 +351,11 @@ class TestCacheMemoizeFunctions(object):
         def my_func(*args, **kwargs):
             return [args, kwargs]
         my_func('arg', kwarg='kwarg')
-        assert len(test_sentinel.master.keys()) == 1
+        assert len(memoized_keys()) == 1
 
         delete_succedeed = delete_memoized(my_func, 'arg', kwarg='kwarg')
         assert delete_succedeed is True, delete_succedeed
-        assert test_sentinel.master.keys() == [], 'Key was not deleted!'
+        assert memoized_keys() == [], 'Key was not deleted!'
 
 
     def test_delete_memoized_returns_false_when_delete_fails(self):
@@ -260,11 +365,11 @@ class TestCacheMemoizeFunctions(object):
         def my_func(*args, **kwargs):
             return [args, kwargs]
         my_func('arg', kwarg='kwarg')
-        assert len(test_sentinel.master.keys()) == 1
+        assert len(memoized_keys()) == 1
 
         delete_succedeed = delete_memoized(my_func, 'badarg', kwarg='barkwarg')
         assert delete_succedeed is False, delete_succedeed
-        assert len(test_sentinel.master.keys()) == 1, 'Key was unexpectedly deleted'
+        assert len(memoized_keys()) == 1, 'Key was unexpectedly deleted'
 
 
     def test_delete_memoized_deletes_only_requested(self):
@@ -276,11 +381,11 @@ class TestCacheMemoizeFunctions(object):
             return [args, kwargs]
         my_func('arg', kwarg='kwarg')
         my_func('other', kwarg='other')
-        assert len(test_sentinel.master.keys()) == 2
+        assert len(memoized_keys()) == 2
 
         delete_succedeed = delete_memoized(my_func, 'arg', kwarg='kwarg')
         assert delete_succedeed is True, delete_succedeed
-        assert len(test_sentinel.master.keys()) == 1, 'Everything was deleted!'
+        assert len(memoized_keys()) == 1, 'Everything was deleted!'
 
 
     def test_delete_memoized_deletes_all_function_calls(self):
@@ -296,8 +401,427 @@ class TestCacheMemoizeFunctions(object):
         my_func('arg', kwarg='kwarg')
         my_func('other', kwarg='other')
         my_other_func('arg', kwarg='kwarg')
-        assert len(test_sentinel.master.keys()) == 3
+        assert len(memoized_keys()) == 3
 
         delete_succedeed = delete_memoized(my_func)
         assert delete_succedeed is True, delete_succedeed
-        assert len(test_sentinel.master.keys()) == 1
+        assert len(memoized_keys()) == 1
+
+
+    def test_memoize_tags_keys_by_function(self):
+        """Test CACHE memoize adds the keys to the tag set of the function, so
+        delete_memoized does not need to scan Redis"""
+
+        @memoize()
+        def my_func(*args, **kwargs):
+            return [args, kwargs]
+        my_func('arg')
+        my_func('other')
+        tag = '%s::tag:function:my_func' % REDIS_KEYPREFIX
+
+        assert test_sentinel.master.smembers(tag) == set(memoized_keys())
+        with patch.object(test_sentinel.slave, 'keys') as keys:
+            delete_memoized(my_func)
+            assert not keys.called
+        assert memoized_keys() == [], memoized_keys()
+        assert not test_sentinel.master.exists(tag)
+
+
+    def test_delete_project_memoized_bumps_project_version(self):
+        """Test CACHE delete_project_memoized invalidates the values of every
+        function of the project, and only them, with a single INCR"""
+
+        calls = []
+        @memoize(project_arg='app_id')
+        def my_func(app_id):
+            calls.append(app_id)
+            return app_id
+        @memoize(project_arg='app_id')
+        def my_other_func(page, app_id=None):
+            calls.append(app_id)
+            return app_id
+        my_func(1)
+        my_other_func(2, app_id=1)
+        my_func(app_id=2)
+        assert len(memoized_keys()) == 3
+
+        with patch.object(test_sentinel.master, 'delete') as delete:
+            delete_succedeed = delete_project_memoized(1)
+            assert not delete.called
+        my_func(1)
+        my_other_func(2, app_id=1)
+        my_func(app_id=2)
+
+        assert delete_succedeed is True, delete_succedeed
+        assert calls == [1, 1, 2, 1, 1], calls
+        # The old values are not read anymore, and expire on their own
+        assert len(memoized_keys()) == 5, memoized_keys()
+
+
+    def test_values_computed_with_the_cache_disabled_are_read(self):
+        """Test CACHE memoize stores the values computed with the cache
+        disabled, as the jobs do, with the current version of the project"""
+
+        calls = []
+        @memoize(project_arg='app_id')
+        def my_func(app_id):
+            calls.append(app_id)
+            return app_id
+        delete_project_memoized(1)
+
+        with patch.dict(os.environ, {'PYBOSSA_REDIS_CACHE_DISABLED': '1'}):
+            my_func(1)
+        my_func(1)
+
+        assert calls == [1], calls
+
+
+    def test_memoize_many_reads_all_values_at_once(self):
+        """Test CACHE memoize many reads the stored values with one MGET and
+        computes and stores only the missing ones"""
+
+        calls = []
+        @memoize()
+        def my_func(arg):
+            calls.append(arg)
+            return arg * 2
+        my_func(1)
+
+        with patch.object(test_sentinel.slave, 'get') as get:
+            values = my_func.many([1, 2, (3,)])
+            assert not get.called
+
+        assert values == [2, 4, 6], values
+        assert calls == [1, 2, 3], calls
+        assert len(memoized_keys()) == 3, memoized_keys()
+        assert my_func.many([1, 2, 3]) == [2, 4, 6]
+
+
+    def test_memoize_many_uses_the_batch_variant(self):
+        """Test CACHE memoize many computes the missing values with the batch
+        variant of the function if it has one"""
+
+        calls = []
+        @memoize()
+        def my_func(arg):
+            return arg * 2
+        @my_func.batch
+        def my_func_many(args):
+            calls.append(args)
+            return [arg * 3 for arg in args]
+        my_func(1)
+
+        values = my_func.many([1, 2, 3])
+
+        assert values == [2, 6, 9], values
+        assert calls == [[2, 3]], calls
+        assert my_func(3) == 9, 'The batch values were not stored'
+
+
+    def test_set_memoized_many_stores_the_values_of_many_functions(self):
+        """Test CACHE set_memoized_many stores precomputed values, that are
+        read by the memoized functions, with a single pipeline"""
+
+        calls = []
+        @memoize(project_arg='app_id')
+        def my_func(app_id):
+            calls.append(app_id)
+        @memoize()
+        def my_other_func(name):
+            calls.append(name)
+        delete_project_memoized(2)
+
+        with patch.object(test_sentinel.master, 'setex') as setex:
+            set_memoized_many([(my_func, (1,), 'one'), (my_func, (2,), 'two'),
+                               (my_other_func, ('name',), 'name')])
+            assert not setex.called
+
+        assert my_func(1) == 'one'
+        assert my_func(2) == 'two'
+        assert my_other_func('name') == 'name'
+        assert calls == [], calls
+
+
+    def test_memoize_records_metrics(self):
+        """Test CACHE memoize records the hits, misses and writes of every
+        function"""
+        metrics.reset()
+
+        @memoize()
+        def my_func(arg):
+            return arg
+        my_func('arg')
+        my_func('arg')
+        my_func.many(['arg', 'other'])
+        entry = [entry for entry in metrics.get_all()
+                 if entry['name'] == 'my_func'][0]
+
+        assert entry['hits'] == 2, entry
+        assert entry['misses'] == 2, entry
+        assert entry['writes'] == 2, entry
+        assert entry['avg_size'] > 0, entry
+
+
+    def test_memoize_reads_every_value_once_per_request(self):
+        """Test CACHE memoize reads a value from Redis once per request, and
+        again after it is deleted"""
+
+        @memoize()
+        def my_func(arg):
+            return arg
+
+        with Flask(__name__).test_request_context():
+            with patch.object(test_sentinel.slave, 'get',
+                              wraps=test_sentinel.slave.get) as get:
+                my_func('arg')
+                my_func('arg')
+                assert get.call_count == 1, get.call_count
+                delete_memoized(my_func, 'arg')
+                my_func('arg')
+                assert get.call_count == 2, get.call_count
+            stats = get_request_stats()
+
+        assert stats['memo_hits'] == 1, stats
+        assert stats['redis_calls'] >= 4, stats
+
+
+    def test_memoize_reads_every_project_version_once_per_request(self):
+        """Test CACHE memoize reads the version of a project from Redis once
+        per request, even if it has none yet, and again after it is bumped"""
+
+        calls = []
+        @memoize(project_arg='app_id')
+        def my_func(app_id, page=1):
+            calls.append(app_id)
+            return app_id
+
+        with Flask(__name__).test_request_context():
+            my_func(1)
+            with patch.object(test_sentinel.slave, 'mget',
+                              wraps=test_sentinel.slave.mget) as mget:
+                my_func(1)
+                my_func(1, page=2)
+                assert not mget.called, mget.call_args_list
+                delete_project_memoized(1)
+                my_func(1)
+                assert mget.call_count == 1, mget.call_args_list
+
+        assert calls == [1, 1, 1], calls
+
+
+@patch('pybossa.cache.cache_sentinel', new=test_sentinel)
+class TestStaleValues(object):
+
+    @classmethod
+    def setup_class(cls):
+        import os
+        cls.cache = os.environ.pop('PYBOSSA_REDIS_CACHE_DISABLED', None)
+
+    @classmethod
+    def teardown_class(cls):
+        if cls.cache:
+            import os
+            os.environ['PYBOSSA_REDIS_CACHE_DISABLED'] = cls.cache
+
+    def setUp(self):
+        test_sentinel.master.flushall()
+
+    def soft_expire(self):
+        """Leave the memoized value in the stale period"""
+        key = memoized_keys()[0]
+        test_sentinel.master.expire(key, 50)
+        return key
+
+
+    def test_memoize_stores_values_for_timeout_plus_stale_timeout(self):
+        """Test CACHE memoize keeps the values in Redis during the stale
+        period too"""
+
+        @memoize(timeout=10, stale_timeout=100)
+        def my_func(arg):
+            return arg
+        my_func('arg')
+
+        ttl = test_sentinel.master.ttl(memoized_keys()[0])
+        assert 100 < ttl <= 110, ttl
+
+
+    def test_memoize_serves_stale_value_while_locked(self):
+        """Test CACHE memoize serves the stale value while another caller
+        holds the lock, and counts it"""
+
+        @memoize(timeout=10, stale_timeout=100)
+        def my_func(arg, call_count=[]):
+            call_count.append(1)
+            return len(call_count)
+        my_func('arg')
+        key = self.soft_expire()
+        test_sentinel.master.set(cache_module._lock_key(key), 1)
+
+        assert my_func('arg') == 1, 'The stale value was not served'
+        assert get_counters() == {'my_func': {'stale': 1}}, get_counters()
+
+
+    def test_cache_counts_stale_values_by_key_prefix(self):
+        """Test CACHE cache labels the stale values it serves by its key
+        prefix, as its metrics"""
+
+        @cache(key_prefix='my_prefix', timeout=10, stale_timeout=100)
+        def my_func(call_count=[]):
+            call_count.append(1)
+            return len(call_count)
+        my_func()
+        key = '%s::my_prefix' % REDIS_KEYPREFIX
+        test_sentinel.master.expire(key, 50)
+        test_sentinel.master.set(cache_module._lock_key(key), 1)
+
+        assert my_func() == 1, 'The stale value was not served'
+        assert get_counters() == {'my_prefix': {'stale': 1}}, get_counters()
+
+
+    def test_memoize_recomputes_stale_value_with_lock(self):
+        """Test CACHE memoize recomputes a stale value by the caller that gets
+        the lock, and releases it"""
+
+        @memoize(timeout=10, stale_timeout=100)
+        def my_func(arg, call_count=[]):
+            call_count.append(1)
+            return len(call_count)
+        my_func('arg')
+        key = self.soft_expire()
+
+        assert my_func('arg') == 2, 'The stale value was not recomputed'
+        assert test_sentinel.master.ttl(key) > 100
+        assert not test_sentinel.master.exists(cache_module._lock_key(key))
+        assert get_counters() == {}, get_counters()
+
+
+    @patch('pybossa.cache._refresh_queue')
+    def test_memoize_recomputes_stale_value_in_background(self, queue):
+        """Test CACHE memoize enqueues the recomputation of a stale value if
+        background is set, and serves the stale value"""
+
+        @memoize(timeout=10, stale_timeout=100, background=True)
+        def my_func(arg, call_count=[]):
+            call_count.append(1)
+            return len(call_count)
+        my_func('arg')
+        key = self.soft_expire()
+
+        assert my_func('arg') == 1, 'The stale value was not served'
+        queue.return_value.enqueue.assert_called_with(
+            'pybossa.jobs.refresh_cached', my_func.__module__, 'my_func',
+            ('arg',), {}, cache_module._lock_key(key))
+
+
+    @patch('pybossa.cache.LOCK_WAIT', new=0)
+    def test_memoize_counts_lock_waits(self):
+        """Test CACHE memoize waits for a value being computed by another
+        caller, and computes it itself if it does not come"""
+
+        @memoize(timeout=10, stale_timeout=100)
+        def my_func(arg):
+            return arg
+        key = "%s:my_func_args:" % REDIS_KEYPREFIX
+        key = get_hash_key(key, get_key_to_hash('arg'))
+        test_sentinel.master.set(cache_module._lock_key(key), 1)
+
+        assert my_func('arg') == 'arg'
+        assert get_counters() == {'my_func': {'lock_wait': 1}}, get_counters()
+
+
+class TestLocalCache(object):
+
+    def test_get_returns_stored_values(self):
+        """Test LOCAL_CACHE get returns the stored values until they expire"""
+        local_cache = LocalCache(10)
+        local_cache.set('key', 'value', 60)
+        local_cache.set('expired', 'value', -1)
+
+        assert local_cache.get('key') == 'value', local_cache.get('key')
+        assert local_cache.get('expired') is None
+        assert local_cache.get('missing') is None
+
+
+    def test_set_evicts_least_recently_used(self):
+        """Test LOCAL_CACHE evicts the least recently used values when full"""
+        local_cache = LocalCache(2)
+        local_cache.set('a', 1, 60)
+        local_cache.set('b', 2, 60)
+        local_cache.get('a')
+        local_cache.set('c', 3, 60)
+
+        assert len(local_cache) == 2, len(local_cache)
+        assert local_cache.get('b') is None
+        assert local_cache.get('a') == 1
+        assert local_cache.get('c') == 3
+
+
+    def test_apply_invalidation(self):
+        """Test LOCAL_CACHE applies key, prefix and full invalidations"""
+        local_cache = LocalCache(10)
+        for key in ['p:a', 'p:b', 'q:a']:
+            local_cache.set(key, 'value', 60)
+
+        apply_invalidation(local_cache, 'key:p:a')
+        assert local_cache.get('p:a') is None
+        assert local_cache.get('p:b') == 'value'
+
+        apply_invalidation(local_cache, 'prefix:p:')
+        assert local_cache.get('p:b') is None
+        assert local_cache.get('q:a') == 'value'
+
+        apply_invalidation(local_cache, 'all')
+        assert len(local_cache) == 0, len(local_cache)
+
+
+@patch('pybossa.cache.cache_sentinel', new=test_sentinel)
+@patch('pybossa.cache.Listener', new=MagicMock())
+class TestTwoTierCache(TestCacheMemoizeFunctions):
+
+    def setUp(self):
+        super(TestTwoTierCache, self).setUp()
+        self.settings = patch.multiple(cache_module.settings, create=True,
+                                       LOCAL_CACHE_SIZE=10,
+                                       LOCAL_CACHE_TIMEOUT=60)
+        self.settings.start()
+        cache_module._local_cache = None
+
+    def tearDown(self):
+        self.settings.stop()
+        cache_module._local_cache = None
+
+
+    def test_memoize_reads_from_local_cache(self):
+        """Test CACHE memoize serves the values from the local cache without
+        hitting Redis"""
+
+        @memoize()
+        def my_func(arg, call_count=[]):
+            call_count.append(1)
+            return len(call_count)
+        my_func('arg')
+        test_sentinel.master.flushall()
+
+        assert my_func('arg') == 1, 'The value was not read from memory'
+
+
+    def test_delete_memoized_drops_local_values(self):
+        """Test CACHE delete_memoized drops the values from the local cache
+        and publishes the invalidation"""
+
+        @memoize()
+        def my_func(arg, call_count=[]):
+            call_count.append(1)
+            return len(call_count)
+        my_func('arg')
+        my_func('other')
+
+        with patch.object(test_sentinel.master, 'publish') as publish:
+            delete_memoized(my_func, 'arg')
+            assert my_func('arg') == 3, 'The local value was not deleted'
+            assert my_func('other') == 2, 'Other values were deleted'
+            delete_memoized(my_func)
+            assert my_func('other') == 4, 'The local values were not deleted'
+
+        assert publish.call_count == 2, publish.call_args_list
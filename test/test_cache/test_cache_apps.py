@@ -16,8 +16,10 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
 from default import Test, with_context
 from pybossa.cache import apps as cached_apps
+from pybossa.cache import serializers
 from factories import UserFactory, AppFactory, TaskFactory, \
     TaskRunFactory, AnonymousTaskRunFactory
 from mock import patch
@@ -83,6 +85,19 @@ class TestAppsCache(Test):
         assert len(featured) is 0, featured
 
 
+    def test_get_featured_is_stored_as_json(self):
+        """Test CACHE PROJECTS get_featured stores the projects as JSON"""
+
+        AppFactory.create(featured=True)
+
+        with patch('pybossa.cache.serializers.dumps',
+                   wraps=serializers.dumps) as dumps:
+            featured = cached_apps.get_featured()
+
+        assert dumps.call_args[0][1] == 'json', dumps.call_args
+        assert json.loads(json.dumps(featured)) == featured, featured
+
+
     def test_get_featured_returns_required_fields(self):
         """Test CACHE PROJECTS get_featured returns the required info
         about each featured project"""
@@ -455,7 +470,7 @@ class TestAppsCache(Test):
         assert number_of_featured == 1, number_of_featured
 
 
-    @patch('pybossa.cache.pickle')
+    @patch('pybossa.cache.serializers.pickle')
     @patch('pybossa.cache.apps._n_draft')
     def test_n_count_calls_n_draft(self, _n_draft, pickle):
         """Test CACHE PROJECTS n_count calls _n_draft when called with argument
@@ -465,7 +480,7 @@ class TestAppsCache(Test):
         _n_draft.assert_called_with()
 
 
-    @patch('pybossa.cache.pickle')
+    @patch('pybossa.cache.serializers.pickle')
     @patch('pybossa.cache.apps._n_featured')
     def test_n_count_calls_n_featuredt(self, _n_featured, pickle):
         """Test CACHE PROJECTS n_count calls _n_featured when called with
@@ -531,3 +546,51 @@ class TestAppsCache(Test):
 
         for field in fields:
             assert field in pro_owned_projects[0].keys(), field
+
+
+    def test_many_returns_the_same_values_as_single_calls(self):
+        """Test CACHE PROJECTS the batch variants of the project stats return
+        the same values as the single calls"""
+        app = self.create_app_with_contributors(anonymous=2, registered=3,
+                                                two_tasks=True)
+        other_app = self.create_app_with_tasks(completed_tasks=1,
+                                               ongoing_tasks=2)
+        app_ids = [app.id, other_app.id, 9999]
+        functions = (cached_apps.n_tasks, cached_apps.n_completed_tasks,
+                     cached_apps.n_registered_volunteers,
+                     cached_apps.n_anonymous_volunteers,
+                     cached_apps.n_volunteers, cached_apps.overall_progress,
+                     cached_apps.last_activity)
+
+        for function in functions:
+            expected = [function(app_id) for app_id in app_ids]
+            values = function.many(app_ids)
+            assert values == expected, (function.__name__, values, expected)
+
+
+    def test_warm_counters_returns_the_same_values_as_single_calls(self):
+        """Test CACHE PROJECTS warm_counters computes the same counters as the
+        single calls, and stores all of them at once"""
+        app = self.create_app_with_contributors(anonymous=2, registered=3,
+                                                two_tasks=True)
+        other_app = self.create_app_with_tasks(completed_tasks=1,
+                                               ongoing_tasks=2)
+        functions = (cached_apps.n_tasks, cached_apps.n_completed_tasks,
+                     cached_apps.n_task_runs,
+                     cached_apps.n_registered_volunteers,
+                     cached_apps.n_anonymous_volunteers,
+                     cached_apps.n_volunteers, cached_apps.overall_progress,
+                     cached_apps.last_activity)
+
+        with patch('pybossa.cache.apps.set_memoized_many') as set_many:
+            counters = cached_apps.warm_counters([app.id, other_app.id, 9999])
+            calls = set_many.call_args[0][0]
+
+        assert set_many.call_count == 1, set_many.call_count
+        assert sorted(counters.keys()) == sorted([app.id, other_app.id])
+        for app_id in (app.id, other_app.id):
+            for function in functions:
+                expected = function(app_id)
+                value = counters[app_id][function.__name__]
+                assert value == expected, (function.__name__, value, expected)
+                assert (function, (app_id,), expected) in calls, function
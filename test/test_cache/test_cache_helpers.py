@@ -16,6 +16,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 
+from mock import patch
 from default import Test, db, with_context
 from factories import (AppFactory, TaskFactory, TaskRunFactory,
                       AnonymousTaskRunFactory, UserFactory)
@@ -233,3 +234,19 @@ class TestHelpersCache(Test):
 
         assert 'task_presenter' in app.info
         assert contributing_state == 'draft', contributing_state
+
+    @with_context
+    def test_n_available_tasks_is_the_same_in_sql(self):
+        """Test n_available_tasks gives the same count when the answered tasks
+        are excluded with an SQL anti-join"""
+        app = AppFactory.create()
+        tasks = TaskFactory.create_batch(3, app=app, n_answers=2)
+        TaskFactory.create(app=app, state='completed')
+        user = UserFactory.create()
+        TaskRunFactory.create(task=tasks[0], user=user)
+
+        n_tasks = helpers.n_available_tasks(app.id, user_id=user.id)
+        with patch('pybossa.seen_tasks.MAX_CHECKED', 0):
+            n_tasks_sql = helpers.n_available_tasks(app.id, user_id=user.id)
+
+        assert n_tasks == n_tasks_sql == 2, (n_tasks, n_tasks_sql)
@@ -0,0 +1,144 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SF Isle of Man Limited
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+
+from default import Test, db, with_context
+from factories import AppFactory, TaskFactory, AnonymousTaskRunFactory
+from factories import task_repo
+from mock import patch
+from pybossa.model.task import Task
+from pybossa.model.task_run import TaskRun
+from pybossa.cache import invalidation
+from pybossa import importers
+
+
+@patch('pybossa.cache.apps.delete_counters')
+class TestCacheInvalidation(Test):
+
+    @with_context
+    def test_counters_are_reset_once_per_transaction(self, delete_counters):
+        """Test CACHE INVALIDATION resets the counters of the projects changed
+        once, when the transaction commits"""
+        app = AppFactory.create()
+        delete_counters.reset_mock()
+        for i in range(3):
+            db.session.add(Task(app_id=app.id))
+        db.session.flush()
+        assert not delete_counters.called
+
+        db.session.commit()
+
+        delete_counters.assert_called_once_with(set([app.id]))
+
+    @with_context
+    def test_counters_are_not_reset_on_rollback(self, delete_counters):
+        """Test CACHE INVALIDATION does not reset the counters if the
+        transaction is rolled back"""
+        app = AppFactory.create()
+        delete_counters.reset_mock()
+        db.session.add(Task(app_id=app.id))
+        db.session.flush()
+        db.session.rollback()
+        db.session.commit()
+
+        assert not delete_counters.called
+
+    @with_context
+    @patch('pybossa.leaderboard.add')
+    @patch('pybossa.seen_tasks.add')
+    def test_index_writes_wait_for_the_commit(self, seen_add, leaderboard_add,
+                                             delete_counters):
+        """Test CACHE INVALIDATION applies the writes to the Redis indexes of
+        a task run once it commits, and drops them on rollback"""
+        task = TaskFactory.create()
+        db.session.add(TaskRun(app_id=task.app_id, task_id=task.id,
+                               user_ip='127.0.0.1'))
+        db.session.flush()
+        assert not seen_add.called
+
+        db.session.rollback()
+        db.session.commit()
+        assert not seen_add.called
+
+        AnonymousTaskRunFactory.create(task=task)
+        assert seen_add.call_count == 1, seen_add.call_args_list
+        assert leaderboard_add.call_count == 1
+
+    @with_context
+    @patch('pybossa.leaderboard.add')
+    @patch('pybossa.seen_tasks.add', side_effect=IOError)
+    def test_failed_index_writes_do_not_stop_the_rest(self, seen_add,
+                                                      leaderboard_add,
+                                                      delete_counters):
+        """Test CACHE INVALIDATION applies the rest of the writes and resets
+        the counters when one of the writes fails after the commit"""
+        task = TaskFactory.create()
+        delete_counters.reset_mock()
+
+        AnonymousTaskRunFactory.create(task=task)
+
+        assert seen_add.called
+        assert leaderboard_add.called
+        delete_counters.assert_called_once_with(set([task.app_id]))
+
+    @with_context
+    def test_task_runs_reset_the_counters(self, delete_counters):
+        """Test CACHE INVALIDATION resets the counters when a task run is
+        posted or deleted"""
+        task = TaskFactory.create()
+        delete_counters.reset_mock()
+
+        task_run = AnonymousTaskRunFactory.create(task=task)
+        task_repo.delete(task_run)
+
+        assert delete_counters.call_count == 2, delete_counters.call_args_list
+        delete_counters.assert_called_with(set([task.app_id]))
+
+    @with_context
+    @patch('pybossa.cache.invalidation.delete_project_memoized')
+    def test_coalesced_bumps_the_project_versions_once(self, delete_project,
+                                                      delete_counters):
+        """Test CACHE INVALIDATION coalesced bumps the version of every
+        project changed once, when the block exits"""
+        app = AppFactory.create()
+        other_app = AppFactory.create()
+        delete_counters.reset_mock()
+
+        with invalidation.coalesced():
+            TaskFactory.create_batch(3, app=app)
+            TaskFactory.create(app=other_app)
+            assert not delete_project.called
+
+        assert delete_project.call_count == 2, delete_project.call_args_list
+        delete_project.assert_any_call(app.id)
+        delete_project.assert_any_call(other_app.id)
+        assert not delete_counters.called
+
+    @with_context
+    @patch('pybossa.cache.invalidation.delete_project_memoized')
+    def test_import_bumps_the_project_version_once(self, delete_project,
+                                                   delete_counters):
+        """Test CACHE INVALIDATION importing tasks bumps the version of the
+        project once"""
+        app = AppFactory.create()
+        delete_counters.reset_mock()
+        tasks_data = [dict(info={'question': i}) for i in range(5)]
+
+        importers.create_tasks(task_repo, tasks_data, app.id)
+
+        delete_project.assert_called_once_with(app.id)
+        assert not delete_counters.called
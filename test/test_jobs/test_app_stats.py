@@ -65,9 +65,9 @@ class TestProjectsStats(Test):
 
         job = jobs[0]
         err_msg = "There should have the same name, but it's: %s" % job['name']
-        assert "get_app_stats" == job['name'].__name__, err_msg
+        assert "get_apps_stats" == job['name'].__name__, err_msg
         err_msg = "There should have the same args, but it's: %s" % job['args']
-        assert [app.id, app.short_name] == job['args'], err_msg
+        assert [[app.id]] == job['args'], err_msg
         err_msg = "There should have the same kwargs, but it's: %s" % job['kwargs']
         assert {} == job['kwargs'], err_msg
 
@@ -0,0 +1,126 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SF Isle of Man Limited
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+
+from mock import patch
+from default import Test, db, with_context
+from factories import AppFactory, TaskFactory, AnonymousTaskRunFactory
+from pybossa.model.task import Task
+from pybossa import last_answers
+from pybossa import sched
+
+
+class TestLastAnswers(Test):
+
+    def create_incremental_task(self):
+        app = AppFactory.create(info={'task_presenter': '<div></div>',
+                                      'sched': 'incremental'})
+        return TaskFactory.create(app=app, info={'question': 'q'})
+
+    def get_tasks(self, *tasks):
+        """Read the tasks again, with their current n_task_runs"""
+        db.session.expire_all()
+        return [db.session.query(Task).get(task.id) for task in tasks]
+
+    @with_context
+    @patch('pybossa.last_answers._load')
+    def test_last_answer_is_saved_on_task_run_insert(self, load):
+        """Test LAST_ANSWERS stores the last answer when a task run of an
+        incremental project is posted"""
+        task = self.create_incremental_task()
+        AnonymousTaskRunFactory.create(task=task, info={'answer': 'first'})
+        AnonymousTaskRunFactory.create(task=task, info={'answer': 'last'},
+                                       user_ip='127.0.0.2')
+
+        answers = last_answers.get_many(self.get_tasks(task))
+
+        assert answers == {task.id: {'answer': 'last'}}, answers
+        assert not load.called
+
+    @with_context
+    def test_missing_last_answers_are_read_from_the_db(self):
+        """Test LAST_ANSWERS reads the missing last answers from the DB"""
+        task = self.create_incremental_task()
+        other_task = TaskFactory.create(app=task.app)
+        AnonymousTaskRunFactory.create(task=task, info={'answer': 'first'})
+        AnonymousTaskRunFactory.create(task=task, info={'answer': 'last'},
+                                       user_ip='127.0.0.2')
+        last_answers.clear(task.id)
+
+        answers = last_answers.get_many(self.get_tasks(task, other_task))
+
+        assert answers == {task.id: {'answer': 'last'},
+                           other_task.id: None}, answers
+
+    @with_context
+    @patch('pybossa.last_answers.clear')
+    @patch('pybossa.last_answers.save')
+    def test_last_answer_is_not_stored_for_other_schedulers(self, save, clear):
+        """Test LAST_ANSWERS does not touch Redis when a task run of a project
+        that is not incremental is posted"""
+        AnonymousTaskRunFactory.create(info={'answer': 'No'})
+
+        assert not save.called
+        assert not clear.called
+
+    @with_context
+    def test_outdated_last_answers_are_read_from_the_db(self):
+        """Test LAST_ANSWERS reads the last answer from the DB if the task got
+        answers while its project used another scheduler"""
+        task = self.create_incremental_task()
+        AnonymousTaskRunFactory.create(task=task, info={'answer': 'first'})
+        app = task.app
+        app.info = dict(app.info, sched='depth_first')
+        db.session.commit()
+        AnonymousTaskRunFactory.create(task=task, info={'answer': 'last'},
+                                       user_ip='127.0.0.2')
+
+        answers = last_answers.get_many(self.get_tasks(task))
+
+        assert answers == {task.id: {'answer': 'last'}}, answers
+
+    @with_context
+    def test_last_answers_are_read_by_finish_time(self):
+        """Test LAST_ANSWERS reads the answer that finished last from the DB,
+        not the one with the highest id"""
+        task = self.create_incremental_task()
+        AnonymousTaskRunFactory.create(task=task, info={'answer': 'last'},
+                                       finish_time='2015-01-02T00:00:00')
+        AnonymousTaskRunFactory.create(task=task, info={'answer': 'first'},
+                                       finish_time='2015-01-01T00:00:00',
+                                       user_ip='127.0.0.2')
+        last_answers.clear(task.id)
+
+        answers = last_answers.get_many(self.get_tasks(task))
+
+        assert answers == {task.id: {'answer': 'last'}}, answers
+
+    @with_context
+    def test_incremental_task_does_not_modify_the_session_task(self):
+        """Test SCHED incremental returns a copy of the task with its last
+        answer, and leaves the task in the session untouched"""
+        task = self.create_incremental_task()
+        AnonymousTaskRunFactory.create(task=task, info={'answer': 'No'})
+
+        out = sched.get_incremental_task(task.app_id, user_id=1)
+        session_task = db.session.query(Task).get(task.id)
+
+        assert out.id == task.id, out
+        assert out.info['last_answer'] == {'answer': 'No'}, out.info
+        assert out.info['question'] == 'q', out.info
+        assert out not in db.session
+        assert 'last_answer' not in session_task.info, session_task.info
@@ -0,0 +1,126 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SF Isle of Man Limited
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+
+from mock import patch
+from default import Test, db, sentinel, with_context
+from factories import AppFactory, TaskFactory, TaskRunFactory, UserFactory
+from pybossa import leaderboard
+from pybossa.cache import users as cached_users
+
+
+class TestLeaderboard(Test):
+
+    def create_runs(self, n_runs_per_user):
+        app = AppFactory.create()
+        tasks = TaskFactory.create_batch(max(n_runs_per_user), app=app)
+        users = UserFactory.create_batch(len(n_runs_per_user))
+        for user, n_runs in zip(users, n_runs_per_user):
+            for task in tasks[:n_runs]:
+                TaskRunFactory.create(user=user, task=task)
+        return users
+
+    @with_context
+    def test_top_shares_the_rank_of_ties(self):
+        """Test LEADERBOARD top gives the same rank to users with the same
+        score, like the SQL rank() function"""
+        users = self.create_runs([1, 3, 3, 2])
+        leaderboard.rebuild()
+
+        top = leaderboard.top(10)
+
+        assert [(rank, score) for _, rank, score in top] == [
+            (1, 3), (1, 3), (3, 2), (4, 1)], top
+        assert leaderboard.rank_and_score(users[3].id) == (3, 2)
+        assert leaderboard.rank_and_score(users[0].id) == (4, 1)
+
+    @with_context
+    def test_task_run_events_update_the_scores(self):
+        """Test LEADERBOARD is kept up to date when task runs are added or
+        deleted"""
+        users = self.create_runs([1, 2])
+        leaderboard.rebuild()
+        assert leaderboard.rank_and_score(users[0].id) == (2, 1)
+
+        TaskRunFactory.create(user=users[0])
+        TaskRunFactory.create(user=users[0])
+        assert leaderboard.rank_and_score(users[0].id) == (1, 3)
+
+        for task_run in list(users[1].task_runs):
+            db.session.delete(task_run)
+        db.session.commit()
+        assert leaderboard.rank_and_score(users[1].id) == (None, None)
+        assert len(leaderboard.top(10)) == 1
+
+    @with_context
+    def test_rebuild_from_the_task_run_table(self):
+        """Test LEADERBOARD rebuild replaces the scores with the ones in the
+        task_run table"""
+        users = self.create_runs([2, 1])
+        leaderboard.add(users[1].id, 1000)
+        leaderboard.add(users[1].id, 1001)
+
+        assert leaderboard.rebuild() == 2
+        assert leaderboard.top(10) == [(users[0].id, 1, 2),
+                                       (users[1].id, 2, 1)]
+
+    @with_context
+    def test_task_runs_added_during_a_rebuild_are_kept(self):
+        """Test LEADERBOARD adds the task runs that a running rebuild does not
+        read to the new leaderboard too"""
+        users = self.create_runs([1])
+        sentinel.master.set(leaderboard.REBUILD_LOCK_KEY, '5:rebuilt')
+
+        leaderboard.add(users[0].id, 5)
+        leaderboard.add(users[0].id, 6)
+
+        assert sentinel.master.zscore('rebuilt', users[0].id) == 1
+        # The task run of create_runs and the two added
+        assert sentinel.master.zscore(leaderboard.LEADERBOARD_KEY,
+                                      users[0].id) == 3
+
+    @with_context
+    @patch('pybossa.leaderboard._rebuild_queue')
+    def test_ranks_are_read_from_the_db_until_it_is_built(self, queue):
+        """Test LEADERBOARD queues a single job to build the leaderboard, and
+        reads the ranks from the task_run table until it is built"""
+        users = self.create_runs([1, 2])
+
+        assert leaderboard.top(10) == [(users[1].id, 1, 2),
+                                       (users[0].id, 2, 1)]
+        assert leaderboard.rank_and_score(users[0].id) == (2, 1)
+        assert not sentinel.master.exists(leaderboard.LEADERBOARD_SEEDED_KEY)
+        queue.return_value.enqueue.assert_called_once_with(
+            'pybossa.jobs.rebuild_leaderboard')
+
+    @with_context
+    def test_get_leaderboard_adds_the_user_out_of_the_top(self):
+        """Test CACHE USERS get_leaderboard appends the current user if they
+        are not in the top n, with no rank if they have no task runs"""
+        users = self.create_runs([3, 2, 1])
+        newbie = UserFactory.create()
+
+        top = cached_users.get_leaderboard(1, users[2].id)
+        anonymous = cached_users.get_leaderboard(1, 'anonymous')
+        no_runs = cached_users.get_leaderboard(1, newbie.id)
+
+        assert [(u['id'], u['rank'], u['score']) for u in top] == [
+            (users[0].id, 1, 3), (users[2].id, 3, 1)], top
+        assert top[0]['name'] == users[0].name, top
+        assert len(anonymous) == 1, anonymous
+        assert no_runs[1]['rank'] == -1, no_runs
+        assert no_runs[1]['score'] == -1, no_runs
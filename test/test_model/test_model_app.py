@@ -130,3 +130,17 @@ class TestModelApp(Test):
         app = AppFactory.build(info={'passwd_hash': 'mypassword'})
 
         assert not app.check_password('notmypassword')
+
+    @with_context
+    def test_updated_at_follows_updated(self):
+        """Test APP model sets updated_at from updated when it is created and
+        when it is updated"""
+        app = AppFactory.create()
+        assert app.updated_at.isoformat() == app.updated, app.updated_at
+        created = app.updated
+
+        app.name = u'New name'
+        db.session.commit()
+
+        assert app.updated != created, app.updated
+        assert app.updated_at.isoformat() == app.updated, app.updated_at
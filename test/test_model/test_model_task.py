@@ -23,6 +23,7 @@ from pybossa.model.user import User
 from pybossa.model.app import App
 from pybossa.model.task import Task
 from pybossa.model.category import Category
+from factories import TaskFactory, AnonymousTaskRunFactory, task_repo
 
 
 class TestModelTask(Test):
@@ -49,3 +50,33 @@ class TestModelTask(Test):
         db.session.add(task)
         assert_raises(IntegrityError, db.session.commit)
         db.session.rollback()
+
+
+    @with_context
+    def test_n_task_runs_is_updated_on_insert_and_delete(self):
+        """Test TASK n_task_runs counter follows the task runs of the task"""
+        task = TaskFactory.create()
+        assert task.n_task_runs == 0, task.n_task_runs
+
+        task_runs = AnonymousTaskRunFactory.create_batch(2, task=task)
+        assert task_repo.get_task(task.id).n_task_runs == 2
+
+        task_repo.delete(task_runs[0])
+        assert task_repo.get_task(task.id).n_task_runs == 1
+
+
+    @with_context
+    def test_n_task_runs_is_incremented_in_place(self):
+        """Test TASK n_task_runs is incremented by the database, and completes
+        the task when it reaches n_answers"""
+        task = TaskFactory.create(n_answers=3)
+        # As if another answer had been counted by a concurrent transaction
+        db.session.execute('UPDATE task SET n_task_runs=2 WHERE id=%s'
+                           % task.id)
+        db.session.commit()
+
+        AnonymousTaskRunFactory.create(task=task)
+        task = task_repo.get_task(task.id)
+
+        assert task.n_task_runs == 3, task.n_task_runs
+        assert task.state == 'completed', task.state
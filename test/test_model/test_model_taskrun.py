@@ -16,7 +16,9 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 
+import datetime
 from default import Test, db, with_context
+from factories import TaskRunFactory
 from nose.tools import assert_raises
 from sqlalchemy.exc import IntegrityError
 from pybossa.model.user import User
@@ -59,3 +61,23 @@ class TestModelTaskRun(Test):
         db.session.add(task_run)
         assert_raises(IntegrityError, db.session.commit)
         db.session.rollback()
+
+    @with_context
+    def test_task_run_timestamp_columns(self):
+        """Test TASK_RUN model keeps the timestamp columns in sync with the
+        ISO string ones, and leaves them out of dictize"""
+        task_run = TaskRunFactory.create(
+            finish_time='2015-01-20T10:15:00.000000')
+        finished_at = datetime.datetime(2015, 1, 20, 10, 15)
+
+        assert task_run.finished_at == finished_at, task_run.finished_at
+        assert task_run.created_at is not None
+        assert task_run.created_at.isoformat() == task_run.created
+
+        task_run.finish_time = '2015-01-21T08:00:00'
+        db.session.commit()
+
+        assert task_run.finished_at == datetime.datetime(2015, 1, 21, 8, 0)
+        assert 'finished_at' not in task_run.dictize()
+        assert 'created_at' not in task_run.dictize()
+        assert task_run.dictize()['finish_time'] == '2015-01-21T08:00:00'
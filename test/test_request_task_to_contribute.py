@@ -19,7 +19,8 @@
 from redis import StrictRedis
 from mock import patch
 
-from pybossa.api import _mark_task_as_requested_by_user
+from pybossa.api import (_mark_task_as_requested_by_user,
+                          _mark_tasks_as_requested_by_user)
 from pybossa.api.task_run import _check_task_requested_by_user
 from pybossa.model.task import Task
 from pybossa.model.task_run import TaskRun
@@ -70,6 +71,20 @@ class TestTasksMarkedForContribution(object):
         assert self.connection.ttl(key) == 60 * 60, self.connection.ttl(key)
 
 
+    @patch('pybossa.api.get_user_id_or_ip')
+    def test_mark_tasks_as_requested_by_user_creates_key_per_task(self, user):
+        """When a user requests several tasks at once, a key is stored for
+        every task"""
+        user.return_value = {'user_id': 33, 'user_ip': None}
+        tasks = [Task(id=22), Task(id=23)]
+
+        _mark_tasks_as_requested_by_user(tasks, self.connection)
+
+        for key in ['pybossa:task_requested:user:33:task:22',
+                    'pybossa:task_requested:user:33:task:23']:
+            assert key in self.connection.keys(), self.connection.keys()
+
+
 class TestCheckTasksRequestedByUser(object):
 
     def setUp(self):
@@ -20,6 +20,7 @@ import json
 import random
 
 from mock import patch
+from sqlalchemy import event
 
 from helper import sched
 from default import Test, db, with_context
@@ -28,6 +29,7 @@ from pybossa.model.app import App
 from pybossa.model.user import User
 from pybossa.model.task_run import TaskRun
 from pybossa.model.category import Category
+from pybossa import seen_tasks
 from factories import TaskFactory, AppFactory, TaskRunFactory, AnonymousTaskRunFactory, UserFactory
 import pybossa
 
@@ -417,6 +419,7 @@ class TestGetBreadthFirst(Test):
         db.session.query(TaskRun).filter_by(app_id=1).delete()
         db.session.commit()
         db.session.remove()
+        seen_tasks.reset(1)
 
     @with_context
     def test_get_default_task_anonymous(self):
@@ -442,6 +445,72 @@ class TestGetBreadthFirst(Test):
         task = pybossa.sched.get_random_task(app_id=1)
         assert task is None, task
 
+    @with_context
+    def test_get_random_task_only_returns_available_tasks(self):
+        """Test SCHED get_random_task only returns open tasks the user has not
+        answered yet"""
+        project = AppFactory.create()
+        TaskFactory.create_batch(3, app=project, state='completed')
+        answered = TaskFactory.create_batch(3, app=project)
+        available = TaskFactory.create(app=project)
+        for task in answered:
+            AnonymousTaskRunFactory.create(task=task, user_ip='127.0.0.1')
+
+        for i in range(10):
+            task = pybossa.sched.get_random_task(project.id,
+                                                 user_ip='127.0.0.1')
+            assert task.id == available.id, task
+
+        for i in range(10):
+            task = pybossa.sched.get_random_task(project.id,
+                                                 user_ip='127.0.0.2')
+            assert task.state != 'completed', task
+
+    @with_context
+    def test_get_random_task_picks_every_available_task(self):
+        """Test SCHED get_random_task picks any available task, also after
+        gaps in the ids"""
+        project = AppFactory.create()
+        tasks = TaskFactory.create_batch(5, app=project)
+        for task in tasks[1:3]:
+            db.session.delete(task)
+        db.session.commit()
+        expected = set([tasks[0].id, tasks[3].id, tasks[4].id])
+
+        picked = set(pybossa.sched.get_random_task(project.id, user_id=1).id
+                     for i in range(60))
+
+        assert picked == expected, picked
+
+    @with_context
+    @patch('pybossa.task_pool.RANDOM_DRAWS', 0)
+    def test_get_random_task_when_the_draws_are_not_enough(self):
+        """Test SCHED get_random_task reads the tasks from the DB when the
+        random draws only hit answered tasks"""
+        project = AppFactory.create()
+        answered = TaskFactory.create_batch(3, app=project)
+        available = TaskFactory.create(app=project)
+        for task in answered:
+            AnonymousTaskRunFactory.create(task=task, user_ip='127.0.0.1')
+
+        with patch('pybossa.task_pool.candidates') as candidates:
+            task = pybossa.sched.get_random_task(project.id,
+                                                 user_ip='127.0.0.1')
+
+        assert task.id == available.id, task
+        assert not candidates.called
+
+    @with_context
+    def test_get_random_task_reads_the_db_while_seeding(self):
+        """Test SCHED get_random_task reads the tasks from the DB while
+        another worker builds the pool"""
+        project = AppFactory.create()
+        task = TaskFactory.create(app=project)
+        with patch('pybossa.task_pool._seed_pool', return_value=False):
+            picked = pybossa.sched.get_random_task(project.id, user_id=1)
+
+        assert picked.id == task.id, picked
+
 
     def _test_get_breadth_first_task(self, user=None):
         self.del_task_runs()
@@ -503,3 +572,133 @@ class TestGetBreadthFirst(Test):
         tr = TaskRun(app=app, task=task, user=user)
         db.session.add(tr)
         db.session.commit()
+
+
+class TestSchedQueries(Test):
+
+    def count_queries(self, scheduler, *args, **kwargs):
+        statements = []
+        # Seed the index of seen tasks first, and then start with an empty
+        # identity map, so every load hits the DB
+        scheduler(*args, **kwargs)
+        db.session.remove()
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            task = scheduler(*args, **kwargs)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        return task, len(statements)
+
+    @with_context
+    def test_depth_first_loads_only_the_returned_task(self):
+        """Test SCHED depth_first runs one query for the candidates and one
+        for the returned task"""
+        project = AppFactory.create()
+        task_ids = [t.id for t in TaskFactory.create_batch(10, app=project)]
+        project_id = project.id
+
+        task, n_queries = self.count_queries(pybossa.sched.get_depth_first_task,
+                                             project_id, offset=3)
+
+        assert task.id == task_ids[3], task
+        assert n_queries == 2, n_queries
+
+    @with_context
+    def test_breadth_first_loads_only_the_returned_task(self):
+        """Test SCHED breadth_first runs one query for the candidates and one
+        for the returned task"""
+        project = AppFactory.create()
+        TaskFactory.create_batch(10, app=project)
+        project_id = project.id
+
+        task, n_queries = self.count_queries(
+            pybossa.sched.get_breadth_first_task, project_id, user_id=1)
+
+        assert task is not None, task
+        assert n_queries == 2, n_queries
+
+    @with_context
+    def test_get_candidate_tasks_loads_tasks_in_one_query(self):
+        """Test SCHED get_candidate_tasks loads all the candidates with a
+        single query"""
+        project = AppFactory.create()
+        TaskFactory.create_batch(10, app=project, priority_0=0.5)
+        TaskFactory.create(app=project, priority_0=1)
+        project_id = project.id
+
+        tasks, n_queries = self.count_queries(
+            pybossa.sched.get_candidate_tasks, project_id)
+
+        assert len(tasks) == 10, tasks
+        assert tasks[0].priority_0 == 1, tasks[0]
+        assert n_queries == 2, n_queries
+
+    @with_context
+    def test_new_tasks_returns_distinct_tasks_for_every_scheduler(self):
+        """Test SCHED new_tasks returns up to limit distinct tasks with every
+        scheduler"""
+        project = AppFactory.create()
+        TaskFactory.create_batch(5, app=project)
+        project_id = project.id
+
+        for sched in ['default', 'breadth_first', 'depth_first',
+                      'depth_first_pool', 'random', 'incremental']:
+            tasks = pybossa.sched.new_tasks(project_id, sched, user_id=1,
+                                            limit=3)
+            task_ids = set(task.id for task in tasks)
+            assert len(task_ids) == 3, (sched, tasks)
+
+            tasks = pybossa.sched.new_tasks(project_id, sched, user_id=1,
+                                            limit=10)
+            assert len(tasks) == 5, (sched, tasks)
+
+    @with_context
+    def test_new_tasks_loads_all_the_tasks_in_one_query(self):
+        """Test SCHED new_tasks runs one query for the candidates and one for
+        all the returned tasks"""
+        project = AppFactory.create()
+        task_ids = [t.id for t in TaskFactory.create_batch(10, app=project)]
+        project_id = project.id
+
+        tasks, n_queries = self.count_queries(pybossa.sched.new_tasks,
+                                              project_id, 'depth_first',
+                                              offset=2, limit=3)
+
+        assert [task.id for task in tasks] == task_ids[2:5], tasks
+        assert n_queries == 2, n_queries
+
+    @with_context
+    def test_candidates_skip_the_answered_tasks(self):
+        """Test SCHED get_candidate_task_ids reads enough candidates to skip
+        the tasks the user has answered"""
+        project = AppFactory.create()
+        tasks = TaskFactory.create_batch(4, app=project, n_answers=2)
+        user = UserFactory.create()
+        for task in tasks[:2]:
+            TaskRunFactory.create(task=task, user=user)
+
+        task_ids = pybossa.sched.get_candidate_task_ids(
+            project.id, user_id=user.id, limit=2)
+
+        assert task_ids == [tasks[2].id, tasks[3].id], task_ids
+
+    @with_context
+    @patch('pybossa.seen_tasks.MAX_CHECKED', 0)
+    def test_candidates_exclude_many_answered_tasks_in_sql(self):
+        """Test SCHED get_candidate_task_ids excludes the tasks answered by
+        users with more than MAX_CHECKED answers with an SQL anti-join"""
+        project = AppFactory.create()
+        tasks = TaskFactory.create_batch(3, app=project, n_answers=2)
+        user = UserFactory.create()
+        TaskRunFactory.create(task=tasks[0], user=user)
+        AnonymousTaskRunFactory.create(task=tasks[1], user_ip='10.0.0.1')
+
+        by_user = pybossa.sched.get_candidate_task_ids(project.id,
+                                                       user_id=user.id)
+        by_ip = pybossa.sched.get_candidate_task_ids(project.id,
+                                                     user_ip='10.0.0.1')
+
+        assert by_user == [tasks[1].id, tasks[2].id], by_user
+        assert by_ip == [tasks[0].id, tasks[2].id], by_ip
@@ -0,0 +1,136 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SF Isle of Man Limited
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+
+from mock import patch, MagicMock
+from default import Test, with_context
+from factories import AppFactory, TaskFactory
+from pybossa import sched, sched_metrics
+
+
+class TestSchedMetrics(Test):
+
+    def setUp(self):
+        super(TestSchedMetrics, self).setUp()
+        sched_metrics.reset()
+
+    @with_context
+    def test_record_and_get_all(self):
+        """Test SCHED_METRICS aggregates the calls by project and scheduler"""
+        sched_metrics.record(1, 'depth_first', 0.002, 3, 1)
+        sched_metrics.record(1, 'depth_first', 0.004, 5, 0)
+        sched_metrics.record(2, 'random', 0.001, 1, 1)
+
+        metrics = sched_metrics.get_all()
+
+        assert metrics[0] == dict(app_id=1, sched='depth_first', calls=2,
+                                  empty=1, avg_candidates=4.0, avg_ms=3.0,
+                                  max_ms=4.0), metrics
+        assert metrics[1]['app_id'] == 2, metrics
+        assert metrics[1]['sched'] == 'random', metrics
+
+    @with_context
+    def test_record_buffers_the_metrics(self):
+        """Test SCHED_METRICS record keeps the metrics in memory until they
+        are flushed"""
+        with patch('pybossa.sched_metrics.sentinel') as sentinel:
+            sched_metrics.record(1, 'depth_first', 0.002, 3, 1)
+            assert not sentinel.master.method_calls, sentinel.mock_calls
+
+    @with_context
+    def test_flush_keeps_the_highest_max_time(self):
+        """Test SCHED_METRICS flush does not overwrite a higher maximum time
+        stored by another worker"""
+        sched_metrics.record(1, 'depth_first', 0.004, 1, 1)
+        sched_metrics.flush()
+        sched_metrics.record(1, 'depth_first', 0.002, 1, 1)
+
+        metrics = sched_metrics.get_all()
+
+        assert metrics[0]['max_ms'] == 4.0, metrics
+        assert metrics[0]['calls'] == 2, metrics
+
+    @with_context
+    def test_new_tasks_records_metrics(self):
+        """Test SCHED new_tasks records the calls with the scheduler used and
+        the candidates it considered"""
+        app = AppFactory.create()
+        TaskFactory.create_batch(3, app=app)
+
+        sched.new_tasks(app.id, 'breadth_first', user_id=1, limit=2)
+        sched.new_tasks(app.id, 'unknown', user_id=1)
+        metrics = dict((entry['sched'], entry)
+                       for entry in sched_metrics.get_all())
+
+        assert metrics['breadth_first']['calls'] == 1, metrics
+        assert metrics['breadth_first']['avg_candidates'] == 3, metrics
+        assert metrics['default']['calls'] == 1, metrics
+
+    @with_context
+    def test_new_tasks_counts_the_tasks_of_silent_schedulers(self):
+        """Test SCHED new_tasks counts the tasks returned as the candidates of
+        the schedulers that do not report them"""
+        scheduler = MagicMock(return_value=['task'])
+
+        with patch.dict(sched.SCHEDULERS, {'silent': scheduler}):
+            sched.new_tasks(1, 'silent')
+        metrics = sched_metrics.get_all()
+
+        assert metrics[0]['avg_candidates'] == 1, metrics
+
+
+class TestSchedulerPlugins(Test):
+
+    def setUp(self):
+        super(TestSchedulerPlugins, self).setUp()
+        sched._plugins = None
+
+    def tearDown(self):
+        sched._plugins = None
+        super(TestSchedulerPlugins, self).tearDown()
+
+    def entry_point(self, name, scheduler):
+        entry_point = MagicMock()
+        entry_point.name = name
+        entry_point.load.return_value = scheduler
+        return entry_point
+
+    @with_context
+    @patch('pybossa.sched.pkg_resources.iter_entry_points')
+    def test_plugins_are_used_by_new_task(self, iter_entry_points):
+        """Test SCHED uses the schedulers registered as entry points"""
+        app = AppFactory.create()
+        task = TaskFactory.create(app=app)
+        plugin = MagicMock(return_value=[task])
+        iter_entry_points.return_value = [self.entry_point('plugin', plugin)]
+
+        out = sched.new_task(app.id, 'plugin', user_id=1, offset=1)
+
+        iter_entry_points.assert_called_with('pybossa.schedulers')
+        plugin.assert_called_with(app.id, 1, None, offset=1, limit=1)
+        assert out.id == task.id, out
+
+    @with_context
+    @patch('pybossa.sched.pkg_resources.iter_entry_points')
+    def test_plugins_cannot_replace_builtin_schedulers(self, iter_entry_points):
+        """Test SCHED plugins cannot replace the built-in schedulers"""
+        plugin = MagicMock()
+        iter_entry_points.return_value = [self.entry_point('random', plugin)]
+
+        schedulers = sched.get_schedulers()
+
+        assert schedulers['random'] == sched.get_random_tasks, schedulers
@@ -0,0 +1,124 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SF Isle of Man Limited
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+
+from default import Test, with_context
+from factories import (AppFactory, TaskFactory, TaskRunFactory,
+                       AnonymousTaskRunFactory, UserFactory)
+from factories import task_repo
+from pybossa.core import sentinel
+from pybossa import seen_tasks
+
+
+class TestSeenTasks(Test):
+
+    @with_context
+    def test_seen_task_ids_are_seeded_from_task_runs(self):
+        """Test SEEN_TASKS returns the tasks answered before the index was
+        used"""
+        user = UserFactory.create()
+        task = TaskFactory.create()
+        TaskFactory.create(app=task.app)
+        TaskRunFactory.create(task=task, user=user)
+
+        seen = seen_tasks.seen_task_ids(task.app_id, user_id=user.id)
+
+        assert seen == [task.id], seen
+
+    @with_context
+    def test_seen_task_ids_are_updated_on_task_run_insert(self):
+        """Test SEEN_TASKS keeps track of the task runs posted once the index
+        is in use"""
+        task = TaskFactory.create()
+        assert seen_tasks.seen_task_ids(task.app_id, user_ip='127.0.0.1') == []
+
+        AnonymousTaskRunFactory.create(task=task, user_ip='127.0.0.1')
+        seen = seen_tasks.seen_task_ids(task.app_id, user_ip='127.0.0.1')
+
+        assert seen == [task.id], seen
+
+    @with_context
+    def test_task_runs_added_while_seeding_are_kept(self):
+        """Test SEEN_TASKS keeps the task runs added to a set that is not
+        seeded yet, as a seeding may not have read them from the DB"""
+        user = UserFactory.create()
+        task_run = TaskRunFactory.create(user=user)
+        app_id = task_run.app_id
+        sentinel.master.delete(seen_tasks.SEEN_KEY % (app_id, user.id))
+
+        # Committed after the seeding read the task_run table
+        seen_tasks.add(app_id, 1000, user_id=user.id)
+        seen_key = seen_tasks.key(app_id, user_id=user.id)
+
+        assert sorted(seen_tasks.members(seen_key)) == [task_run.task_id,
+                                                        1000]
+        assert seen_tasks.count(seen_key) == 2
+
+    @with_context
+    def test_seen_task_ids_are_updated_on_task_run_delete(self):
+        """Test SEEN_TASKS forgets the task runs that are deleted"""
+        user = UserFactory.create()
+        task_run = TaskRunFactory.create(user=user)
+        app_id = task_run.app_id
+        assert seen_tasks.seen_task_ids(app_id, user_id=user.id) != []
+
+        task_repo.delete(task_run)
+        seen = seen_tasks.seen_task_ids(app_id, user_id=user.id)
+
+        assert seen == [], seen
+
+    @with_context
+    def test_rebuild_recovers_lost_data(self):
+        """Test SEEN_TASKS rebuild restores the index from the task_run
+        table"""
+        user = UserFactory.create()
+        task_run = TaskRunFactory.create(user=user)
+        app_id, task_id = task_run.app_id, task_run.task_id
+        key = seen_tasks.key(app_id, user_id=user.id)
+        # Simulate a Redis failover that lost the last writes
+        sentinel.master.srem(key, task_id)
+
+        n_sets = seen_tasks.rebuild(app_id)
+        seen = seen_tasks.seen_task_ids(app_id, user_id=user.id)
+
+        assert n_sets == 1, n_sets
+        assert seen == [task_id], seen
+
+    @with_context
+    def test_reset_only_drops_the_given_project(self):
+        """Test SEEN_TASKS reset does not drop the index of other projects"""
+        app, other_app = AppFactory.create_batch(2)
+        seen_tasks.key(app.id, user_id=1)
+        other_key = seen_tasks.key(other_app.id, user_id=1)
+
+        seen_tasks.reset(app.id)
+
+        assert sentinel.master.keys(seen_tasks.SEEN_KEY % ('*', '*')) == \
+            [other_key]
+
+    @with_context
+    def test_sets_are_tracked_in_the_index_of_their_project(self):
+        """Test SEEN_TASKS tracks the sets of every project, so rebuild drops
+        them without scanning the keyspace"""
+        app = AppFactory.create()
+        seen_key = seen_tasks.key(app.id, user_id=1)
+        index = sentinel.master.smembers(seen_tasks.SEEN_INDEX_KEY % app.id)
+        assert index == set([seen_key]), index
+
+        seen_tasks.rebuild()
+
+        assert not sentinel.master.exists(seen_key)
@@ -0,0 +1,129 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SF Isle of Man Limited
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+from mock import patch
+from default import Test, db, with_context
+from factories import (AppFactory, TaskFactory, TaskRunFactory,
+                       AnonymousTaskRunFactory)
+from factories import task_repo
+from pybossa.model.app_stats import AppStatsDay, AppStatsHour
+from pybossa import stats_rollups
+from pybossa.cache import project_stats
+
+
+class TestStatsRollups(Test):
+
+    def rollups(self, app_id):
+        days = db.session.query(AppStatsDay).filter_by(app_id=app_id).all()
+        hours = db.session.query(AppStatsHour).filter_by(app_id=app_id)
+        return ([(d.day, d.n_answers_anon, d.n_answers_auth,
+                  d.n_completed_tasks) for d in days],
+                sorted((h.hour, h.user_type, h.n_answers) for h in hours))
+
+    @with_context
+    def test_task_runs_are_counted_on_insert(self):
+        """Test STATS_ROLLUPS counts the task runs by day and hour, and the
+        task they complete"""
+        task = TaskFactory.create(n_answers=2)
+        finish_time = '2015-01-20T10:15:00.000000'
+        TaskRunFactory.create(task=task, finish_time=finish_time)
+        AnonymousTaskRunFactory.create(task=task, finish_time=finish_time)
+        AnonymousTaskRunFactory.create(task=task, finish_time=finish_time,
+                                       user_ip='127.0.0.2')
+
+        days, hours = self.rollups(task.app_id)
+
+        assert days == [(datetime.date(2015, 1, 20), 2, 1, 1)], days
+        assert hours == [(10, 'anon', 2), (10, 'auth', 1)], hours
+
+    @with_context
+    def test_task_runs_are_discounted_on_delete(self):
+        """Test STATS_ROLLUPS discounts the task runs deleted"""
+        task_run = AnonymousTaskRunFactory.create(
+            finish_time='2015-01-20T10:15:00.000000')
+
+        task_repo.delete(task_run)
+        days, hours = self.rollups(task_run.app_id)
+
+        assert days == [(datetime.date(2015, 1, 20), 0, 0, 0)], days
+        assert hours == [(10, 'anon', 0)], hours
+
+    @with_context
+    def test_completion_is_moved_on_delete(self):
+        """Test STATS_ROLLUPS moves the completion of a task to the answer that
+        completes it after a delete, and discounts it once it is no longer
+        completed"""
+        task = TaskFactory.create(n_answers=2)
+        first = AnonymousTaskRunFactory.create(
+            task=task, finish_time='2015-01-20T10:15:00.000000')
+        second = AnonymousTaskRunFactory.create(
+            task=task, finish_time='2015-01-21T10:15:00.000000',
+            user_ip='127.0.0.2')
+        AnonymousTaskRunFactory.create(
+            task=task, finish_time='2015-01-22T10:15:00.000000',
+            user_ip='127.0.0.3')
+
+        task_repo.delete(second)
+        days = sorted(self.rollups(task.app_id)[0])
+
+        assert [day[3] for day in days] == [0, 0, 1], days
+
+        task_repo.delete(first)
+        days = sorted(self.rollups(task.app_id)[0])
+
+        assert [day[3] for day in days] == [0, 0, 0], days
+
+    @with_context
+    def test_stats_are_read_from_the_task_runs_until_rebuilt(self):
+        """Test STATS_ROLLUPS the project stats are read from the task runs
+        while the rollups do not count all of them"""
+        task = TaskFactory.create(n_answers=2)
+        TaskRunFactory.create(task=task,
+                              finish_time='2015-01-20T10:15:00.000000')
+        AnonymousTaskRunFactory.create(
+            task=task, finish_time='2015-01-21T11:15:00.000000')
+        expected = (project_stats.stats_dates(task.app_id),
+                    project_stats.stats_hours(task.app_id))
+        db.session.query(AppStatsDay).delete()
+        db.session.query(AppStatsHour).delete()
+        db.session.commit()
+
+        assert stats_rollups.complete(task.app_id, db.session) is False
+        assert project_stats.stats_dates(task.app_id) == expected[0]
+        assert project_stats.stats_hours(task.app_id) == expected[1]
+
+    @with_context
+    @patch('pybossa.stats_rollups.REBUILD_CHUNK', new=2)
+    def test_rebuild_counts_the_existing_task_runs(self):
+        """Test STATS_ROLLUPS rebuild counts the task runs of a project in
+        chunks of tasks"""
+        app = AppFactory.create()
+        finish_time = '2015-01-20T23:59:00.000000'
+        for task in TaskFactory.create_batch(3, app=app, n_answers=1):
+            TaskRunFactory.create(task=task, finish_time=finish_time)
+        expected = self.rollups(app.id)
+        db.session.query(AppStatsDay).delete()
+        db.session.query(AppStatsHour).delete()
+        db.session.commit()
+
+        n_task_runs = stats_rollups.rebuild(app.id)
+
+        assert n_task_runs == 3, n_task_runs
+        assert self.rollups(app.id) == expected, self.rollups(app.id)
+        assert expected[0] == [(datetime.date(2015, 1, 20), 0, 3, 3)], expected
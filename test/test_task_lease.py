@@ -0,0 +1,150 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SF Isle of Man Limited
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import time
+from mock import patch
+from default import Test, db, flask_app, with_context
+from factories import (AppFactory, TaskFactory, AnonymousTaskRunFactory,
+                       UserFactory)
+from pybossa.model.task_run import TaskRun
+from pybossa import task_lease
+from pybossa import sched
+
+
+class TestTaskLease(Test):
+
+    @with_context
+    def test_n_leases_does_not_count_own_lease(self):
+        """Test TASK_LEASE n_leases only counts the leases of other users"""
+        task_lease.acquire([1, 2], 60, user_id=1)
+        task_lease.acquire([1], 60, user_ip='127.0.0.2')
+
+        leases = task_lease.n_leases([1, 2], user_id=1)
+
+        assert leases == {1: 1, 2: 0}, leases
+
+    @with_context
+    def test_n_leases_ignores_expired_leases(self):
+        """Test TASK_LEASE n_leases does not count expired leases"""
+        task_lease.acquire([1], 60, user_id=1)
+
+        with patch('pybossa.task_lease.time') as mock_time:
+            mock_time.time.return_value = time.time() + 61
+            leases = task_lease.n_leases([1], user_id=2)
+
+        assert leases == {1: 0}, leases
+
+    @with_context
+    def test_task_run_releases_lease(self):
+        """Test TASK_LEASE the lease is released when the task run is posted"""
+        task = TaskFactory.create()
+        task_lease.acquire([task.id], 60, user_ip='127.0.0.1')
+
+        AnonymousTaskRunFactory.create(task=task, user_ip='127.0.0.1')
+        leases = task_lease.n_leases([task.id], user_id=1)
+
+        assert leases == {task.id: 0}, leases
+
+    @with_context
+    def test_rolled_back_task_run_keeps_lease(self):
+        """Test TASK_LEASE the lease is kept if the task run is rolled back"""
+        task = TaskFactory.create(n_answers=1)
+        task_lease.acquire([task.id], 60, user_ip='127.0.0.1')
+
+        db.session.add(TaskRun(app_id=task.app_id, task_id=task.id,
+                               user_ip='127.0.0.1'))
+        db.session.flush()
+        db.session.rollback()
+        leases = task_lease.n_leases([task.id], user_id=1)
+
+        assert leases == {task.id: 1}, leases
+
+    @with_context
+    @patch.dict(flask_app.config, {'TASK_LEASE_TIMEOUT': 60})
+    def test_scheduler_skips_fully_leased_tasks(self):
+        """Test SCHED skips tasks whose leases cover the answers they need"""
+        app = AppFactory.create()
+        leased, free = TaskFactory.create_batch(2, app=app, n_answers=1)
+        task_lease.acquire([leased.id], 60, user_id=2)
+
+        task = sched.get_depth_first_task(app.id, user_id=1)
+
+        assert task.id == free.id, task
+
+    @with_context
+    @patch.dict(flask_app.config, {'TASK_LEASE_TIMEOUT': 60})
+    def test_every_scheduler_skips_fully_leased_tasks(self):
+        """Test SCHED skips the fully leased tasks with every scheduler,
+        including the ones that read the task pool"""
+        app = AppFactory.create()
+        leased, free = TaskFactory.create_batch(2, app=app, n_answers=1)
+        task_lease.acquire([leased.id], 60, user_id=2)
+
+        for scheduler in ['default', 'breadth_first', 'depth_first',
+                          'depth_first_pool', 'random', 'incremental']:
+            for i in range(5):
+                task = sched.new_task(app.id, scheduler, user_id=1)
+                assert task.id == free.id, (scheduler, task)
+
+    @with_context
+    @patch.dict(flask_app.config, {'TASK_LEASE_TIMEOUT': 60})
+    def test_scheduler_returns_leased_tasks_if_all_are_leased(self):
+        """Test SCHED returns a leased task if all the tasks are leased"""
+        app = AppFactory.create()
+        task = TaskFactory.create(app=app, n_answers=1)
+        task_lease.acquire([task.id], 60, user_id=2)
+
+        out = sched.get_depth_first_task(app.id, user_id=1)
+
+        assert out.id == task.id, out
+
+    @with_context
+    @patch.dict(flask_app.config, {'TASK_LEASE_TIMEOUT': 60})
+    def test_newtask_leases_the_task(self):
+        """Test API newtask records a lease for the returned task, so another
+        user gets the other task"""
+        app = AppFactory.create()
+        task = TaskFactory.create(app=app, n_answers=1)
+        other = TaskFactory.create(app=app, n_answers=1)
+        user = UserFactory.create()
+
+        res = self.app.get('api/app/%s/newtask' % app.id)
+        data = json.loads(res.data)
+        leases = task_lease.n_leases([task.id], user_id=user.id)
+        res = self.app.get('api/app/%s/newtask?api_key=%s' % (app.id,
+                                                               user.api_key))
+        other_data = json.loads(res.data)
+
+        assert data['id'] == task.id, data
+        assert leases == {task.id: 1}, leases
+        assert other_data['id'] == other.id, other_data
+
+    @with_context
+    def test_leases_are_disabled_by_default(self):
+        """Test TASK_LEASE newtask records no lease and the schedulers do not
+        skip leased tasks unless TASK_LEASE_TIMEOUT is set"""
+        app = AppFactory.create()
+        task = TaskFactory.create(app=app, n_answers=1)
+        TaskFactory.create(app=app, n_answers=1)
+        task_lease.acquire([task.id], 60, user_id=2)
+
+        res = self.app.get('api/app/%s/newtask' % app.id)
+
+        assert json.loads(res.data)['id'] == task.id, res.data
+        assert task_lease.n_leases([task.id], user_id=2) == {task.id: 0}
@@ -0,0 +1,197 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SF Isle of Man Limited
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+
+from mock import patch
+from default import Test, sentinel, with_context
+from factories import (AppFactory, TaskFactory, TaskRunFactory,
+                       AnonymousTaskRunFactory, UserFactory)
+from factories import task_repo
+from pybossa import task_pool
+from pybossa import sched
+
+
+class TestTaskPool(Test):
+
+    def create_app_with_priorities(self, priorities):
+        app = AppFactory.create()
+        for priority in priorities:
+            TaskFactory.create(app=app, priority_0=priority)
+        return app
+
+    @with_context
+    def test_candidates_same_order_as_get_candidate_tasks(self):
+        """Test TASK_POOL candidates are sorted by priority and id as
+        get_candidate_tasks does"""
+        app = self.create_app_with_priorities([0, 0.5, 1, 0.5, 0])
+
+        expected = [t.id for t in sched.get_candidate_tasks(app.id, user_id=1)]
+        candidates = task_pool.candidates(app.id, user_id=1)
+
+        assert candidates == expected, (candidates, expected)
+
+    @with_context
+    def test_candidates_ignores_tasks_answered_by_user(self):
+        """Test TASK_POOL candidates does not return tasks already answered
+        by the user"""
+        app = self.create_app_with_priorities([1, 0])
+        user = UserFactory.create()
+        task = task_repo.get_task_by(app_id=app.id, priority_0=1)
+        TaskRunFactory.create(task=task, user=user)
+
+        candidates = task_pool.candidates(app.id, user_id=user.id)
+
+        assert task.id not in candidates, candidates
+        assert len(candidates) == 1, candidates
+
+    @with_context
+    def test_candidates_ignores_tasks_answered_after_seeding(self):
+        """Test TASK_POOL candidates keeps track of new answers once the
+        pool is seeded"""
+        app = self.create_app_with_priorities([1, 0])
+        task = task_repo.get_task_by(app_id=app.id, priority_0=1)
+        task_pool.candidates(app.id, user_ip='127.0.0.1')
+
+        AnonymousTaskRunFactory.create(task=task, user_ip='127.0.0.1')
+        candidates = task_pool.candidates(app.id, user_ip='127.0.0.1')
+
+        assert task.id not in candidates, candidates
+
+    @with_context
+    def test_candidates_ignores_completed_tasks(self):
+        """Test TASK_POOL candidates does not return tasks completed after
+        the pool is seeded"""
+        app = AppFactory.create()
+        task = TaskFactory.create(app=app, n_answers=1)
+        task_pool.candidates(app.id, user_id=1)
+
+        AnonymousTaskRunFactory.create(task=task)
+        candidates = task_pool.candidates(app.id, user_id=1)
+
+        assert candidates == [], candidates
+
+    @with_context
+    def test_candidates_keeps_track_of_new_tasks(self):
+        """Test TASK_POOL candidates returns tasks created after the pool is
+        seeded"""
+        app = self.create_app_with_priorities([0])
+        task_pool.candidates(app.id, user_id=1)
+
+        task = TaskFactory.create(app=app, priority_0=1)
+        candidates = task_pool.candidates(app.id, user_id=1)
+
+        assert candidates[0] == task.id, candidates
+
+    @with_context
+    def test_update_tasks_redundancy_resets_the_pool(self):
+        """Test TASK_POOL is seeded again when tasks are updated in bulk"""
+        app = AppFactory.create()
+        task = TaskFactory.create(app=app, n_answers=2)
+        AnonymousTaskRunFactory.create(task=task)
+        task_pool.candidates(app.id, user_id=1)
+
+        task_repo.update_tasks_redundancy(app, 1)
+        candidates = task_pool.candidates(app.id, user_id=1)
+
+        assert candidates == [], candidates
+
+    @with_context
+    def test_depth_first_pool_returns_same_task_as_depth_first(self):
+        """Test SCHED depth_first_pool returns the same tasks as depth_first"""
+        app = self.create_app_with_priorities([0, 0.5, 1, 0.5, 0])
+
+        for offset in range(6):
+            expected = sched.new_task(app.id, 'depth_first', user_id=1,
+                                      offset=offset)
+            task = sched.new_task(app.id, 'depth_first_pool', user_id=1,
+                                  offset=offset)
+            if expected is None:
+                assert task is None, task
+            else:
+                assert task.id == expected.id, (task, expected)
+
+    @with_context
+    def test_candidates_are_read_from_the_db_while_seeding(self):
+        """Test SCHED depth_first_pool reads the candidates from the DB while
+        another worker builds the pool"""
+        app = self.create_app_with_priorities([0, 1])
+        sentinel.master.set(task_pool.POOL_LOCK_KEY % app.id, 'building')
+
+        task = sched.new_task(app.id, 'depth_first_pool', user_id=1)
+
+        assert task_pool.candidates(app.id, user_id=1) is None
+        assert task.priority_0 == 1, task
+        assert not sentinel.master.exists(task_pool.POOL_SEEDED_KEY % app.id)
+
+    @with_context
+    def test_tasks_added_while_seeding_are_kept(self):
+        """Test TASK_POOL adds the tasks created while the pool is built to
+        the new pool too"""
+        app = AppFactory.create()
+        sentinel.master.set(task_pool.POOL_LOCK_KEY % app.id, 'building')
+
+        TaskFactory.create(app=app)
+
+        assert sentinel.master.zcard('building') == 1
+        assert not sentinel.master.exists(task_pool.POOL_KEY % app.id)
+
+    @with_context
+    def test_failed_seeding_is_not_marked_as_seeded(self):
+        """Test TASK_POOL does not flag a pool as seeded nor keep the lock if
+        building it fails"""
+        app = self.create_app_with_priorities([0])
+
+        with patch('pybossa.task_pool._score', side_effect=IOError):
+            self.assertRaises(IOError, task_pool.candidates, app.id, user_id=1)
+
+        assert not sentinel.master.exists(task_pool.POOL_SEEDED_KEY % app.id)
+        assert not sentinel.master.exists(task_pool.POOL_LOCK_KEY % app.id)
+        assert task_pool.candidates(app.id, user_id=1) != []
+
+    @with_context
+    def test_depth_first_pool_keeps_tasks_missing_from_the_db(self):
+        """Test SCHED depth_first_pool skips the pool tasks it cannot load,
+        e.g. as the replica lags behind, without removing them"""
+        app = self.create_app_with_priorities([0])
+        task_pool.candidates(app.id, user_id=1)
+        missing_id = 1000
+        task_pool.add_task(app.id, missing_id, priority_0=1)
+
+        task = sched.new_task(app.id, 'depth_first_pool', user_id=1)
+
+        assert task is not None and task.id != missing_id, task
+        assert missing_id in task_pool.candidates(app.id, user_id=1)
+
+    @with_context
+    def test_seeding_stops_if_the_lock_is_lost(self):
+        """Test TASK_POOL drops the pool being built if its lock is lost, e.g.
+        after a reset, instead of marking it as seeded"""
+        app = self.create_app_with_priorities([0, 1])
+        lock_key = task_pool.POOL_LOCK_KEY % app.id
+
+        def member(task_id):
+            sentinel.master.delete(lock_key)
+            return '%012d' % task_id
+
+        with patch('pybossa.task_pool.SEED_CHUNK', 1):
+            with patch('pybossa.task_pool._member', side_effect=member):
+                candidates = task_pool.candidates(app.id, user_id=1)
+
+        assert candidates is None, candidates
+        assert not sentinel.master.exists(task_pool.POOL_SEEDED_KEY % app.id)
+        assert sentinel.master.keys(task_pool.POOL_TMP_KEY % (app.id, '*')) \
+            == []
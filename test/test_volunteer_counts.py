@@ -0,0 +1,116 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SF Isle of Man Limited
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+
+from mock import patch
+from default import Test, db, flask_app, sentinel, with_context
+from factories import AppFactory, TaskFactory, TaskRunFactory, UserFactory
+from factories import AnonymousTaskRunFactory
+from pybossa import volunteer_counts
+from pybossa.cache import apps as cached_apps, site_stats
+
+
+class TestVolunteerCounts(Test):
+
+    @with_context
+    @patch.dict(flask_app.config, {'APPROXIMATE_VOLUNTEER_COUNTS': True})
+    def test_counts_are_seeded_and_fed_by_the_task_runs(self):
+        """Test VOLUNTEER COUNTS seeds the counters from the task runs and
+        adds the new volunteers"""
+        app = AppFactory.create()
+        tasks = TaskFactory.create_batch(2, app=app)
+        user = UserFactory.create()
+        for task in tasks:
+            TaskRunFactory.create(task=task, user=user)
+            AnonymousTaskRunFactory.create(task=task, user_ip='10.0.0.1')
+        assert volunteer_counts.count(volunteer_counts.AUTH, app.id) == 1
+        assert volunteer_counts.count(volunteer_counts.ANON, app.id) == 1
+
+        AnonymousTaskRunFactory.create(task=tasks[0], user_ip='10.0.0.2')
+        TaskRunFactory.create(task=tasks[0])
+
+        assert volunteer_counts.count(volunteer_counts.AUTH, app.id) == 2
+        assert volunteer_counts.count(volunteer_counts.ANON, app.id) == 2
+        assert volunteer_counts.count(volunteer_counts.ANON) == 2
+        assert volunteer_counts.count_many(volunteer_counts.AUTH,
+                                           [app.id, app.id + 1]) == [2, 0]
+
+    @with_context
+    @patch.dict(flask_app.config, {'APPROXIMATE_VOLUNTEER_COUNTS': True})
+    def test_deleted_task_runs_reseed_the_counters(self):
+        """Test VOLUNTEER COUNTS forgets the volunteers of deleted task
+        runs"""
+        app = AppFactory.create()
+        task_runs = [AnonymousTaskRunFactory.create(app=app, task__app=app,
+                                                    user_ip=ip)
+                     for ip in ('10.0.0.1', '10.0.0.2')]
+        assert volunteer_counts.count(volunteer_counts.ANON, app.id) == 2
+
+        db.session.delete(task_runs[0])
+        db.session.commit()
+
+        assert volunteer_counts.count(volunteer_counts.ANON, app.id) == 1
+
+    @with_context
+    @patch.dict(flask_app.config, {'APPROXIMATE_VOLUNTEER_COUNTS': True})
+    def test_cached_counts_use_the_counters(self):
+        """Test CACHE APPS and SITE STATS read the volunteer counters when
+        APPROXIMATE_VOLUNTEER_COUNTS is enabled"""
+        app = AppFactory.create()
+        AnonymousTaskRunFactory.create(app=app, task__app=app)
+        TaskRunFactory.create(app=app, task__app=app)
+
+        with patch('pybossa.cache.apps.session') as session:
+            assert cached_apps.n_volunteers(app.id) == 2
+            assert cached_apps.n_registered_volunteers.many([app.id]) == [1]
+            assert not session.execute.called
+        assert site_stats.n_anon_users() == 1
+
+    @with_context
+    @patch.dict(flask_app.config, {'APPROXIMATE_VOLUNTEER_COUNTS': True})
+    def test_counts_are_read_from_the_db_while_seeding(self):
+        """Test VOLUNTEER COUNTS counts the volunteers in the task_run table
+        while another worker builds the counter"""
+        app = AppFactory.create()
+        lock_key = volunteer_counts.COUNTER_LOCK_KEY % ('app:%s' % app.id,
+                                                       volunteer_counts.ANON)
+        sentinel.master.set(lock_key, 'building')
+
+        AnonymousTaskRunFactory.create(app=app, task__app=app)
+
+        assert volunteer_counts.count(volunteer_counts.ANON, app.id) == 1
+        assert volunteer_counts.count_many(volunteer_counts.ANON,
+                                           [app.id]) == [1]
+        # The volunteers posted meanwhile are added to the new counter
+        assert sentinel.master.execute_command('PFCOUNT', 'building') == 1
+
+    @with_context
+    @patch.dict(flask_app.config, {'APPROXIMATE_VOLUNTEER_COUNTS': True})
+    def test_failed_seeding_is_not_marked_as_seeded(self):
+        """Test VOLUNTEER COUNTS does not flag a counter as seeded nor keep
+        the lock if building it fails"""
+        app = AppFactory.create()
+        scope = 'app:%s' % app.id
+
+        with patch('pybossa.volunteer_counts._pfadd', side_effect=IOError):
+            self.assertRaises(IOError, volunteer_counts.count,
+                              volunteer_counts.AUTH, app.id)
+
+        for key in (volunteer_counts.COUNTER_SEEDED_KEY,
+                    volunteer_counts.COUNTER_LOCK_KEY):
+            assert not sentinel.master.exists(key % (scope,
+                                                     volunteer_counts.AUTH))
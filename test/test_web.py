@@ -70,6 +70,18 @@ class TestWeb(web.Helper):
         assert self.html_title() in res.data, res
         assert "Create a Project" in res.data, res
 
+    @with_context
+    def test_01_index_cache_debug_headers(self):
+        """Test WEB responses have the cache debug headers if enabled"""
+        with patch.dict(self.flask_app.config, {'CACHE_DEBUG_HEADERS': True}):
+            res = self.app.get("/", follow_redirects=True)
+
+        assert int(res.headers['X-Cache-Redis-Calls']) > 0, res.headers
+        assert 'X-Cache-Memo-Hits' in res.headers, res.headers
+
+        res = self.app.get("/", follow_redirects=True)
+        assert 'X-Cache-Redis-Calls' not in res.headers, res.headers
+
     @with_context
     def test_01_search(self):
         """Test WEB search page works."""